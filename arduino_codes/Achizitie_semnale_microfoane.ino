@@ -1,6 +1,12 @@
 
 
  #define FASTADC 1
+// 1: send binary frames (sync word, sequence counter, four uint16 samples)
+// 0: send one ASCII voltage per line
+#define BINARY_FRAMES 0
+// 1: in ASCII mode, print a "#" line before the first channel of each frame
+#define FRAME_MARKERS 0
+#define SYNC_WORD 0xA55A
 #ifndef cbi
 #define cbi(sfr, bit) (_SFR_BYTE(sfr) &= ~_BV(bit))
 #endif
@@ -8,6 +14,7 @@
 #define sbi(sfr, bit) (_SFR_BYTE(sfr) |= _BV(bit))
 #endif
 int i=0;
+uint16_t seq=0;
 void setup() {
 #if FASTADC
   // set prescale to 16
@@ -18,6 +25,17 @@ Serial.begin(115200);
 }
 void loop() {
   // put your main code here, to run repeatedly:
+#if BINARY_FRAMES
+      uint16_t frame[6];
+      frame[0] = SYNC_WORD;
+      frame[1] = seq++;
+      frame[2] = analogRead(A0);
+      frame[3] = analogRead(A1);
+      frame[4] = analogRead(A2);
+      frame[5] = analogRead(A3);
+      // AVR and ESP32 are little endian, matching the PC side decoder
+      Serial.write((uint8_t*)frame, sizeof(frame));
+#else
       float sensorValue1 = analogRead(A0);
       float t1=5.*sensorValue1/1024.;
       float sensorValue2 = analogRead(A1);
@@ -26,6 +44,9 @@ void loop() {
       float t3=5.*sensorValue3/1024.;
       float sensorValue4 = analogRead(A3);
       float t4=5.*sensorValue4/1024.;
+#if FRAME_MARKERS
+        Serial.println("#");
+#endif
         //Serial.println("Senzor1");
         Serial.println(t1);
          // Serial.println("Senzor2");
@@ -34,6 +55,6 @@ void loop() {
         Serial.println(t3);
           //Serial.println("Senzor4");
         Serial.println(t4);
-         
+#endif
 }
         
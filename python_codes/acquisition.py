@@ -0,0 +1,282 @@
+"""Continuous acquisition into a ring buffer with pre/post-trigger capture.
+
+A reader thread keeps pulling samples from a :class:`sources.SampleSource`
+(normally the serial port) into a preallocated ring buffer, whatever the
+consumers are doing.  Whenever a
+sample exceeds the trigger threshold, the window ``[trigger - pre,
+trigger + post)`` is copied out of the ring buffer once the post-trigger
+samples have arrived and handed to the consumers as a :class:`CaptureEvent`.
+Memory use is bounded by the ring buffer and the size of the event queue.
+"""
+
+import queue
+import threading
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+import metrics
+from serial_protocol import CHANNELS
+from sources import DEFAULT_FS, SampleSource, SerialSource
+
+
+class CaptureEvent(NamedTuple):
+    """Samples around one trigger.
+
+    Attributes
+    ----------
+    samples : numpy.ndarray
+        ``(channels, N)`` voltages, a copy independent of the ring buffer.
+    trigger_index : int
+        Column of ``samples`` holding the trigger sample.
+    start : int
+        Absolute index (since acquisition start) of the first sample.
+    amplitude : float
+        Largest voltage of the trigger sample.
+    timestamp : float
+        Host time (``time.time()``) of the trigger sample.
+    """
+
+    samples: np.ndarray
+    trigger_index: int
+    start: int
+    amplitude: float
+    timestamp: float
+
+
+class RingBuffer:
+    """Fixed-size ``(channels, capacity)`` buffer of the most recent samples.
+
+    Samples are addressed by their absolute index since the first write;
+    only the last ``capacity`` of them are available.
+    """
+
+    def __init__(self, channels, capacity, dtype=float):
+        self.capacity = capacity
+        self._data = np.zeros((channels, capacity), dtype=dtype)
+        self.total = 0
+
+    def write(self, block):
+        """Append a ``(channels, n)`` block."""
+        n = block.shape[1]
+        if n > self.capacity:
+            block = block[:, -self.capacity :]
+            self.total += n - self.capacity
+            n = self.capacity
+        start = self.total % self.capacity
+        first = min(n, self.capacity - start)
+        self._data[:, start : start + first] = block[:, :first]
+        self._data[:, : n - first] = block[:, first:]
+        self.total += n
+
+    def snapshot(self, start, stop):
+        """Return a copy of the samples with absolute indices ``[start, stop)``."""
+        if start < self.total - self.capacity or stop > self.total or start > stop:
+            raise IndexError("Requested samples are not in the ring buffer")
+        idx = np.arange(start, stop) % self.capacity
+        return self._data[:, idx]
+
+
+class AcquisitionEngine:
+    """Read a sample stream continuously and emit triggered captures.
+
+    Parameters
+    ----------
+    ser : SampleSource, serial.Serial or file-like
+        Source of the samples.  A port is wrapped in a
+        :class:`sources.SerialSource`; its ``read(n)`` should return within a
+        short timeout so that :meth:`stop` can end the reader thread.
+    fs : float, optional
+        Per-channel sampling frequency in Hz, by default the source's, or
+        ``sources.DEFAULT_FS`` if the source does not tell it.
+    threshold : float, optional
+        Trigger level in volts; any channel above it triggers.
+    pre, post : int, optional
+        Samples kept before and after the trigger sample.
+    binary : bool, optional
+        Expect binary frames (:class:`serial_protocol.FrameDecoder`) instead
+        of ASCII lines when ``ser`` is a port.
+    capacity : int, optional
+        Ring buffer length; at least ``2 * (pre + post)`` plus one read.
+    max_events : int, optional
+        Captures waiting for a consumer.  When the queue is full the oldest
+        capture is discarded and counted in ``dropped_events``.
+    chunk_frames : int, optional
+        Frames requested per read from a port, and the block size assumed
+        for sources that do not tell theirs (``block_frames``).
+    block_filter : callable, optional
+        Applied to every ``(channels, n)`` block before it is stored, e.g. a
+        :class:`signal_filter.BandpassFilter`.  The trigger threshold then
+        applies to the filtered samples.
+    """
+
+    def __init__(
+        self,
+        ser,
+        fs=None,
+        threshold=1.75,
+        pre=200,
+        post=200,
+        binary=False,
+        channels=CHANNELS,
+        capacity=None,
+        max_events=16,
+        chunk_frames=256,
+        block_filter=None,
+    ):
+        if not isinstance(ser, SampleSource):
+            ser = SerialSource(ser, fs, binary, channels, chunk_frames)
+        self.source = ser
+        if fs is None:
+            fs = DEFAULT_FS if ser.fs is None else ser.fs
+        self.fs = fs
+        self.threshold = threshold
+        self.pre = pre
+        self.post = post
+        self.channels = ser.channels
+        self.block_filter = block_filter
+        # longer blocks are processed in pieces, so that a capture window
+        # is never overwritten before it is emitted
+        self.max_block = ser.block_frames or chunk_frames
+        minimum = 2 * (pre + post) + 2 * self.max_block
+        self.ring = RingBuffer(ser.channels, max(capacity or 0, minimum))
+        self.events = queue.Queue(maxsize=max_events)
+        self.dropped_events = 0
+        self.error = None
+        self.finished = False
+        self._pending = []
+        self._holdoff = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, timeout=1.0):
+        """Start the reader thread.
+
+        The outcome of a previous run (``error``, ``finished``) is cleared,
+        so an engine stopped by a failure can be started again.  A thread
+        still finishing after :meth:`stop` is waited for up to ``timeout``
+        seconds; ``RuntimeError`` is raised if it is still alive then.
+        """
+        if self._thread is not None:
+            if self._thread.is_alive() and not self._stop.is_set():
+                return
+            # a stopped reader may still be blocked in its last read
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                raise RuntimeError("The previous acquisition thread has not exited yet")
+            self._thread = None
+        self.error = None
+        self.finished = False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="acquisition", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        """Stop the reader thread.
+
+        The thread is kept until it has exited, even if that takes longer
+        than ``timeout``, so that it is never run twice.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if not self._thread.is_alive():
+                self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def get_event(self, timeout=None):
+        """Return the next :class:`CaptureEvent` or ``None`` on timeout."""
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def poll(self):
+        """Read and process one block; return ``False`` once the source is exhausted."""
+        block = self.source.read_block()
+        if block is None:
+            self.finished = True
+            return False
+        self.process_block(block, time.time())
+        return True
+
+    def wait_event(self):
+        """Return the next capture, reading the source in the calling thread.
+
+        For use without :meth:`start`; returns ``None`` if the source ends
+        first.
+        """
+        while self.events.empty():
+            if not self.poll():
+                return None
+        return self.events.get_nowait()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set() and self.poll():
+                pass
+        except Exception as exc:  # reported to the consumer through ``error``
+            self.error = exc
+
+    def process_block(self, block, arrival=None):
+        """Store a ``(channels, n)`` block of voltages and emit due captures.
+
+        Called by the reader thread; also usable directly to feed samples
+        from another source.
+        """
+        n = block.shape[1]
+        if not n:
+            return
+        arrival = time.time() if arrival is None else arrival
+        if n > self.max_block:
+            for i in range(0, n, self.max_block):
+                piece = block[:, i : i + self.max_block]
+                self.process_block(piece, arrival - (n - i - piece.shape[1]) / self.fs)
+            return
+        metrics.count("samples", n)
+        if self.block_filter is not None:
+            with metrics.stage("filter"):
+                block = self.block_filter(block)
+        first = self.ring.total
+        self.ring.write(block)
+        hits = np.flatnonzero((block > self.threshold).any(axis=0)) + first
+        hits = hits[hits >= self._holdoff]
+        while len(hits):
+            trig = int(hits[0])
+            amp = float(block[:, trig - first].max())
+            stamp = arrival - (self.ring.total - 1 - trig) / self.fs
+            self._pending.append((trig, amp, stamp))
+            # captures do not overlap: the next trigger comes after this window
+            self._holdoff = trig + self.post
+            hits = hits[hits >= self._holdoff]
+        while self._pending and self._pending[0][0] + self.post <= self.ring.total:
+            self._emit(*self._pending.pop(0))
+
+    def _emit(self, trig, amp, stamp):
+        start = max(trig - self.pre, self.ring.total - self.ring.capacity, 0)
+        event = CaptureEvent(
+            self.ring.snapshot(start, trig + self.post), trig - start, start, amp, stamp
+        )
+        metrics.count("events")
+        while True:
+            try:
+                self.events.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.events.get_nowait()
+                    self.dropped_events += 1
+                    metrics.count("dropped_events")
+                except queue.Empty:
+                    pass
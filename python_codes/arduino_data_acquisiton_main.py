@@ -1,72 +1,86 @@
-import serial
 import datetime
 from datetime import datetime
 import timeit
 import compute_correlation
-from tdoa import tdoa
-from data_visualization import draw_fig_real_time, plot_3d_coordinates
+from tdoa import TdoaSolver
+from data_visualization import LivePlot, plot_3d_coordinates
 import numpy as np
 import matplotlib.pyplot as plt
 import sys
+from serial_protocol import CHANNELS
+from sources import ReplaySource, SerialSource, SyntheticSource
+import metrics
 
 if __name__ == "__main__":
-    data = []
     # Reference microphone
     x=[0,0.17,0.17,0.72]
     y=[0,0,0.85,0.61]
     z=[0,0,0,0.13]
-    port = sys.argv[1] if len(sys.argv) > 1 else 'COM6'
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    port = args[0] if args else 'COM6'
+    # ``--binary`` expects the framed protocol of ``serial_protocol``
+    binary = "--binary" in sys.argv
+    # ``--metrics`` prints the time spent in each stage at the end
+    if "--metrics" in sys.argv:
+        metrics.enable()
     print(f"start (using port {port})")
-    ser = serial.Serial(port, baudrate=115200)
+    # ``--synthetic`` and ``--replay=<archive dir>`` run without the hardware
+    replay = [a.split("=", 1)[1] for a in sys.argv[1:] if a.startswith("--replay=")]
+    if replay:
+        source = ReplaySource(replay[0], gap=200, speed=1.0)
+    elif "--synthetic" in sys.argv:
+        source = SyntheticSource(speed=1.0)
+    else:
+        source = SerialSource(port, binary=binary)
     dateTimeObj=datetime.now()
     start = timeit.default_timer()
     # Read data until you find a signal amplitude value greater than 1.75 V
-    while True :
-        x = ser.readline()
-        data.append(x)
-        draw_fig_real_time(data)
-        print(x)
-        if x[0] in "123" and  x[1] == "." and  x[2] in "0123456789" and  x[3] in "0123456789" and len(x)==6:
-            if x > '1.75' and x < '3.3':
-                print('We detected a signal source at time: {} and the signal amplitude value is: {}.'.format(dateTimeObj,x))
-                i=0
-                while i < 50:
-                    "Continue reading data 50 iterations after the source is detected. "
-                    x=ser.readline()
-                    data.append(x)
-                    print(x)
-                    i=i+1
-                break
-    ser.close()
+    plt.ion()
+    live_fig, live_ax = plt.subplots()
+    live_ax.set(title='Semnal audio in timp real', xlabel='Timp', ylabel='Amplitudine')
+    live_ax.grid(True)
+    live = LivePlot(live_ax, window=2000, channels=source.channels)
+    plt.show()
+    blocks = []
+    for volts in source:
+        blocks.append(volts)
+        live.append(volts)
+        if live.refresh():
+            live_fig.canvas.flush_events()
+        hits = np.flatnonzero((volts > 1.75).any(axis=0))
+        if len(hits):
+            print('We detected a signal source at time: {} and the signal amplitude value is: {}.'.format(dateTimeObj, volts[:, hits[0]].max()))
+            # Continue reading 50 samples after the source is detected.
+            missing = -(-50 // CHANNELS) - (volts.shape[1] - hits[0] - 1)
+            while missing > 0:
+                volts = source.read_block()
+                if volts is None:
+                    break
+                blocks.append(volts[:, :missing])
+                missing -= volts.shape[1]
+            break
+    sigs = np.concatenate(blocks, axis=1)
+    source.close()
+    plt.ioff()
     stop = timeit.default_timer()
     time = stop - start
     print("stop");
-    s1, s2, s3, s4 = [], [], [], []
-    for j in range(len(data)-3):
-        s4.append(data[j])
-        s1.append(data[j+1])
-        s2.append(data[j+2])
-        s3.append(data[j+3])
-    s11 = np.array(s1)
-    s22 = np.array(s2)
-    s33 = np.array(s3)
-    s44 = np.array(s4)
-    fes = len(data)/time
+    fes = sigs.shape[1]/time
     fig, axs = plt.subplots(2, 2)
-    axs[0, 0].plot(s1)
-    axs[0, 0].set_title('signal purchased by microphone 1')
-    axs[0, 1].plot(s2)
-    axs[0, 1].set_title('signal purchased by microphone 2')
-    axs[1, 0].plot(s3)
-    axs[1, 0].set_title('signal purchased by microphone 3')
-    axs[1, 1].plot(s4)
-    axs[1, 1].set_title('signal purchased by microphone 4')
+    for k, (ax, sig) in enumerate(zip(axs.flat, sigs)):
+        ax.plot(sig)
+        ax.set_title('signal purchased by microphone {}'.format(k + 1))
     for ax in axs.flat:
         ax.set(xlabel='Samples', ylabel='Amplitude')
         ax.set_ylim([0, 3])
     plt.show()
-    (td1,td2,td3) = compute_correlation.corelatia(s1,s2,s3,s4,fes)
-    (xs,ys,zs)= tdoa(td1,td2,td3)
+    with metrics.stage("detect.correlation"):
+        (td1,td2,td3) = compute_correlation.corelatia(sigs,fes)
+    solver = TdoaSolver(x, y, z)
+    with metrics.stage("tdoa"):
+        (xs,ys,zs)= solver.localize(td1,td2,td3)
+    if metrics.enabled():
+        metrics.dump(sys.stdout)
     plot_3d_coordinates(xs,ys,zs)
 
 
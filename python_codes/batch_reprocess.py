@@ -0,0 +1,274 @@
+"""Reprocess archived captures with a grid of methods and parameters.
+
+Every combination of method, method parameters and optional band-pass
+filter is run on every capture of a :class:`capture_archive.CaptureArchive`,
+spread over all cores with a :class:`concurrent.futures.ProcessPoolExecutor`::
+
+    python batch_reprocess.py captures/ results.npz --methods=wavelet,dpe \\
+        --wavelet.threshold=0.4,0.6 --dpe.level=0.3,0.35 --band=none,20-200
+
+The captures are loaded once into a :class:`multiprocessing.shared_memory.SharedMemory`
+block that the workers map, so tasks only carry capture indices.  The block
+holds the archived integer counts, converted to volts by the worker.  Results
+(delays, coordinates and the time spent filtering, estimating the delays and
+solving for the position) are written as columns of an ``.npz`` file; the
+``(config, capture_id)`` pairs already present in it are skipped when the
+command is run again.
+"""
+
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+from scipy import signal
+
+from capture_archive import CaptureArchive
+from detectors import available, detector_class, get_detector
+from signal_filter import butter_bandpass_sos
+from tdoa import TdoaSolver
+
+# Used for captures archived without a geometry, as in ``tk_app``
+MIC_X = [0, 0.17, 0.17, 0.72]
+MIC_Y = [0, 0, 0.85, 0.61]
+MIC_Z = [0, 0, 0, 0.13]
+
+COLUMNS = (
+    "capture_id", "config", "method", "params", "band",
+    "td12", "td13", "td14", "x", "y", "z",
+    "t_filter", "t_delays", "t_solve",
+)
+
+
+def _bandpass(sigs, fs, band):
+    lo, hi = band
+    sos = butter_bandpass_sos(lo, min(hi, 0.49 * fs), fs, order=4)
+    return signal.sosfiltfilt(sos, sigs, axis=-1)
+
+
+# State of a worker process, set by ``_init_worker``
+_worker = {}
+
+
+def _init_worker(shm_name, shape, dtype, offsets, scale, fs, geometry):
+    # the methods import these on first use; load them now so that the
+    # import is not counted in the time of the first capture
+    import pywt  # noqa: F401
+    from scipy import fft  # noqa: F401
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker["shm"] = shm
+    _worker["samples"] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _worker["offsets"] = offsets
+    _worker["scale"] = scale
+    _worker["fs"] = fs
+    _worker["geometry"] = geometry
+    _worker["solvers"] = {}
+    _worker["detectors"] = {}
+
+
+def _solver(geometry):
+    key = geometry.tobytes()
+    if key not in _worker["solvers"]:
+        _worker["solvers"][key] = TdoaSolver(*geometry.T)
+    return _worker["solvers"][key]
+
+
+def _detector(config, geometry):
+    # kept for the whole run, with their prepared per-length artifacts
+    key = (config["key"], geometry.tobytes())
+    if key not in _worker["detectors"]:
+        _worker["detectors"][key] = get_detector(config["method"], geometry, **config["params"])
+    return _worker["detectors"][key]
+
+
+def _run_task(config, indices):
+    """Process the captures at ``indices`` with one configuration."""
+    band = config["band"]
+    rows = []
+    for i in indices:
+        counts = _worker["samples"][:, _worker["offsets"][i] : _worker["offsets"][i + 1]]
+        sigs = counts * _worker["scale"][i]
+        fs = float(_worker["fs"][i])
+        geometry = _worker["geometry"][i]
+        t0 = time.perf_counter()
+        if band is not None:
+            sigs = _bandpass(sigs, fs, band)
+        t1 = time.perf_counter()
+        try:
+            result = _detector(config, geometry).detect(sigs, fs)
+            td = result.delays
+            t2 = time.perf_counter()
+            pos = result.position
+            if result.rejected:
+                pos = (np.nan,) * 3
+            elif pos is None:
+                pos = _solver(geometry).localize(*td)
+        except Exception:
+            # a failing capture is recorded as NaN instead of aborting the batch
+            td, pos = (np.nan,) * 3, (np.nan,) * 3
+            t2 = time.perf_counter()
+        t3 = time.perf_counter()
+        rows.append((i, *td, *pos, t1 - t0, t2 - t1, t3 - t2))
+    return config, rows
+
+
+def parameter_grid(methods, params=None, bands=(None,)):
+    """Return the list of configurations to run.
+
+    ``params`` maps a method to ``{name: [values]}``; every combination of
+    the values is combined with every band (``(lo, hi)`` in Hz or ``None``).
+    Unknown methods or parameters raise at once rather than in the workers.
+    """
+    params = params or {}
+    # ``(20, 200)`` and ``(20.0, 200.0)`` must give the same key
+    bands = [None if band is None else tuple(float(f) for f in band) for band in bands]
+    configs = []
+    for method in methods:
+        names = sorted(params.get(method, {}))
+        unknown = set(names) - set(detector_class(method).params)
+        if unknown:
+            raise TypeError(f"{method} got unexpected parameters: {', '.join(sorted(unknown))}")
+        values = [params[method][name] for name in names]
+        for combo in itertools.product(*values):
+            for band in bands:
+                config = {"method": method, "params": dict(zip(names, combo)), "band": band}
+                config["key"] = json.dumps(config, sort_keys=True)
+                configs.append(config)
+    return configs
+
+
+def load_results(path):
+    """Return the columns of a results file, empty columns if it does not exist."""
+    if not os.path.exists(path):
+        columns = {name: np.empty(0) for name in COLUMNS}
+        columns["capture_id"] = np.empty(0, dtype=np.int64)
+        for name in ("config", "method", "params", "band"):
+            columns[name] = np.empty(0, dtype=str)
+        return columns
+    with np.load(path) as data:
+        return {name: data[name] for name in COLUMNS}
+
+
+def _save_results(path, columns):
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, **columns)
+    os.replace(tmp, path)
+
+
+def _append(columns, batches):
+    """Return ``columns`` extended with the ``(config, rows)`` pairs of ``batches``."""
+    parts = {name: [columns[name]] for name in COLUMNS}
+    for config, rows in batches:
+        rows = np.array(rows, dtype=float).reshape(-1, 10)
+        n = len(rows)
+        parts["capture_id"].append(rows[:, 0].astype(np.int64))
+        parts["config"].append(np.full(n, config["key"]))
+        parts["method"].append(np.full(n, config["method"]))
+        parts["params"].append(np.full(n, json.dumps(config["params"], sort_keys=True)))
+        parts["band"].append(np.full(n, "none" if config["band"] is None else "%g-%g" % tuple(config["band"])))
+        for k, name in enumerate(COLUMNS[5:], start=1):
+            parts[name].append(rows[:, k])
+    return {name: np.concatenate(parts[name]) for name in COLUMNS}
+
+
+def reprocess(archive, output, configs, capture_ids=None, workers=None, chunk=32, save_every=5.0):
+    """Run ``configs`` on the captures of ``archive`` and store the results in ``output``.
+
+    Returns the number of ``(config, capture)`` results computed.
+    """
+    if isinstance(archive, str):
+        archive = CaptureArchive(archive)
+    capture_ids = list(range(len(archive)) if capture_ids is None else capture_ids)
+    columns = load_results(output)
+    done = set(zip(columns["config"].tolist(), columns["capture_id"].tolist()))
+    todo = []
+    for config in configs:
+        pending = [i for i, cid in enumerate(capture_ids) if (config["key"], cid) not in done]
+        todo.extend((config, pending[k : k + chunk]) for k in range(0, len(pending), chunk))
+    if not todo:
+        return 0
+
+    records = [archive.read(cid) for cid in capture_ids]
+    channels = records[0].samples.shape[0]
+    offsets = np.cumsum([0] + [r.samples.shape[1] for r in records])
+    fs = np.array([r.fs for r in records])
+    scale = np.array([r.scale for r in records])
+    dtype = np.result_type(*(r.samples.dtype for r in records))
+    default = np.column_stack((MIC_X, MIC_Y, MIC_Z))
+    geometry = np.array([default if np.isnan(r.geometry).any() else r.geometry for r in records])
+    shape = (channels, int(offsets[-1]))
+    shm = shared_memory.SharedMemory(create=True, size=max(1, dtype.itemsize * shape[0] * shape[1]))
+    computed = 0
+    # results not yet in ``columns``, which are only rebuilt when saved
+    batches = []
+    try:
+        samples = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        for r, start, stop in zip(records, offsets[:-1], offsets[1:]):
+            samples[:, start:stop] = r.samples
+        del samples
+        ids = np.asarray(capture_ids)
+        last_save = time.monotonic()
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(shm.name, shape, dtype, offsets, scale, fs, geometry),
+        ) as pool:
+            futures = [pool.submit(_run_task, config, indices) for config, indices in todo]
+            for future in as_completed(futures):
+                config, rows = future.result()
+                batches.append((config, [(ids[row[0]], *row[1:]) for row in rows]))
+                computed += len(rows)
+                if time.monotonic() - last_save > save_every:
+                    columns, batches = _append(columns, batches), []
+                    _save_results(output, columns)
+                    last_save = time.monotonic()
+    finally:
+        _save_results(output, _append(columns, batches))
+        shm.close()
+        shm.unlink()
+    return computed
+
+
+def _parse_values(text):
+    values = []
+    for item in text.split(","):
+        try:
+            values.append(json.loads(item))
+        except ValueError:
+            values.append(item)
+    return values
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    opts = dict(a[2:].split("=", 1) for a in argv if a.startswith("--") and "=" in a)
+    args = [a for a in argv if not a.startswith("--")]
+    if len(args) != 2:
+        print(__doc__)
+        return 2
+    archive, output = args
+    methods = opts.pop("methods", ",".join(available())).split(",")
+    bands = [
+        None if b == "none" else tuple(float(f) for f in b.split("-"))
+        for b in opts.pop("band", "none").split(",")
+    ]
+    workers = int(opts.pop("workers", os.cpu_count() or 1))
+    chunk = int(opts.pop("chunk", 32))
+    params = {}
+    for key, text in opts.items():
+        method, _, name = key.partition(".")
+        params.setdefault(method, {})[name] = _parse_values(text)
+    configs = parameter_grid(methods, params, bands)
+    start = time.perf_counter()
+    computed = reprocess(archive, output, configs, workers=workers, chunk=chunk)
+    print(f"{computed} results in {time.perf_counter() - start:.1f} s -> {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""Append-only archive of the raw samples behind every event.
+
+An archive is a directory of segment files holding one record per capture
+and an ``index.bin`` file mapping capture ids to their position::
+
+    record   size        field
+    header   48          HEADER_DTYPE: magic, sample type, channel count,
+                         sample count, trigger index, capture id, fs,
+                         volts per count, host timestamp
+    geometry 24*C        (C, 3) float64 microphone positions in metres
+    samples  2*C*N       (C, N) uint16 ADC counts (or int16), row major
+
+Records are only ever appended, a segment is closed once it reaches
+``segment_bytes`` and the index entry is written after the record, so a
+crash at worst leaves unreferenced bytes at the end of a segment.  Reads map
+only the pages of the requested record with :class:`numpy.memmap`.
+
+Capture ids are stored in the ``capture_id`` column of the ``events`` table
+(see :func:`db_logger.log_event`).
+"""
+
+import os
+import threading
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+from deinterleave import as_channels
+from serial_protocol import ADC_BITS, VREF, counts_to_volts, volts_to_counts
+
+ARCHIVE_DIR = 'captures'
+MAGIC = b'CAP1'
+SEGMENT_BYTES = 1 << 30
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('signed', 'u1'),
+    ('reserved', 'u1'),
+    ('channels', '<u2'),
+    ('samples', '<u4'),
+    ('trigger_index', '<u4'),
+    ('capture_id', '<u8'),
+    ('fs', '<f8'),
+    ('scale', '<f8'),
+    ('timestamp', '<f8'),
+])
+INDEX_DTYPE = np.dtype([('segment', '<u4'), ('offset', '<u8')])
+_SAMPLE_DTYPES = (np.dtype('<u2'), np.dtype('<i2'))
+
+
+class CaptureRecord(NamedTuple):
+    """One archived capture.
+
+    Attributes
+    ----------
+    capture_id : int
+        Position of the capture in the archive.
+    samples : numpy.ndarray
+        ``(channels, N)`` read-only memory-mapped integer samples.
+    fs : float
+        Sampling frequency in Hz.
+    trigger_index : int
+        Column of ``samples`` holding the trigger sample.
+    geometry : numpy.ndarray
+        ``(channels, 3)`` microphone positions in metres (``NaN`` if unknown).
+    timestamp : float
+        Host time of the trigger sample (``time.time()``).
+    scale : float
+        Volts per count.
+    """
+
+    capture_id: int
+    samples: np.ndarray
+    fs: float
+    trigger_index: int
+    geometry: np.ndarray
+    timestamp: float
+    scale: float
+
+    def volts(self):
+        """Return the samples converted to volts."""
+        return self.samples * self.scale
+
+
+def _quantize(volts, scale=None):
+    """Return ``(counts, scale)`` storing the float array ``volts``."""
+    if not np.isfinite(volts).all():
+        raise ValueError('Samples must be finite')
+    if scale is None:
+        counts = volts_to_counts(volts)
+        if np.array_equal(counts_to_volts(counts), volts):
+            return counts, VREF / (1 << ADC_BITS)
+        peak = float(np.abs(volts).max())
+        scale = peak / 32767 if peak else 1.0
+    counts = np.rint(volts / scale)
+    if counts.size and (counts.min() < -32768 or counts.max() > 32767):
+        raise ValueError(f'Samples do not fit in int16 counts of {scale:g} V')
+    return counts.astype(np.int16), scale
+
+
+class CaptureArchive:
+    """Directory of append-only capture segments.
+
+    Parameters
+    ----------
+    path : str, optional
+        Archive directory, created if needed.
+    segment_bytes : int, optional
+        Size after which new records go to a new segment file.
+    """
+
+    def __init__(self, path=ARCHIVE_DIR, segment_bytes=SEGMENT_BYTES):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._index_path = os.path.join(path, 'index.bin')
+        self._load_index()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, f'segment_{segment:05d}.cap')
+
+    def _load_index(self):
+        if os.path.exists(self._index_path):
+            raw = np.fromfile(self._index_path, dtype=np.uint8)
+            # ignore an entry cut short by a crash
+            raw = raw[: len(raw) - len(raw) % INDEX_DTYPE.itemsize]
+            self._index = raw.view(INDEX_DTYPE).copy()
+        else:
+            self._index = np.empty(0, dtype=INDEX_DTYPE)
+        # ``_index`` grows geometrically, only the first ``_count`` entries are used
+        self._count = len(self._index)
+
+    def _add_entry(self, entry):
+        if self._count == len(self._index):
+            grown = np.empty(max(64, 2 * self._count), dtype=INDEX_DTYPE)
+            grown[: self._count] = self._index[: self._count]
+            self._index = grown
+        self._index[self._count] = entry
+        self._count += 1
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, capture_id):
+        return self.read(capture_id)
+
+    def __iter__(self):
+        for capture_id in range(len(self)):
+            yield self.read(capture_id)
+
+    def append(self, samples, fs, trigger_index=0, geometry=None, timestamp=None, scale=None):
+        """Store a capture and return its id.
+
+        ``samples`` is a ``(channels, N)`` array of ``uint16``/``int16``
+        counts, whose ``scale`` (volts per count) defaults to the resolution
+        of the ADC, or of voltages.  Voltages read from the ADC are stored as
+        its counts; any other voltages (filtered, baseline removed, ...) as
+        ``int16`` counts of ``scale`` volts, by default the largest
+        magnitude over 32767, so they are kept to 16 bits.  A ``ValueError``
+        is raised if they do not fit ``scale`` or are not finite.
+        """
+        samples = np.asarray(samples)
+        if not (samples.dtype.kind in 'ui' and samples.dtype.itemsize == 2):
+            samples, scale = _quantize(as_channels(samples), scale)
+        if samples.ndim != 2:
+            raise ValueError('Expected a (channels, N) sample matrix')
+        channels, n = samples.shape
+        signed = samples.dtype.kind == 'i'
+        samples = np.ascontiguousarray(samples, dtype=_SAMPLE_DTYPES[signed])
+        if geometry is None:
+            geometry = np.full((channels, 3), np.nan)
+        geometry = np.asarray(geometry, dtype='<f8').reshape(channels, 3)
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['signed'] = signed
+        header['channels'] = channels
+        header['samples'] = n
+        header['trigger_index'] = trigger_index
+        header['fs'] = fs
+        header['scale'] = VREF / (1 << ADC_BITS) if scale is None else scale
+        header['timestamp'] = time.time() if timestamp is None else timestamp
+        size = HEADER_DTYPE.itemsize + geometry.nbytes + samples.nbytes
+
+        with self._lock:
+            capture_id = self._count
+            header['capture_id'] = capture_id
+            segment = int(self._index['segment'][capture_id - 1]) if capture_id else 0
+            path = self._segment_path(segment)
+            offset = os.path.getsize(path) if os.path.exists(path) else 0
+            if offset and offset + size > self.segment_bytes:
+                segment += 1
+                path = self._segment_path(segment)
+                offset = 0
+            with open(path, 'ab') as f:
+                f.write(header.tobytes())
+                f.write(geometry.tobytes())
+                f.write(samples.tobytes())
+            entry = np.array([(segment, offset)], dtype=INDEX_DTYPE)
+            with open(self._index_path, 'ab') as f:
+                f.write(entry.tobytes())
+            self._add_entry(entry[0])
+        return capture_id
+
+    def read(self, capture_id):
+        """Return the :class:`CaptureRecord` of ``capture_id``.
+
+        Only the pages of this record's samples are mapped from disk.
+        """
+        if capture_id >= self._count:
+            # written by another process since we opened the archive
+            with self._lock:
+                self._load_index()
+        if not 0 <= capture_id < self._count:
+            raise IndexError(f'No capture {capture_id} in {self.path}')
+        segment, offset = self._index[capture_id].tolist()
+        path = self._segment_path(segment)
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1, offset=offset)[0]
+        if header['magic'] != MAGIC or header['capture_id'] != capture_id:
+            raise ValueError(f'Corrupt capture record {capture_id} in {path}')
+        channels = int(header['channels'])
+        geometry = np.fromfile(
+            path, dtype='<f8', count=3 * channels, offset=offset + HEADER_DTYPE.itemsize
+        ).reshape(channels, 3)
+        samples = np.memmap(
+            path,
+            dtype=_SAMPLE_DTYPES[int(header['signed'])],
+            mode='r',
+            offset=offset + HEADER_DTYPE.itemsize + geometry.nbytes,
+            shape=(channels, int(header['samples'])),
+        )
+        return CaptureRecord(
+            capture_id,
+            samples,
+            float(header['fs']),
+            int(header['trigger_index']),
+            geometry,
+            float(header['timestamp']),
+            float(header['scale']),
+        )
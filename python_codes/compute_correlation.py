@@ -1,39 +1,46 @@
-from scipy import signal
 import numpy as np 
-import matplotlib.pyplot as plt 
 
-def corelatia(s1, s2, s3, s4, fs):
-    """Estimate TDOA using cross correlation."""
+from deinterleave import as_channels
 
-    # ``scipy.signal.correlate`` expects ``numpy`` arrays.  Ensure that the
-    # provided lists are converted to arrays in order to avoid attribute errors
-    # on Python lists when SciPy tries to access ``.shape``.
-    s1 = np.asarray(s1)
-    s2 = np.asarray(s2)
-    s3 = np.asarray(s3)
-    s4 = np.asarray(s4)
 
-    corr1 = signal.correlate(s1, s2, mode="full")
-    corr2 = signal.correlate(s1, s3, mode="full")
-    corr3 = signal.correlate(s1, s4, mode="full")
+def correlation_curves(sigs):
+    """Return the full cross-correlation of channel 1 with each other channel.
 
-    delay1 = np.argmax(corr1) - (len(s2) - 1)
-    delay2 = np.argmax(corr2) - (len(s3) - 1)
-    delay3 = np.argmax(corr3) - (len(s4) - 1)
+    Row ``k`` is ``scipy.signal.correlate(sigs[0], sigs[k + 1])``; column
+    ``N - 1`` is lag 0.
+    """
+    from scipy import signal
 
-    t1 = delay1 / fs
-    t2 = delay2 / fs
-    t3 = delay3 / fs
+    sigs = as_channels(sigs)
+    return np.array([signal.correlate(sigs[0], other, mode="full") for other in sigs[1:]])
+
+
+def corelatia(sigs, fs):
+    """Estimate TDOA using cross correlation.
+
+    ``sigs`` is the ``(channels, N)`` sample matrix; the delays of channels
+    2..4 are measured against channel 1.
+    """
+
+    sigs = as_channels(sigs)
+    n = sigs.shape[1]
+
+    corr = correlation_curves(sigs)
+    t1, t2, t3 = (np.argmax(corr, axis=1) - (n - 1)) / fs
 
     print(f'The delays between microphones are {t1}, {t2}, {t3}')
     return t1, t2, t3
 
 def lag_finder(y1, y2, sr):
+    from scipy import signal
+
     n = len(y1)
     corr = signal.correlate(y2, y1, mode='same') / np.sqrt(signal.correlate(y1, y1, mode='same')[int(n/2)] * signal.correlate(y2, y2, mode='same')[int(n/2)])
     delay_arr = np.linspace(-0.5*n/sr, 0.5*n/sr, n)
     delay = delay_arr[np.argmax(corr)]
     print('y2 is ' + str(delay) + ' behind y1')
+    import matplotlib.pyplot as plt
+
     plt.figure()
     plt.plot(delay_arr, corr)
     plt.title('Lag: ' + str(np.round(delay, 3)) + ' s')
@@ -1,48 +1,125 @@
 """Compute and display spectrograms for four signals."""
 
-import matplotlib.pyplot as plt
 import numpy as np
-from scipy import signal
+from numpy.lib.stride_tricks import sliding_window_view
 
+from deinterleave import as_channels
 
-def spectrogram(s1, s2, s3, s4, fs, axes=None, show=True):
+WINDOW = ('tukey', 0.25)
 
-    """Plot spectrograms for the four microphone signals."""
 
-    # ``scipy.signal.spectrogram`` expects numpy arrays.  The signals
-    # captured from the serial port are lists of floats, so convert them to
-    # arrays here to avoid attribute errors when SciPy accesses ``shape``.
-    s1 = np.asarray(s1)
-    s2 = np.asarray(s2)
-    s3 = np.asarray(s3)
-    s4 = np.asarray(s4)
+def spectrogram_batch(sigs, fs, nperseg=256, noverlap=None, dtype=np.float32):
+    """Return ``(f, t, Sxx)`` of all channels from a single STFT.
 
-    f1, t1, Sxx1 = signal.spectrogram(s1, fs)
-    f2, t2, Sxx2 = signal.spectrogram(s2, fs)
-    f3, t3, Sxx3 = signal.spectrogram(s3, fs)
-    f4, t4, Sxx4 = signal.spectrogram(s4, fs)
+    ``Sxx`` is the ``(channels, F, T)`` power spectral density, computed in
+    ``dtype``, with the defaults of :func:`scipy.signal.spectrogram`.
+    """
+    from scipy import signal
+
+    sigs = as_channels(sigs).astype(dtype, copy=False)
+    return signal.spectrogram(
+        sigs, fs, window=WINDOW, nperseg=min(nperseg, sigs.shape[1]), noverlap=noverlap, axis=-1
+    )
+
+
+def plot_spectrogram(axs, f, t, Sxx):
+    """Draw the ``(channels, F, T)`` spectrogram ``Sxx`` into the axes ``axs``."""
+    for k, (ax, S) in enumerate(zip(np.ravel(axs), Sxx)):
+        ax.clear()
+        ax.pcolormesh(t, f, S)
+        ax.set_title(f'Spectrogram {k + 1}')
+        ax.set(xlabel='Time [sec]', ylabel='Frequency [Hz]')
+
+
+def spectrogram(sigs, fs, axes=None, show=True):
+
+    """Plot spectrograms for the microphone signals.
+
+    ``sigs`` is the ``(channels, N)`` sample matrix.  Returns one
+    ``(f, t, Sxx)`` tuple per channel.
+    """
+
+    f, t, Sxx = spectrogram_batch(sigs, fs)
+    results = [(f, t, s) for s in Sxx]
 
     if axes is not None:
         axs = axes
     elif show:
+        import matplotlib.pyplot as plt
+
         fig, axs = plt.subplots(2, 2)
     else:
         axs = None
 
     if axs is not None:
-        axs[0, 0].pcolormesh(t1, f1, Sxx1)
-        axs[0, 0].set_title('Spectrogram 1')
-        axs[0, 1].pcolormesh(t2, f2, Sxx2)
-        axs[0, 1].set_title('Spectrogram 2')
-        axs[1, 0].pcolormesh(t3, f3, Sxx3)
-        axs[1, 0].set_title('Spectrogram 3')
-        axs[1, 1].pcolormesh(t4, f4, Sxx4)
-        axs[1, 1].set_title('Spectrogram 4')
-        for ax in axs.flat:
-            ax.set(xlabel='Time [sec]', ylabel='Frequency [Hz]')
+        plot_spectrogram(axs, f, t, Sxx)
         if show and axes is None:
             plt.tight_layout()
             plt.show()
 
-    return (f1, t1, Sxx1), (f2, t2, Sxx2), (f3, t3, Sxx3), (f4, t4, Sxx4)
+    return tuple(results)
+
+
+class StreamingSpectrogram:
+    """Spectrogram of a stream, extended as ``(channels, n)`` blocks arrive.
+
+    Only the segments completed by the new samples are transformed; the
+    samples shared with the next segment are kept between calls.  The
+    columns match :func:`spectrogram_batch` of the whole stream.  The last
+    ``max_columns`` columns are kept in a ring buffer for display.
+    """
+
+    def __init__(self, fs, channels=4, nperseg=256, noverlap=None, max_columns=512, dtype=np.float32):
+        from scipy import fft, signal
+
+        self.fs = fs
+        self.nperseg = nperseg
+        self.step = nperseg - (nperseg // 8 if noverlap is None else noverlap)
+        self.dtype = dtype
+        win = signal.get_window(WINDOW, nperseg)
+        self._window = win.astype(dtype)
+        scale = np.full(nperseg // 2 + 1, 2.0 / (fs * (win * win).sum()))
+        scale[0] /= 2
+        if nperseg % 2 == 0:
+            scale[-1] /= 2
+        self._scale = scale.astype(dtype)
+        self.freqs = fft.rfftfreq(nperseg, 1 / fs)
+        self.columns = 0
+        self._buf = np.empty((channels, 0), dtype=dtype)
+        self._ring = np.zeros((channels, len(self.freqs), max_columns), dtype=dtype)
+
+    def update(self, block):
+        """Add a block and return the ``(channels, F, k)`` new columns."""
+        block = as_channels(block).astype(self.dtype, copy=False)
+        buf = np.concatenate((self._buf, block), axis=1)
+        count = max(0, (buf.shape[1] - self.nperseg) // self.step + 1)
+        if not count:
+            self._buf = buf
+            return np.empty(self._ring.shape[:2] + (0,), dtype=self.dtype)
+        segs = sliding_window_view(buf[:, : (count - 1) * self.step + self.nperseg], self.nperseg, axis=1)
+        segs = segs[:, :: self.step]
+        from scipy import fft
+
+        segs = (segs - segs.mean(axis=-1, keepdims=True)) * self._window
+        spec = fft.rfft(segs, axis=-1)
+        new = ((spec.real ** 2 + spec.imag ** 2) * self._scale).astype(self.dtype)
+        new = np.moveaxis(new, 1, 2)
+        self._buf = buf[:, count * self.step :]
+        self._store(new)
+        return new
+
+    def _store(self, new):
+        size = self._ring.shape[2]
+        count = new.shape[2]
+        kept = new[:, :, -size:]
+        idx = (self.columns + count - kept.shape[2] + np.arange(kept.shape[2])) % size
+        self._ring[:, :, idx] = kept
+        self.columns += count
 
+    def history(self):
+        """Return ``(f, t, Sxx)`` of the columns still in the ring buffer."""
+        size = self._ring.shape[2]
+        first = max(0, self.columns - size)
+        cols = np.arange(first, self.columns)
+        t = (cols * self.step + self.nperseg / 2) / self.fs
+        return self.freqs, t, self._ring[:, :, cols % size]
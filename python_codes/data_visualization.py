@@ -1,15 +1,23 @@
+import time
+
 import matplotlib.pyplot as plt 
 import numpy as np
 
-def plot_3d_coordinates(xs, ys, zs):
-    """Display the microphone layout and the estimated source position."""
+def plot_3d_coordinates(xs, ys, zs, ax=None):
+    """Display the microphone layout and the estimated source position.
+
+    With ``ax`` (a 3-D axes) the points are drawn there instead of in a new
+    window.
+    """
 
     x = [0, 5, 0, 5]
     y = [0, 0, 5, 5]
     z = [0, 0, 0, 0]
 
-    fig = plt.figure()
-    ax = fig.add_subplot(111, projection="3d")
+    show = ax is None
+    if show:
+        fig = plt.figure()
+        ax = fig.add_subplot(111, projection="3d")
     ax.scatter3D(x, y, z, c=z, cmap="hsv")
     ax.set_xlim(-10, 10)
     ax.set_ylim(-10, 10)
@@ -18,7 +26,110 @@ def plot_3d_coordinates(xs, ys, zs):
     ax.set_xlabel("X")
     ax.set_ylabel("Y")
     ax.set_zlabel("Z")
-    plt.show()
+    if show:
+        plt.show()
+
+def minmax_decimate(y, buckets):
+    """Reduce ``y`` to the minimum and maximum of ``buckets`` equal slices.
+
+    Returns ``(x, y)`` with two points per slice at the slice centre, which
+    draws the same envelope as the full signal at one slice per pixel.
+    Signals with at most ``2 * buckets`` samples are returned unchanged.
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= 2 * buckets:
+        return np.arange(n), y
+    starts = np.linspace(0, n, buckets + 1).astype(int)[:-1]
+    centres = starts + np.diff(np.append(starts, n)) / 2
+    with np.errstate(invalid="ignore"):
+        lo = np.fmin.reduceat(y, starts)
+        hi = np.fmax.reduceat(y, starts)
+    return np.repeat(centres, 2), np.column_stack((lo, hi)).ravel()
+
+
+class LivePlot:
+    """Scrolling view of the last ``window`` samples of every channel.
+
+    The lines are created once and updated with ``set_data``; when the
+    canvas supports it only the lines are redrawn over a cached background
+    (blitting).  Each line is decimated to the pixel width of its axes with
+    :func:`minmax_decimate`, and :meth:`refresh` draws at most ``max_fps``
+    times per second however fast samples are appended, so the cost of
+    plotting does not grow with the sample rate or the length of the record.
+
+    ``axes`` is one axes for all channels or one per channel.
+    """
+
+    def __init__(self, axes, window=2000, channels=4, ylim=(0, 5), max_fps=25):
+        self.axes = list(np.ravel(axes))
+        self.canvas = self.axes[0].figure.canvas
+        self.window = window
+        self.min_interval = 1.0 / max_fps
+        self.total = 0
+        self._ring = np.full((channels, window), np.nan)
+        self._lines = []
+        for ch in range(channels):
+            ax = self.axes[ch % len(self.axes)]
+            (line,) = ax.plot([], [], linewidth=0.8, animated=True)
+            self._lines.append((ax, line))
+        for ax in self.axes:
+            ax.set_xlim(0, window)
+            ax.set_ylim(*ylim)
+        self._background = None
+        self._last = -np.inf
+        self._dirty = False
+        self.canvas.mpl_connect("draw_event", self._on_draw)
+
+    def append(self, block):
+        """Add a ``(channels, n)`` block at the right end of the window."""
+        block = np.asarray(block, dtype=float)[:, -self.window :]
+        n = block.shape[1]
+        idx = (self.total + np.arange(n)) % self.window
+        self._ring[:, idx] = block
+        self.total += n
+        self._dirty = True
+
+    def set(self, sigs):
+        """Show ``sigs`` (``(channels, N)``) alone, aligned to the right."""
+        self._ring[:] = np.nan
+        self.total = 0
+        self.append(sigs)
+
+    def _ordered(self):
+        idx = (self.total + np.arange(self.window)) % self.window
+        return self._ring[:, idx]
+
+    def _update_lines(self):
+        for (ax, line), y in zip(self._lines, self._ordered()):
+            line.set_data(*minmax_decimate(y, max(1, int(ax.bbox.width))))
+
+    def _on_draw(self, event):
+        # a full redraw (first show, resize): cache the background without
+        # the animated lines, then draw them on top
+        if getattr(self.canvas, "supports_blit", False):
+            self._background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self._update_lines()
+        for ax, line in self._lines:
+            ax.draw_artist(line)
+
+    def refresh(self, force=False):
+        """Redraw if there is new data and the frame rate allows; return whether it did."""
+        now = time.monotonic()
+        if not force and (not self._dirty or now - self._last < self.min_interval):
+            return False
+        self._last = now
+        self._dirty = False
+        if self._background is None:
+            self.canvas.draw_idle()
+            return True
+        self.canvas.restore_region(self._background)
+        self._update_lines()
+        for ax, line in self._lines:
+            ax.draw_artist(line)
+        self.canvas.blit(self.canvas.figure.bbox)
+        return True
+
 
 def draw_fig_real_time(data):
     plt.clf()
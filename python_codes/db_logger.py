@@ -1,32 +1,411 @@
+"""Event log in a SQLite database.
+
+:class:`EventStore` keeps a single connection in WAL mode and leaves the
+inserts to a background writer thread, which commits them in batches, so
+logging an event never waits for the disk.  :func:`log_event` is a thin
+wrapper around a store opened on first use.
+
+The writer also keeps two summary tables up to date in the same
+transactions, the number of events per minute and the number of events per
+``OCCUPANCY_CELL`` cube of space, which :class:`EventQuery` reads without
+scanning the events.
+"""
+
+import atexit
+import math
+import queue
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+import metrics
 
 DB_PATH = 'logs.db'
+# Edge in metres of the cubes counted in the ``occupancy`` table
+OCCUPANCY_CELL = 0.1
 
-# Initialize DB
-conn = sqlite3.connect(DB_PATH)
-conn.execute(
-    '''CREATE TABLE IF NOT EXISTS events(
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events(
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     timestamp TEXT NOT NULL,
     amplitude REAL,
     x REAL,
     y REAL,
-    z REAL
-)'''
-)
-conn.commit()
-
-
-def log_event(amplitude, x, y, z, db_path=DB_PATH):
-    """Store an event in the SQLite database and return the timestamp."""
-    ts = datetime.utcnow().isoformat()
-    with sqlite3.connect(db_path) as c:
-        c.execute(
-            'INSERT INTO events(timestamp, amplitude, x, y, z) VALUES (?,?,?,?,?)',
-            (ts, amplitude, x, y, z),
+    z REAL,
+    capture_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS events_per_minute(
+    minute TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS occupancy(
+    ix INTEGER NOT NULL,
+    iy INTEGER NOT NULL,
+    iz INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY(ix, iy, iz)
+);
+'''
+
+EVENT_DTYPE = np.dtype([
+    ('id', np.int64),
+    ('timestamp', 'datetime64[us]'),
+    ('amplitude', float),
+    ('x', float),
+    ('y', float),
+    ('z', float),
+    ('capture_id', np.int64),
+])
+
+_STOP = object()
+
+
+def _now():
+    return datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+
+
+def _iso(t):
+    """Return ``t`` (``str``, ``datetime`` or ``numpy.datetime64``) as stored."""
+    if isinstance(t, datetime):
+        if t.tzinfo is not None:
+            t = t.astimezone(timezone.utc).replace(tzinfo=None)
+        return t.isoformat()
+    if isinstance(t, np.datetime64):
+        return str(t.astype('datetime64[us]'))
+    return str(t)
+
+
+def _cell(value):
+    return math.floor(value / OCCUPANCY_CELL)
+
+
+def _update_summaries(conn, rows):
+    """Add ``(timestamp, amplitude, x, y, z, ...)`` rows to the summary tables."""
+    minutes = Counter(row[0][:16] for row in rows)
+    cells = Counter(
+        (_cell(x), _cell(y), _cell(z))
+        for _, _, x, y, z, *_ in rows
+        if all(v is not None and math.isfinite(v) for v in (x, y, z))
+    )
+    conn.executemany(
+        '''INSERT INTO events_per_minute(minute, count) VALUES (?, ?)
+        ON CONFLICT(minute) DO UPDATE SET count = count + excluded.count''',
+        minutes.items(),
+    )
+    conn.executemany(
+        '''INSERT INTO occupancy(ix, iy, iz, count) VALUES (?, ?, ?, ?)
+        ON CONFLICT(ix, iy, iz) DO UPDATE SET count = count + excluded.count''',
+        ((*cell, n) for cell, n in cells.items()),
+    )
+
+
+def _create_tables(conn):
+    with conn:
+        conn.executescript(SCHEMA)
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(events)')]
+        if 'capture_id' not in columns:
+            # databases written before raw captures were archived
+            conn.execute('ALTER TABLE events ADD COLUMN capture_id INTEGER')
+        conn.execute('CREATE INDEX IF NOT EXISTS events_timestamp ON events(timestamp)')
+
+
+def _init_schema(conn, chunk=65536):
+    """Create the tables and fill the summaries of a database that lacks them."""
+    _create_tables(conn)
+    summarized = conn.execute('SELECT SUM(count) FROM events_per_minute').fetchone()[0] or 0
+    total = conn.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+    if summarized == total:
+        return
+    with conn:
+        conn.execute('DELETE FROM events_per_minute')
+        conn.execute('DELETE FROM occupancy')
+        cur = conn.execute('SELECT timestamp, amplitude, x, y, z FROM events')
+        while True:
+            rows = cur.fetchmany(chunk)
+            if not rows:
+                break
+            _update_summaries(conn, rows)
+
+
+class EventStore:
+    """Batched, non-blocking writer of the ``events`` table.
+
+    Parameters
+    ----------
+    db_path : str, optional
+        SQLite database file, created if needed.
+    batch_size : int, optional
+        Events written per transaction at most; reaching it flushes at once.
+    flush_interval : float, optional
+        Longest time in seconds an event waits before being committed.
+    max_pending : int, optional
+        Events queued for the writer.  When the queue is full :meth:`log`
+        blocks until there is room (or ``timeout`` expires), which slows the
+        producer down to the speed of the disk instead of using unbounded
+        memory.
+
+    A batch that fails to commit is rolled back and counted in ``failed``;
+    the writer keeps going with the next one, and the exception is raised
+    once by the next :meth:`log` or :meth:`flush`.
+    """
+
+    def __init__(self, db_path=DB_PATH, batch_size=256, flush_interval=0.5, max_pending=10000):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.failed = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        # only the writer thread uses the connection once it is set up
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        _init_schema(self._conn)
+        self._thread = threading.Thread(target=self._run, name='event-store', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._conn is None
+
+    def log(self, amplitude, x, y, z, timestamp=None, timeout=None, capture_id=None):
+        """Queue an event and return its timestamp.
+
+        ``timestamp`` is a ``str`` in the stored ISO format, a ``datetime``
+        or a ``numpy.datetime64``, by default the current UTC time.
+        ``capture_id`` links the event to its raw samples in a
+        :class:`capture_archive.CaptureArchive`.
+
+        Raises ``queue.Full`` if there is still no room after ``timeout``
+        seconds, and the exception of a batch that failed since the last
+        call.
+        """
+        self._raise_error()
+        if self.closed:
+            raise ValueError('Event store is closed')
+        ts = _now() if timestamp is None else _iso(timestamp)
+        with metrics.stage('log_event'):
+            self._queue.put((ts, amplitude, x, y, z, capture_id), timeout=timeout)
+        return ts
+
+    def flush(self):
+        """Wait until every queued event has been committed."""
+        if not self.closed:
+            self._queue.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        # reported once: the events logged after the failure are unaffected
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        """Commit the queued events, stop the writer and close the database."""
+        if self.closed:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._conn.close()
+        self._conn = None
+
+    def _run(self):
+        stop = False
+        while not stop:
+            rows = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size and rows[-1] is not _STOP:
+                remaining = deadline - time.monotonic()
+                try:
+                    rows.append(self._queue.get(timeout=max(remaining, 0)))
+                except queue.Empty:
+                    break
+            if rows[-1] is _STOP:
+                rows.pop()
+                stop = True
+            try:
+                with metrics.stage('db_commit'):
+                    self._write(rows)
+            except Exception as exc:  # reported to the producer through ``error``
+                # the transaction was rolled back, the batch is lost
+                self.failed += len(rows)
+                self.error = exc
+            for _ in range(len(rows) + stop):
+                self._queue.task_done()
+
+    def _write(self, rows):
+        if not rows:
+            return
+        with self._conn:
+            self._conn.executemany(
+                'INSERT INTO events(timestamp, amplitude, x, y, z, capture_id) '
+                'VALUES (?,?,?,?,?,?)',
+                rows,
+            )
+            _update_summaries(self._conn, rows)
+        self.written += len(rows)
+
+
+class Occupancy(NamedTuple):
+    """Spatial histogram returned by :meth:`EventQuery.occupancy`.
+
+    Attributes
+    ----------
+    cells : numpy.ndarray
+        ``(K, 3)`` integer indices of the non-empty cells; cell ``(i, j, k)``
+        spans ``[i, i + 1) * size`` along x and so on.
+    counts : numpy.ndarray
+        ``(K,)`` number of events in each cell.
+    size : float
+        Cell edge in metres.
+    """
+
+    cells: np.ndarray
+    counts: np.ndarray
+    size: float
+
+
+class EventQuery:
+    """Read-only access to the events and their summaries.
+
+    Uses its own read-only connection, so queries run alongside the writer
+    of an :class:`EventStore` on the same file, from any process, and never
+    modify it.  The database must exist and have been written by an
+    :class:`EventStore`, which creates the tables.  Time bounds are ``str``
+    in the stored ISO format, ``datetime`` or ``numpy.datetime64``;
+    ``start`` is inclusive and ``stop`` exclusive.
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        uri = Path(db_path).resolve().as_uri() + '?mode=ro'
+        self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    @staticmethod
+    def _where(start, stop, column='timestamp'):
+        clauses, params = [], []
+        if start is not None:
+            clauses.append(f'{column} >= ?')
+            params.append(_iso(start))
+        if stop is not None:
+            clauses.append(f'{column} < ?')
+            params.append(_iso(stop))
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def count(self, start=None, stop=None):
+        """Return the number of events between ``start`` and ``stop``."""
+        where, params = self._where(start, stop)
+        return self._conn.execute('SELECT COUNT(*) FROM events' + where, params).fetchone()[0]
+
+    def iter_events(self, start=None, stop=None, chunk=65536):
+        """Yield the events in time order as structured arrays of ``chunk`` rows.
+
+        The arrays have the fields of ``EVENT_DTYPE``; missing coordinates
+        are ``NaN`` and events without an archived capture have
+        ``capture_id == -1``.
+        """
+        where, params = self._where(start, stop)
+        cur = self._conn.execute(
+            'SELECT id, timestamp, amplitude, x, y, z, capture_id FROM events'
+            + where
+            + ' ORDER BY timestamp, id',
+            params,
         )
-        c.commit()
-    return ts
+        while True:
+            rows = cur.fetchmany(chunk)
+            if not rows:
+                return
+            out = np.empty(len(rows), dtype=EVENT_DTYPE)
+            cols = list(zip(*rows))
+            out['id'] = cols[0]
+            out['timestamp'] = np.array(cols[1], dtype='datetime64[us]')
+            for name, col in zip(('amplitude', 'x', 'y', 'z'), cols[2:6]):
+                out[name] = np.array(col, dtype=float)
+            out['capture_id'] = [-1 if c is None else c for c in cols[6]]
+            yield out
+
+    def events(self, start=None, stop=None):
+        """Return all events between ``start`` and ``stop`` as one structured array."""
+        chunks = list(self.iter_events(start, stop))
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=EVENT_DTYPE)
+
+    def events_per_minute(self, start=None, stop=None):
+        """Return ``(minutes, counts)`` of the minutes holding events.
+
+        ``minutes`` is a ``datetime64[m]`` array; bounds are rounded down to
+        the minute.
+        """
+        where, params = self._where(start, stop, 'minute')
+        params = [p[:16] for p in params]
+        rows = self._conn.execute(
+            'SELECT minute, count FROM events_per_minute' + where + ' ORDER BY minute', params
+        ).fetchall()
+        if not rows:
+            return np.empty(0, dtype='datetime64[m]'), np.empty(0, dtype=np.int64)
+        minutes, counts = zip(*rows)
+        return np.array(minutes, dtype='datetime64[m]'), np.array(counts, dtype=np.int64)
+
+    def occupancy(self):
+        """Return the :class:`Occupancy` histogram of all located events."""
+        rows = self._conn.execute('SELECT ix, iy, iz, count FROM occupancy').fetchall()
+        data = np.array(rows, dtype=np.int64).reshape(-1, 4)
+        return Occupancy(data[:, :3], data[:, 3], OCCUPANCY_CELL)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(db_path=DB_PATH):
+    """Return the shared :class:`EventStore` of ``db_path``, opening it on first use.
+
+    Shared stores are closed, and their pending events committed, when the
+    interpreter exits.
+    """
+    with _stores_lock:
+        store = _stores.get(db_path)
+        if store is None or store.closed:
+            store = _stores[db_path] = EventStore(db_path)
+        return store
+
+
+@atexit.register
+def close_stores():
+    """Close every store opened by :func:`get_store`."""
+    with _stores_lock:
+        for store in _stores.values():
+            store.close()
+        _stores.clear()
+
+
+def log_event(amplitude, x, y, z, db_path=DB_PATH, capture_id=None):
+    """Store an event in the SQLite database and return the timestamp.
 
+    ``capture_id`` is the id returned by
+    :meth:`capture_archive.CaptureArchive.append` for the samples of the event.
 
+    The event is committed shortly afterwards by the writer thread of
+    :func:`get_store`; call ``get_store(db_path).flush()`` to wait for it.
+    """
+    return get_store(db_path).log(amplitude, x, y, z, capture_id=capture_id)
@@ -0,0 +1,101 @@
+"""Split the interleaved sample stream into a ``(channels, N)`` matrix.
+
+The microcontroller sends one sample of every microphone in turn, so the
+stream read from the serial port looks like ``m1 m2 m3 m4 m1 m2 ...``.  In
+ASCII mode it may also contain frame markers (lines holding ``#``) written
+before the first channel of each frame; :class:`serial_protocol.AsciiDecoder`
+and ``read_signals`` turn them into ``NaN`` entries.
+"""
+
+import numpy as np
+
+CHANNELS = 4
+
+
+def deinterleave(stream, channels=CHANNELS, phase=None):
+    """Return the samples of ``stream`` as a ``(channels, N)`` matrix.
+
+    Parameters
+    ----------
+    stream : array_like
+        Channel-interleaved samples.  ``NaN`` entries are frame markers.
+    channels : int, optional
+        Number of interleaved channels.
+    phase : int, optional
+        Index of the first sample of channel 1.  Ignored when the stream
+        contains frame markers, in which case the phase is taken from them.
+        Defaults to 0.
+
+    Returns
+    -------
+    numpy.ndarray
+        Row ``k`` holds the samples of microphone ``k + 1``.  Leading and
+        trailing partial frames are dropped.  Without markers the result is
+        a strided view of ``stream`` (no copy when ``stream`` already is a
+        float array).
+    """
+    stream = np.asarray(stream, dtype=float)
+    markers = np.flatnonzero(np.isnan(stream))
+    if len(markers):
+        return _deinterleave_marked(stream, markers, channels)
+    phase = 0 if phase is None else phase % channels
+    n = (len(stream) - phase) // channels
+    return stream[phase : phase + n * channels].reshape(n, channels).T
+
+
+def _deinterleave_marked(stream, markers, channels):
+    """Gather the complete frames following each marker."""
+    ends = np.append(markers[1:], len(stream))
+    starts = markers + 1
+    # The last frame may still be arriving; keep it only if it is complete,
+    # frames with extra or missing samples between two markers are dropped.
+    full = ends - starts == channels
+    full[-1] = ends[-1] - starts[-1] >= channels
+    complete = starts[full]
+    idx = complete[None, :] + np.arange(channels)[:, None]
+    return stream[idx]
+
+
+def as_channels(sigs):
+    """Return ``sigs`` as a float ``(channels, N)`` array.
+
+    ``sigs`` may already be a sample matrix (e.g. from :func:`deinterleave`
+    or :class:`serial_protocol.FrameDecoder`) or a sequence of per-channel
+    sequences.  A float64 matrix is returned as is; anything else (integer
+    counts, float32 samples, lists) is converted to a new float64 array.
+    """
+    sigs = np.asarray(sigs, dtype=float)
+    if sigs.ndim != 2:
+        raise ValueError("Expected a (channels, N) sample matrix")
+    return sigs
+
+
+class FrameAssembler:
+    """Incremental :func:`deinterleave` for a stream arriving in chunks.
+
+    Samples of a frame that is not complete yet are kept until the next
+    call, so chunk boundaries never shift the channel phase.
+    """
+
+    def __init__(self, channels=CHANNELS):
+        self.channels = channels
+        self._rest = np.empty(0)
+
+    def feed(self, values):
+        """Return the ``(channels, n)`` matrix of the newly completed frames."""
+        values = np.concatenate((self._rest, np.asarray(values, dtype=float)))
+        markers = np.flatnonzero(np.isnan(values))
+        if len(markers):
+            last = markers[-1]
+            if len(values) - last - 1 >= self.channels:
+                self._rest = np.empty(0)
+            else:
+                self._rest = values[last:]
+                values = values[:last]
+                markers = markers[:-1]
+            if not len(markers):
+                return np.empty((self.channels, 0))
+            return _deinterleave_marked(values, markers, self.channels)
+        n = len(values) // self.channels
+        self._rest = values[n * self.channels :]
+        return values[: n * self.channels].reshape(n, self.channels).T
@@ -0,0 +1,481 @@
+"""Registry of the time delay detectors.
+
+Every method is a :class:`Detector` subclass registered under its name.  It
+declares its parameters with their defaults, takes a ``(channels, N)``
+capture and the sampling frequency, and returns a :class:`DetectionResult`;
+none of them plots::
+
+    detector = get_detector("wavelet", threshold=0.5)
+    result = detector(sigs, fs)
+    xs, ys, zs = solver.localize(*result.delays)
+
+Artifacts that only depend on the sampling frequency and the capture length
+(the wavelet filter bank, ...) are built by :meth:`Detector.prepare` and
+kept per ``(fs, N)``, so they are computed once per detector.
+
+Other packages add detectors through the ``ENTRY_POINT_GROUP`` entry point
+group; each entry point names a :class:`Detector` subclass, registered
+under the entry point name::
+
+    [project.entry-points."esp32_localization.detectors"]
+    mymethod = "mypackage.detectors:MyDetector"
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import numpy as np
+
+import metrics
+from compute_correlation import correlation_curves
+from deinterleave import as_channels
+from dpe import _noise_floor, dpe_onsets
+from gcc_phat import gcc_phat
+from rpa import rpa_detection
+from srp_phat import SrpLocalizer
+from wavelet_analysis import apply_filter_bank, filter_bank
+
+log = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = "esp32_localization.detectors"
+# Prepared ``(fs, N)`` artifacts kept per detector
+PREPARE_CACHE_SIZE = 8
+
+DETECTORS = {}
+_entry_points_loaded = False
+
+
+class DetectionResult(NamedTuple):
+    """Output of :meth:`Detector.detect`.
+
+    Attributes
+    ----------
+    delays : numpy.ndarray
+        ``(channels - 1,)`` delays ``t1 - t_k`` of channels 2.. in seconds.
+    curves : numpy.ndarray or None
+        Detection curves of the method: one row per channel for the onset
+        detectors, one per pair with channel 1 for the correlations.
+    quality : float
+        Confidence of the detection between 0 and 1, defined per method.
+    position : numpy.ndarray or None
+        ``(3,)`` source position for methods that search it directly, in
+        which case ``delays`` are the delays of that position.
+    rejected : str
+        Why the capture is not worth localizing, ``""`` if it is; the
+        delays of a rejected capture are NaN.
+    """
+
+    delays: np.ndarray
+    curves: object
+    quality: float
+    position: object = None
+    rejected: str = ""
+
+
+def register(cls=None, name=None):
+    """Register a :class:`Detector` subclass; usable as a class decorator."""
+
+    def add(cls):
+        key = name or cls.name
+        if not key:
+            raise ValueError(f"{cls.__name__} has no name")
+        DETECTORS[key] = cls
+        return cls
+
+    return add if cls is None else add(cls)
+
+
+def _load_entry_points():
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    from importlib.metadata import entry_points
+
+    for ep in entry_points(group=ENTRY_POINT_GROUP):
+        if ep.name in DETECTORS:
+            continue
+        try:
+            register(ep.load(), ep.name)
+        except Exception:
+            log.exception("cannot load detector %r from %s", ep.name, ep.value)
+
+
+def available():
+    """Return the names of the registered detectors, plug-ins included."""
+    _load_entry_points()
+    return sorted(DETECTORS)
+
+
+def detector_class(name):
+    """Return the :class:`Detector` subclass registered as ``name``."""
+    if name not in DETECTORS:
+        _load_entry_points()
+    try:
+        return DETECTORS[name]
+    except KeyError:
+        raise ValueError(f"Unknown method: {name}") from None
+
+
+def get_detector(name, geometry=None, **params):
+    """Return a new detector ``name`` for ``geometry`` with ``params``.
+
+    ``geometry`` is the ``(channels, 3)`` microphone coordinates in metres,
+    used by the methods that need them.
+    """
+    return detector_class(name)(geometry, **params)
+
+
+def _first_crossing(curves, threshold):
+    """Index where each curve first exceeds ``threshold`` times its maximum."""
+    return np.argmax(curves > threshold * curves.max(axis=1, keepdims=True), axis=1)
+
+
+def _contrast(curves):
+    """Mean over the curves of ``1 - median / max``, 0 for flat curves."""
+    peak = curves.max(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        contrast = np.where(peak > 0, 1 - np.median(curves, axis=1) / peak, 0.0)
+    return float(np.clip(contrast, 0, 1).mean())
+
+
+class Detector:
+    """Base class of the detectors.
+
+    Subclasses set ``name`` and ``params`` (parameter names and defaults)
+    and implement :meth:`run`; they may override :meth:`prepare`.  The
+    parameters are available as ``self.settings``.  A detector may be used
+    from several threads.
+    """
+
+    name = None
+    params = {}
+
+    def __init__(self, geometry=None, **params):
+        unknown = set(params) - set(self.params)
+        if unknown:
+            raise TypeError(f"{self.name} got unexpected parameters: {', '.join(sorted(unknown))}")
+        self.settings = {**self.params, **params}
+        self.geometry = None if geometry is None else np.asarray(geometry, dtype=float).reshape(-1, 3)
+        self._prepared = OrderedDict()
+        self._prepared_lock = threading.Lock()
+
+    def __repr__(self):
+        args = ", ".join(f"{k}={v!r}" for k, v in self.settings.items())
+        return f"{type(self).__name__}({args})"
+
+    def prepare(self, fs, n):
+        """Return what :meth:`run` reuses for captures of ``n`` samples at ``fs``."""
+        return None
+
+    def prepared(self, fs, n):
+        """Return :meth:`prepare` of ``(fs, n)``, computed once.
+
+        The ``PREPARE_CACHE_SIZE`` most recently used states are kept.
+        """
+        key = (float(fs), int(n))
+        with self._prepared_lock:
+            try:
+                self._prepared.move_to_end(key)
+                return self._prepared[key]
+            except KeyError:
+                pass
+        # prepared outside the lock: two threads may both compute a new
+        # state, but a slow prepare never blocks the cached sizes
+        state = self.prepare(fs, n)
+        with self._prepared_lock:
+            state = self._prepared.setdefault(key, state)
+            while len(self._prepared) > PREPARE_CACHE_SIZE:
+                self._prepared.popitem(last=False)
+        return state
+
+    def run(self, sigs, fs, state):
+        """Return the :class:`DetectionResult` of a ``(channels, N)`` float array."""
+        raise NotImplementedError
+
+    def detect(self, sigs, fs):
+        """Return the :class:`DetectionResult` of a ``(channels, N)`` capture."""
+        sigs = as_channels(sigs)
+        with metrics.stage("detect." + self.name):
+            return self.run(sigs, fs, self.prepared(fs, sigs.shape[1]))
+
+    __call__ = detect
+
+
+@register
+class CorrelationDetector(Detector):
+    """Peak of the plain cross-correlation with channel 1 (:func:`compute_correlation.corelatia`).
+
+    The quality is the mean normalised correlation peak.
+    """
+
+    name = "correlation"
+
+    def run(self, sigs, fs, state):
+        n = sigs.shape[1]
+        curves = correlation_curves(sigs)
+        delays = (np.argmax(curves, axis=1) - (n - 1)) / fs
+        energy = np.sqrt((sigs[0] ** 2).sum() * (sigs[1:] ** 2).sum(axis=1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            peaks = np.where(energy > 0, curves.max(axis=1) / energy, 0.0)
+        return DetectionResult(delays, curves, float(peaks.mean()))
+
+
+@register
+class GccDetector(Detector):
+    """Generalized cross-correlation (:func:`gcc_phat.gcc_phat`).
+
+    The peaks are searched within the delays allowed by the geometry, if
+    given.  The quality is the mean peak height of the pairs with channel 1.
+    """
+
+    name = "gcc"
+    params = {"weighting": "phat", "v": 343, "interpolate": True}
+
+    def run(self, sigs, fs, state):
+        coords = (None,) * 3 if self.geometry is None else self.geometry.T
+        res = gcc_phat(sigs, fs, *coords, **self.settings)
+        ref = res.pairs[:, 0] == 0
+        return DetectionResult(res.delays[ref], res.curves[ref], float(np.clip(res.peaks[ref], 0, 1).mean()))
+
+
+@register
+class WaveletDetector(Detector):
+    """First crossing of the wavelet detection curves (:func:`wavelet_analysis.wavelet_detection`).
+
+    The filter bank is prepared per capture length.  The quality is the
+    contrast of the curves, ``1 - median / max``.
+    """
+
+    name = "wavelet"
+    params = {"threshold": 0.6, "wavelet": "morl", "dtype": "float64"}
+
+    def prepare(self, fs, n):
+        return filter_bank(n, wavelet=self.settings["wavelet"], dtype=self.settings["dtype"])
+
+    def run(self, sigs, fs, state):
+        bank, nfft = state
+        curves = apply_filter_bank(sigs.astype(self.settings["dtype"], copy=False), bank, nfft)
+        t = _first_crossing(curves, self.settings["threshold"]) / fs
+        return DetectionResult(t[0] - t[1:], curves, _contrast(curves))
+
+
+@register
+class RpaDetector(Detector):
+    """First crossing of the recurrence plot curves (:func:`rpa.rpa_detection`).
+
+    The parameters are those of :func:`rpa.rpa_detection`.  The quality is
+    the contrast of the curves, ``1 - median / max``.
+    """
+
+    name = "rpa"
+    params = {"threshold": 0.4, "rp_thresh": 0.9}
+
+    def run(self, sigs, fs, state):
+        *delays, curves = rpa_detection(sigs, fs, **self.settings)
+        return DetectionResult(np.array(delays), curves, _contrast(curves))
+
+
+@register
+class DpeDetector(Detector):
+    """Departure from the baseline (:func:`dpe.dpe_detection`).
+
+    The quality is the fraction of channels where an onset was found;
+    channels without one count as starting at sample 0, and all delays are
+    0 if none was found.
+    """
+
+    name = "dpe"
+    params = {"level": 0.35, "baseline": None, "pre": None, "nsigma": 5.0}
+
+    def run(self, sigs, fs, state):
+        onsets = dpe_onsets(sigs, **self.settings)
+        found = ~np.isnan(onsets)
+        if not found.any():
+            return DetectionResult(np.zeros(len(onsets) - 1), None, 0.0)
+        onsets = np.nan_to_num(onsets)
+        return DetectionResult((onsets[0] - onsets[1:]) / fs, None, float(found.mean()))
+
+
+@register
+class SrpDetector(Detector):
+    """Steered response power search (:class:`srp_phat.SrpLocalizer`).
+
+    Requires the geometry.  The box searched is ``lo`` to ``hi``, by
+    default the microphones' bounding box widened by 1 m horizontally and
+    0 to 2 m in height.  ``cache_dir`` keeps the coarse steering table on
+    disk (e.g. ``srp_phat.CACHE_DIR``).  The quality is the SRP score.
+    """
+
+    name = "srp"
+    params = {
+        "lo": None,
+        "hi": None,
+        "step": 0.01,
+        "coarse_step": 0.1,
+        "weighting": "phat",
+        "upsample": 8,
+        "v": 343,
+        "cache_dir": None,
+    }
+
+    def __init__(self, geometry=None, **params):
+        super().__init__(geometry, **params)
+        self._localizer = None
+        self._lock = threading.Lock()
+
+    def localizer(self):
+        """Return the :class:`srp_phat.SrpLocalizer`, built on first use."""
+        with self._lock:
+            if self._localizer is None:
+                if self.geometry is None:
+                    raise ValueError("srp needs the microphone geometry")
+                s = self.settings
+                mics = self.geometry
+                lo = s["lo"] if s["lo"] is not None else [*(mics[:, :2].min(axis=0) - 1), 0.0]
+                hi = s["hi"] if s["hi"] is not None else [*(mics[:, :2].max(axis=0) + 1), 2.0]
+                self._localizer = SrpLocalizer(
+                    *mics.T, lo, hi, step=s["step"], coarse_step=s["coarse_step"], v=s["v"],
+                    weighting=s["weighting"], upsample=s["upsample"], cache_dir=s["cache_dir"],
+                )
+            return self._localizer
+
+    def run(self, sigs, fs, state):
+        res = self.localizer().localize(sigs, fs)
+        dist = np.linalg.norm(self.geometry - res.position, axis=1)
+        delays = (dist[0] - dist[1:]) / self.settings["v"]
+        return DetectionResult(delays, None, res.score, res.position)
+
+
+@register
+class CascadeDetector(Detector):
+    """Cheap checks first, the ``final`` detector only for doubtful captures.
+
+    1. ``gate``: the peak deviation from the baseline of every channel must
+       exceed ``min_snr`` times its noise (median and MAD of the first
+       ``pre`` samples, at least ``min_noise``) and a DPE onset must be
+       found on every channel, otherwise the capture is rejected as
+       ``"weak"``.  A channel with more than ``max_clipped`` samples inside
+       flat runs (within ``clip_tol``) at its extremes is rejected as
+       ``"clipped"``.
+    2. ``sharpness``: cross-correlation of the pairs with channel 1
+       (:func:`gcc_phat.gcc_phat` with ``weighting="cc"``), normalised to a
+       correlation coefficient.  If the lowest peak is below ``reject_peak``
+       the capture is rejected as ``"ambiguous"``; if it is above
+       ``accept_peak`` and the delays agree with the DPE onsets within
+       ``agree_samples``, they are accepted.
+    3. ``final``: anything else is passed to ``final`` (with
+       ``final_params``).
+
+    :meth:`stats` counts the outcomes and the time spent in each stage.
+    """
+
+    name = "cascade"
+    params = {
+        "final": "wavelet",
+        "final_params": {},
+        "min_snr": 5.0,
+        "min_noise": 0.01,
+        "pre": None,
+        "level": 0.35,
+        "max_clipped": 2,
+        "clip_tol": 0.005,
+        "reject_peak": 0.3,
+        "accept_peak": 0.8,
+        "agree_samples": 2.0,
+    }
+    STAGES = ("gate", "sharpness", "final")
+    OUTCOMES = ("weak", "clipped", "ambiguous", "accepted", "escalated")
+
+    def __init__(self, geometry=None, **params):
+        super().__init__(geometry, **params)
+        s = self.settings
+        self.final = get_detector(s["final"], geometry, **(s["final_params"] or {}))
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self._counts = dict.fromkeys(self.OUTCOMES, 0)
+            self._times = dict.fromkeys(self.STAGES, 0.0)
+
+    def stats(self):
+        """Return the count and fraction of every outcome and the mean time per stage.
+
+        ``time_ms`` is the mean time a capture reaching the stage spent in it.
+        """
+        with self._lock:
+            counts = dict(self._counts)
+            times = dict(self._times)
+        total = sum(counts.values())
+        reached = {
+            "gate": total,
+            "sharpness": total - counts["weak"] - counts["clipped"],
+            "final": counts["escalated"],
+        }
+        return {
+            "events": total,
+            "outcomes": {k: {"count": n, "fraction": n / total if total else 0.0} for k, n in counts.items()},
+            "stages": {
+                k: {"events": reached[k], "time_ms": 1e3 * times[k] / reached[k] if reached[k] else 0.0}
+                for k in self.STAGES
+            },
+        }
+
+    def _done(self, outcome, times):
+        metrics.count("cascade." + outcome)
+        with self._lock:
+            self._counts[outcome] += 1
+            for stage, t in zip(self.STAGES, times):
+                self._times[stage] += t
+
+    def _reject(self, sigs, reason, times):
+        self._done(reason, times)
+        return DetectionResult(np.full(sigs.shape[0] - 1, np.nan), None, 0.0, rejected=reason)
+
+    def _clipped(self, sigs):
+        tol = self.settings["clip_tol"]
+        flat = np.abs(np.diff(sigs, axis=1)) <= tol
+        runs = flat[:, 1:] & flat[:, :-1]
+        top = sigs[:, 1:-1] >= sigs.max(axis=1, keepdims=True) - tol
+        bottom = sigs[:, 1:-1] <= sigs.min(axis=1, keepdims=True) + tol
+        return (runs & (top | bottom)).sum(axis=1)
+
+    def run(self, sigs, fs, state):
+        s = self.settings
+        n = sigs.shape[1]
+        t0 = time.perf_counter()
+        pre = max(4, n // 10) if s["pre"] is None else s["pre"]
+        base, noise = _noise_floor(sigs[:, :pre])
+        snr = np.abs(sigs - base[:, None]).max(axis=1) / np.maximum(noise, s["min_noise"])
+        onsets = dpe_onsets(sigs, s["level"], pre=pre)
+        if (snr < s["min_snr"]).any() or np.isnan(onsets).any():
+            return self._reject(sigs, "weak", (time.perf_counter() - t0,))
+        if (self._clipped(sigs) > s["max_clipped"]).any():
+            return self._reject(sigs, "clipped", (time.perf_counter() - t0,))
+
+        t1 = time.perf_counter()
+        coords = (None,) * 3 if self.geometry is None else self.geometry.T
+        res = gcc_phat(sigs, fs, *coords, weighting="cc")
+        ref = res.pairs[:, 0] == 0
+        centred = sigs - sigs.mean(axis=1, keepdims=True)
+        energy = (centred * centred).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            peaks = np.nan_to_num(res.peaks[ref] / np.sqrt(energy[0] * energy[1:]))
+        delays = res.delays[ref]
+        if peaks.min() < s["reject_peak"]:
+            return self._reject(sigs, "ambiguous", (t1 - t0, time.perf_counter() - t1))
+        onset_delays = (onsets[0] - onsets[1:]) / fs
+        if peaks.min() >= s["accept_peak"] and (
+            np.abs(delays - onset_delays) <= s["agree_samples"] / fs
+        ).all():
+            self._done("accepted", (t1 - t0, time.perf_counter() - t1))
+            return DetectionResult(delays, res.curves[ref], float(peaks.min()))
+
+        t2 = time.perf_counter()
+        result = self.final.detect(sigs, fs)
+        self._done("escalated", (t1 - t0, t2 - t1, time.perf_counter() - t2))
+        return result
@@ -1,29 +1,160 @@
+from typing import NamedTuple
+
 import numpy as np
 
+from deinterleave import as_channels
+
+
+def _noise_floor(segment):
+    """Return the per-channel ``(baseline, noise)`` of a quiet segment."""
+    baseline = np.median(segment, axis=1)
+    noise = 1.4826 * np.median(np.abs(segment - baseline[:, None]), axis=1)
+    return baseline, noise
+
+
+def _interpolate(dev, idx, thr):
+    """Sub-sample position where ``dev`` rises through ``thr`` before ``idx``."""
+    rows = np.arange(len(idx))
+    before = dev[rows, idx - 1]
+    after = dev[rows, idx]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = (thr - before) / (after - before)
+    frac = np.where(np.isfinite(frac), np.clip(frac, 0.0, 1.0), 1.0)
+    return idx - 1 + frac
 
-def dpe_detection(s1, s2, s3, s4, fs, level=0.35):
-    """Simple amplitude threshold detection used in the MATLAB DPE script."""
-    s1 = np.asarray(s1)
-    s2 = np.asarray(s2)
-    s3 = np.asarray(s3)
-    s4 = np.asarray(s4)
 
-    def first_idx(sig):
-        for i, v in enumerate(sig[4:], start=4):
-            if abs(v - 1.4) > level:
-                return i
-        return 0
+def dpe_onsets(sigs, level=0.35, baseline=None, pre=None, nsigma=5.0, start=4):
+    """Return the onset of every channel in (fractional) samples.
 
-    n1 = first_idx(s1)
-    n2 = first_idx(s2)
-    n3 = first_idx(s3)
-    n4 = first_idx(s4)
+    A channel starts when it departs from its baseline by more than
+    ``max(level, nsigma * noise)``.  The baseline and noise are the median
+    and the scaled median absolute deviation of the first ``pre`` samples
+    (a tenth of the capture by default); a fixed ``baseline`` voltage can be
+    given instead, as the MATLAB script used with 1.4 V.  The crossing is
+    interpolated linearly between samples.  Channels without an onset get
+    ``NaN``.
+    """
+    sigs = as_channels(sigs)
+    n = sigs.shape[1]
+    if baseline is None:
+        pre = max(start, n // 10) if pre is None else pre
+        base, noise = _noise_floor(sigs[:, :pre])
+        thr = np.maximum(level, nsigma * noise)
+    else:
+        base = np.broadcast_to(np.asarray(baseline, dtype=float), sigs.shape[:1])
+        thr = np.full(sigs.shape[0], float(level))
 
-    if not any([n1, n2, n3, n4]):
+    dev = np.abs(sigs - base[:, None])
+    above = dev[:, start:] > thr[:, None]
+    found = above.any(axis=1)
+    idx = np.argmax(above, axis=1) + start
+    onsets = np.where(found, _interpolate(dev, np.maximum(idx, 1), thr), np.nan)
+    return onsets
+
+
+def dpe_detection(sigs, fs, level=0.35, baseline=None, pre=None):
+    """Simple amplitude threshold detection used in the MATLAB DPE script.
+
+    ``sigs`` is the ``(channels, N)`` sample matrix.  See :func:`dpe_onsets`
+    for the meaning of ``level``, ``baseline`` and ``pre``.
+    """
+    onsets = dpe_onsets(sigs, level, baseline, pre)
+    if np.isnan(onsets).all():
         # If no event was detected return zeros to avoid division by zero
         return 0.0, 0.0, 0.0
+    onsets = np.nan_to_num(onsets)
+    td12, td13, td14 = (onsets[0] - onsets[1:]) / fs
+    return float(td12), float(td13), float(td14)
+
+
+class Onset(NamedTuple):
+    """Onset reported by :class:`StreamingOnsetDetector`."""
+
+    channel: int
+    index: float
+
+
+class StreamingOnsetDetector:
+    """Report channel onsets as samples arrive.
+
+    The first ``warmup`` samples set the baseline and noise floor of every
+    channel.  Afterwards each :meth:`update` returns the onsets found in the
+    new block, with the same threshold and interpolation as
+    :func:`dpe_onsets`.  A channel is re-armed once it has stayed below the
+    threshold for ``holdoff`` samples.  The baseline keeps following slow
+    drifts while a channel is quiet.
+    """
+
+    def __init__(self, channels=4, level=0.35, nsigma=5.0, warmup=100, holdoff=50, drift=1e-3):
+        self.channels = channels
+        self.level = level
+        self.nsigma = nsigma
+        self.warmup = warmup
+        self.holdoff = holdoff
+        self.drift = drift
+        self.total = 0
+        self.baseline = None
+        self.threshold = None
+        self._warm = []
+        self._armed = np.ones(channels, dtype=bool)
+        self._quiet = np.zeros(channels, dtype=int)
+        self._last_dev = np.zeros(channels)
+
+    def update(self, block):
+        """Process a ``(channels, n)`` block and return a list of :class:`Onset`."""
+        block = as_channels(block)
+        self.total += block.shape[1]
+        if self.baseline is None:
+            self._warm.append(block)
+            warm = np.concatenate(self._warm, axis=1)
+            if warm.shape[1] < self.warmup:
+                return []
+            self._warm = []
+            self.baseline, noise = _noise_floor(warm[:, : self.warmup])
+            self.threshold = np.maximum(self.level, self.nsigma * noise)
+            self._last_dev = np.abs(warm[:, self.warmup - 1] - self.baseline)
+            block = warm[:, self.warmup :]
+        offset = self.total - block.shape[1]
+
+        onsets = []
+        for ch in range(self.channels):
+            onsets.extend(self._channel(ch, block[ch], offset))
+        onsets.sort(key=lambda o: o.index)
+        return onsets
 
-    td12 = (n1 - n2) / fs
-    td13 = (n1 - n3) / fs
-    td14 = (n1 - n4) / fs
-    return td12, td13, td14
+    def _channel(self, ch, sig, offset):
+        thr = self.threshold[ch]
+        dev = np.abs(sig - self.baseline[ch])
+        above = dev > thr
+        found = []
+        pos = 0
+        while pos < len(sig):
+            if self._armed[ch]:
+                hits = np.flatnonzero(above[pos:])
+                if not len(hits):
+                    # follow slow baseline drifts while the channel is quiet
+                    rate = min(1.0, self.drift * (len(sig) - pos))
+                    self.baseline[ch] += rate * (sig[pos:].mean() - self.baseline[ch])
+                    break
+                i = pos + hits[0]
+                before = dev[i - 1] if i > 0 else self._last_dev[ch]
+                frac = (thr - before) / (dev[i] - before) if dev[i] != before else 1.0
+                found.append(Onset(ch, float(offset + i - 1 + np.clip(frac, 0.0, 1.0))))
+                self._armed[ch] = False
+                self._quiet[ch] = 0
+                pos = i + 1
+            else:
+                # re-arm after ``holdoff`` consecutive quiet samples
+                loud = above[pos:]
+                idx = np.arange(len(loud))
+                last_loud = np.maximum.accumulate(np.where(loud, idx, -1))
+                run = np.where(last_loud < 0, idx + 1 + self._quiet[ch], idx - last_loud)
+                ready = np.flatnonzero(run >= self.holdoff)
+                if not len(ready):
+                    self._quiet[ch] = run[-1]
+                    break
+                self._armed[ch] = True
+                pos += ready[0] + 1
+        if len(sig):
+            self._last_dev[ch] = dev[-1]
+        return found
@@ -0,0 +1,144 @@
+"""Signal processing and localization without GUI or plotting dependencies.
+
+The names below are imported from their modules on first access (PEP 562
+module ``__getattr__``), so ``import localization_core`` costs next to
+nothing, and scipy, PyWavelets and sqlite3 are only loaded by the first
+function that needs them::
+
+    import localization_core as core
+
+    result = core.get_detector("wavelet")(sigs, fs)
+    x, y, z = core.TdoaSolver(core.MIC_X, core.MIC_Y, core.MIC_Z).localize(*result.delays)
+
+Running the module measures the import time of every core module in a
+fresh interpreter, on top of numpy, and fails if one exceeds
+``IMPORT_BUDGET_MS`` or loads one of the ``HEAVY`` libraries::
+
+    python localization_core.py
+"""
+
+import importlib
+import sys
+
+# Microphone coordinates in metres, microphone 1 is the reference
+MIC_X = [0, 0.17, 0.17, 0.72]
+MIC_Y = [0, 0, 0.85, 0.61]
+MIC_Z = [0, 0, 0, 0.13]
+
+_EXPORTS = {
+    "AcquisitionEngine": "acquisition",
+    "CaptureEvent": "acquisition",
+    "CaptureArchive": "capture_archive",
+    "corelatia": "compute_correlation",
+    "spectrogram_batch": "compute_spectogram",
+    "StreamingSpectrogram": "compute_spectogram",
+    "DetectionResult": "detectors",
+    "Detector": "detectors",
+    "available": "detectors",
+    "get_detector": "detectors",
+    "register": "detectors",
+    "EventQuery": "db_logger",
+    "EventStore": "db_logger",
+    "log_event": "db_logger",
+    "as_channels": "deinterleave",
+    "deinterleave": "deinterleave",
+    "FrameAssembler": "deinterleave",
+    "dpe_detection": "dpe",
+    "StreamingOnsetDetector": "dpe",
+    "gcc": "gcc_phat",
+    "gcc_phat": "gcc_phat",
+    "tdoa_gcc": "gcc_phat",
+    "rpa_detection": "rpa",
+    "AsciiDecoder": "serial_protocol",
+    "FrameDecoder": "serial_protocol",
+    "counts_to_volts": "serial_protocol",
+    "BandpassFilter": "signal_filter",
+    "butter_bandpass_filter": "signal_filter",
+    "ReplaySource": "sources",
+    "SampleSource": "sources",
+    "SerialSource": "sources",
+    "SyntheticSource": "sources",
+    "SrpLocalizer": "srp_phat",
+    "TdoaSolver": "tdoa",
+    "tdoa": "tdoa",
+    "cwt_detection_curves": "wavelet_analysis",
+    "wavelet_detection": "wavelet_analysis",
+}
+
+__all__ = ["MIC_X", "MIC_Y", "MIC_Z", *sorted(_EXPORTS)]
+
+MODULES = ("metrics", *sorted(set(_EXPORTS.values())))
+# Libraries that importing a core module must not load
+HEAVY = ("matplotlib", "tkinter", "scipy", "pywt")
+# Import time of one core module on top of numpy
+IMPORT_BUDGET_MS = 25.0
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
+
+_PROBE = """
+import sys, time
+import numpy
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(1e3 * elapsed, *heavy)
+"""
+
+
+def measure_imports(modules=MODULES):
+    """Return ``{module: (milliseconds, heavy libraries loaded)}``.
+
+    Every module is imported in a new interpreter after numpy, which all
+    of them need, so the times do not depend on the import order.
+    """
+    import subprocess
+
+    results = {}
+    for module in modules:
+        out = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY)],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        results[module] = (float(out[0]), out[1:])
+    return results
+
+
+def check_import_budget(budget_ms=IMPORT_BUDGET_MS, modules=MODULES):
+    """Return the list of ``(module, milliseconds, heavy)`` over budget."""
+    return [
+        (module, ms, heavy)
+        for module, (ms, heavy) in measure_imports(modules).items()
+        if ms > budget_ms or heavy
+    ]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    budget = float(argv[0]) if argv else IMPORT_BUDGET_MS
+    failures = 0
+    for module, (ms, heavy) in measure_imports().items():
+        ok = ms <= budget and not heavy
+        failures += not ok
+        note = "" if ok else "  OVER BUDGET" if not heavy else "  loads " + ", ".join(heavy)
+        print(f"{module:<20}{ms:8.1f} ms{note}")
+    print(f"budget {budget:g} ms per module: {'ok' if not failures else f'{failures} failing'}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
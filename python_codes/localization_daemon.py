@@ -0,0 +1,412 @@
+"""Headless localization service.
+
+Runs acquisition, detection, localization and logging in a loop without
+Tk or matplotlib, and publishes every event as one JSON line to all the
+clients connected to a local Unix or TCP socket::
+
+    python localization_daemon.py daemon.json
+    socat - UNIX-CONNECT:/tmp/localization.sock
+
+The configuration is a JSON object overriding ``DEFAULT_CONFIG``; it is read
+again on ``SIGHUP``, and ``SIGTERM``/``SIGINT`` stop the service cleanly.
+``source`` is a serial port name, ``"synthetic"`` or ``"replay:<archive>"``;
+``listen`` is ``"unix:<path>"`` or ``"tcp:<host>:<port>"``.
+
+Memory stays bounded however long it runs: samples live in the ring buffer
+of the :class:`acquisition.AcquisitionEngine`, captures waiting for
+processing in its bounded queue, and each subscriber has a bounded output
+buffer; a subscriber that stops reading is disconnected.
+
+With ``metrics_interval`` set, the :mod:`metrics` snapshot (latency of every
+stage, samples and events per second) is logged as JSON at that period.
+"""
+
+import json
+import logging
+import os
+import selectors
+import signal
+import socket
+import sys
+import time
+
+import numpy as np
+
+import metrics
+from acquisition import AcquisitionEngine
+from capture_archive import CaptureArchive
+from db_logger import DB_PATH, EventStore
+from detectors import get_detector
+from sources import ReplaySource, SerialSource, SyntheticSource
+from tdoa import TdoaSolver
+
+log = logging.getLogger("localization_daemon")
+
+DEFAULT_CONFIG = {
+    "source": "COM6",
+    "baud": 115200,
+    "binary": False,
+    "fs": 1000,
+    "method": "gcc",
+    # parameters of the method, see ``detectors``
+    "method_params": {},
+    "threshold": 1.75,
+    "pre": 200,
+    "post": 200,
+    "mics": {"x": [0, 0.17, 0.17, 0.72], "y": [0, 0, 0.85, 0.61], "z": [0, 0, 0, 0.13]},
+    "listen": "unix:/tmp/localization.sock",
+    "db_path": DB_PATH,
+    "archive": None,
+    # seconds between two metrics dumps in the log, 0 to disable
+    "metrics_interval": 0,
+}
+# Settings that require reopening the sample source
+SOURCE_KEYS = ("source", "baud", "binary", "fs", "pre", "post")
+# Bytes queued for one subscriber before it is considered stuck
+MAX_CLIENT_BUFFER = 1 << 20
+
+
+def load_config(path=None):
+    """Return ``DEFAULT_CONFIG`` updated with the JSON file at ``path``."""
+    config = json.loads(json.dumps(DEFAULT_CONFIG))
+    if path is not None:
+        with open(path) as f:
+            config.update(json.load(f))
+    return config
+
+
+def open_source(config):
+    """Return the :class:`sources.SampleSource` described by ``config``."""
+    name = config["source"]
+    if name == "synthetic":
+        return SyntheticSource(fs=config["fs"], speed=1.0)
+    if name.startswith("replay:"):
+        return ReplaySource(name[len("replay:"):], gap=config["pre"] + config["post"], speed=1.0)
+    return SerialSource(name, config["fs"], binary=config["binary"], baud=config["baud"])
+
+
+def _finite(value):
+    """Return ``value`` as a float, or ``None`` (JSON ``null``) if it is NaN or infinite."""
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+class Localizer:
+    """Turn a capture into source coordinates with the configured method."""
+
+    def __init__(self, config):
+        mics = config["mics"]
+        self.method = config["method"]
+        self.geometry = np.column_stack((mics["x"], mics["y"], mics["z"]))
+        self.detector = get_detector(self.method, self.geometry, **config["method_params"])
+        self.solver = TdoaSolver(mics["x"], mics["y"], mics["z"])
+
+    def __call__(self, sigs, fs):
+        """Return ``((x, y, z), result)`` with the :class:`detectors.DetectionResult`.
+
+        The coordinates are ``None`` if the detector rejected the capture.
+        """
+        result = self.detector.detect(sigs, fs)
+        if result.rejected:
+            return None, result
+        if result.position is not None:
+            return tuple(result.position), result
+        with metrics.stage("tdoa"):
+            return self.solver.localize(*result.delays), result
+
+
+class EventPublisher:
+    """Send JSON lines to every client of a listening socket.
+
+    Everything runs in the caller's thread: :meth:`poll` accepts clients and
+    flushes pending output without blocking, :meth:`publish` queues a line
+    for all clients.
+    """
+
+    def __init__(self, address, max_buffer=MAX_CLIENT_BUFFER):
+        self.address = address
+        self.max_buffer = max_buffer
+        self._selector = selectors.DefaultSelector()
+        self._clients = {}
+        self.server = self._listen(address)
+        self._selector.register(self.server, selectors.EVENT_READ)
+
+    @staticmethod
+    def _listen(address):
+        kind, _, where = address.partition(":")
+        if kind == "unix":
+            if os.path.exists(where):
+                os.unlink(where)
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(where)
+        elif kind == "tcp":
+            host, _, port = where.rpartition(":")
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((host or "127.0.0.1", int(port)))
+        else:
+            raise ValueError(f"Unknown address: {address}")
+        server.listen()
+        server.setblocking(False)
+        return server
+
+    @property
+    def clients(self):
+        return len(self._clients)
+
+    def poll(self, timeout=0):
+        """Accept new clients, drop closed ones and send pending output."""
+        for key, mask in self._selector.select(timeout):
+            sock = key.fileobj
+            if sock is self.server:
+                try:
+                    client, _ = self.server.accept()
+                except BlockingIOError:
+                    continue
+                client.setblocking(False)
+                self._clients[client] = bytearray()
+                self._selector.register(client, selectors.EVENT_READ)
+                log.info("subscriber connected (%d)", len(self._clients))
+            elif mask & selectors.EVENT_READ:
+                # subscribers do not talk; readable means closed (or junk)
+                try:
+                    if not sock.recv(4096):
+                        self._drop(sock)
+                        continue
+                except OSError:
+                    self._drop(sock)
+                    continue
+            if sock in self._clients and mask & selectors.EVENT_WRITE:
+                self._flush(sock)
+
+    def publish(self, message):
+        """Queue ``message`` (JSON-serialisable) as one line for every client.
+
+        NaN and infinity are not valid JSON and raise ``ValueError``.
+        """
+        line = (json.dumps(message, allow_nan=False) + "\n").encode()
+        for sock in list(self._clients):
+            self._clients[sock] += line
+            self._flush(sock)
+
+    def _flush(self, sock):
+        buf = self._clients[sock]
+        try:
+            sent = sock.send(buf) if buf else 0
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._drop(sock)
+            return
+        del buf[:sent]
+        if len(buf) > self.max_buffer:
+            log.warning("dropping a subscriber that does not keep up")
+            self._drop(sock)
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if buf else 0)
+        self._selector.modify(sock, events)
+
+    def _drop(self, sock):
+        self._clients.pop(sock, None)
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        sock.close()
+
+    def close(self):
+        for sock in list(self._clients):
+            self._drop(sock)
+        self._selector.unregister(self.server)
+        self.server.close()
+        self._selector.close()
+        kind, _, where = self.address.partition(":")
+        if kind == "unix" and os.path.exists(where):
+            os.unlink(where)
+
+
+class LocalizationDaemon:
+    """The service loop; see the module docstring."""
+
+    def __init__(self, config_path=None):
+        self.config_path = config_path
+        self.config = load_config(config_path)
+        self.engine = None
+        self.publisher = None
+        self.store = None
+        self.archive = None
+        self.events = 0
+        self.rejected = 0
+        self._reload = False
+        self._stop = False
+        self._apply(self.config, None)
+
+    def _apply(self, new, old):
+        """Switch from ``old`` to ``new``, rebuilding only the affected parts.
+
+        Every new part is built before anything is replaced, so when one of
+        them fails (a port that cannot be opened, an unknown method
+        parameter) the exception propagates and the running parts are left
+        untouched.  A serial port that is reopened with new settings is
+        therefore open twice for a moment.
+        """
+        restart = old is None or any(new[k] != old[k] for k in SOURCE_KEYS)
+        relisten = old is None or new["listen"] != old["listen"]
+        reopen = old is None or new["db_path"] != old["db_path"]
+        built = []
+        try:
+            localizer = Localizer(new)
+            engine = publisher = store = None
+            if restart:
+                source = open_source(new)
+                built.append(source)
+                engine = AcquisitionEngine(
+                    source, new["fs"], new["threshold"], new["pre"], new["post"]
+                )
+            if relisten:
+                publisher = EventPublisher(new["listen"])
+                built.append(publisher)
+            if reopen:
+                store = EventStore(new["db_path"])
+                built.append(store)
+            archive = self.archive
+            if old is None or new["archive"] != old["archive"]:
+                archive = CaptureArchive(new["archive"]) if new["archive"] else None
+        except Exception:
+            for part in reversed(built):
+                part.close()
+            raise
+
+        if engine is not None:
+            if self.engine is not None:
+                self.engine.stop()
+                self.engine.source.close()
+            self.engine = engine
+            self.engine.start()
+        self.engine.threshold = new["threshold"]
+        if publisher is not None:
+            if self.publisher is not None:
+                self.publisher.close()
+            self.publisher = publisher
+        if store is not None:
+            if self.store is not None:
+                self.store.close()
+            self.store = store
+        self.archive = archive
+        if new["metrics_interval"]:
+            metrics.enable()
+        elif old is not None and old["metrics_interval"]:
+            metrics.enable(False)
+        self._next_metrics = time.monotonic() + new["metrics_interval"]
+        self.localizer = localizer
+        self.config = new
+
+    def reload(self):
+        """Read the configuration file again and apply the changes."""
+        try:
+            new = load_config(self.config_path)
+            self._apply(new, self.config)
+        except Exception:
+            log.exception("configuration reload failed, keeping the previous one")
+            return
+        log.info("configuration reloaded")
+
+    def install_signal_handlers(self):
+        def on_hup(signum, frame):
+            self._reload = True
+
+        def on_term(signum, frame):
+            self._stop = True
+
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, on_hup)
+        signal.signal(signal.SIGTERM, on_term)
+        signal.signal(signal.SIGINT, on_term)
+
+    def stop(self):
+        self._stop = True
+
+    def process(self, event):
+        """Localize, log, archive and publish one capture; return the message.
+
+        Captures rejected by the detector, or whose position could not be
+        solved (non-finite coordinates), are only counted, and ``None`` is
+        returned.  Non-finite delays or quality are sent as ``null``.
+        """
+        fs = self.engine.fs
+        start = time.perf_counter()
+        coords, result = self.localizer(event.samples, fs)
+        if coords is None or not np.isfinite(coords).all():
+            self.rejected += 1
+            return None
+        capture_id = None
+        if self.archive is not None:
+            capture_id = self.archive.append(
+                event.samples, fs, event.trigger_index, self.localizer.geometry, event.timestamp
+            )
+        x, y, z = (float(c) for c in coords)
+        stamp = self.store.log(event.amplitude, x, y, z, capture_id=capture_id)
+        self.events += 1
+        message = {
+            "timestamp": stamp,
+            "time": event.timestamp,
+            "method": self.localizer.method,
+            "x": x,
+            "y": y,
+            "z": z,
+            "amplitude": event.amplitude,
+            "delays": [_finite(d) for d in result.delays],
+            "quality": _finite(result.quality),
+            "capture_id": capture_id,
+            "processing_ms": 1e3 * (time.perf_counter() - start),
+            "dropped_events": self.engine.dropped_events,
+            "rejected_events": self.rejected,
+        }
+        self.publisher.publish(message)
+        return message
+
+    def run(self):
+        """Process captures until :meth:`stop` or a termination signal."""
+        log.info("listening on %s, method %s", self.config["listen"], self.config["method"])
+        try:
+            while not self._stop:
+                if self._reload:
+                    self._reload = False
+                    self.reload()
+                self.publisher.poll()
+                interval = self.config["metrics_interval"]
+                if interval and time.monotonic() >= self._next_metrics:
+                    self._next_metrics += interval
+                    log.info("metrics %s", json.dumps(metrics.snapshot()))
+                if self.engine.error is not None:
+                    raise self.engine.error
+                if self.engine.finished and self.engine.events.empty():
+                    log.info("sample source exhausted")
+                    break
+                event = self.engine.get_event(timeout=0.1)
+                if event is None:
+                    continue
+                try:
+                    self.process(event)
+                except Exception:
+                    log.exception("processing an event failed")
+        finally:
+            self.close()
+
+    def close(self):
+        self.engine.stop()
+        self.engine.source.close()
+        self.publisher.close()
+        self.store.close()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    daemon = LocalizationDaemon(argv[0] if argv else None)
+    daemon.install_signal_handlers()
+    daemon.run()
+
+
+if __name__ == "__main__":
+    main()
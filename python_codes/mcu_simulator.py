@@ -7,11 +7,24 @@ from typing import Sequence
 import numpy as np
 import serial
 
+from serial_protocol import FRAME_MARKER, encode_frames, volts_to_counts
+
 
 def main():
     """Send pre-generated signals with delays to the specified serial port."""
 
-    port = sys.argv[1] if len(sys.argv) > 1 else "COM11"
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    port = args[0] if args else "COM11"
+    binary = "--binary" in sys.argv
+    # ASCII mode only: send a frame marker line before each set of samples
+    markers = "--markers" in sys.argv
+    opts = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    # per-channel delays in seconds, e.g. --delays=0,0.0005,0.001,0.0015
+    delays = tuple(float(d) for d in opts.get("delays", "0,0.0005,0.001,0.0015").split(","))
+    # binary mode only: send a tone burst every PERIOD seconds of host time
+    # instead of the continuous sine, so that several simulators emit
+    # coincident events
+    pulse = float(opts["pulse"]) if "pulse" in opts else None
     baud = 115200
 
     def generate_signals(
@@ -32,17 +45,64 @@ def main():
             signals.append(voltage)
         return np.array(signals)
 
+    def pulse_signals(
+        t: np.ndarray,
+        period: float,
+        freq: float = 200.0,
+        delays: Sequence[float] = (0.0, 0.0005, 0.001, 0.0015),
+        width: float = 0.003,
+    ) -> np.ndarray:
+        """Short Gaussian tone bursts centred on the multiples of ``period`` of ``t``."""
+
+        signals = []
+        for d in delays:
+            # time since the middle of the nearest burst
+            u = (t - d + period / 2) % period - period / 2
+            burst = np.exp(-0.5 * (u / width) ** 2) * np.sin(2 * np.pi * freq * u)
+            signals.append(np.clip(1.65 + 1.5 * burst, 0, 3.3))
+        return np.array(signals)
+
     fs = 1000
-    sigs = generate_signals(fs=fs)
+    sigs = generate_signals(fs=fs, delays=delays)
     samples = sigs.shape[1]
 
     ser = serial.Serial(port, baudrate=baud)
-    print(f"Sending data on {port} at {baud} baud")
+    mode = "binary frames" if binary else "ASCII"
+    print(f"Sending {mode} on {port} at {baud} baud")
     sys.stdout.flush()
 
     try:
+        if binary and pulse is not None:
+            # Paced on the host clock, so the bursts of every simulator
+            # started on this machine line up.
+            block = max(1, fs // 100)
+            start = time.time()
+            seq = 0
+            while True:
+                t = start + (seq + np.arange(block)) / fs
+                frames = encode_frames(volts_to_counts(pulse_signals(t, pulse, delays=delays)), seq)
+                seq += block
+                # like the board, send the samples once they are acquired
+                delay = start + seq / fs - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                ser.write(frames)
+        if binary:
+            # Send 10 ms worth of frames per write; the sequence counter keeps
+            # running across repetitions of the signal.
+            counts = volts_to_counts(sigs)
+            block = max(1, fs // 100)
+            seq = 0
+            while True:
+                for i in range(0, samples, block):
+                    chunk = counts[:, i : i + block]
+                    ser.write(encode_frames(chunk, seq))
+                    seq += chunk.shape[1]
+                    time.sleep(chunk.shape[1] / fs)
         while True:
             for i in range(samples):
+                if markers:
+                    ser.write(FRAME_MARKER + b"\r\n")
                 for ch in range(sigs.shape[0]):
                     line = f"{sigs[ch, i]:.2f}\r\n".encode()
                     ser.write(line)
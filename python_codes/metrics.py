@@ -0,0 +1,256 @@
+"""Latency histograms and counters of the localization pipeline.
+
+The pipeline stages (serial read, decoding, de-interleaving, filtering, the
+delay detector, the TDOA solver and the event log) are timed with::
+
+    with metrics.stage("tdoa"):
+        xs, ys, zs = solver.localize(td1, td2, td3)
+
+and throughput is counted with ``metrics.count("samples", n)``.  Collection
+is off by default; while it is off :func:`stage` returns a shared no-op
+context manager and :func:`count` returns at once, so the instrumentation
+can stay in the hot paths.  Turn it on with :func:`enable` or by setting the
+``LOCALIZATION_METRICS`` environment variable.
+
+:func:`snapshot` returns the current figures as a dictionary, :func:`dump`
+writes them as text or JSON, and :func:`start_reporter` dumps them
+periodically from a background thread.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds in seconds of the histogram buckets: 8 per decade from 1 us
+# to 10 s, the last bucket collects everything slower
+BOUNDS = tuple(10 ** (k / 8) for k in range(-48, 9))
+QUANTILES = (0.5, 0.9, 0.99)
+
+_NULL = contextlib.nullcontext()
+
+
+class Histogram:
+    """Counts of durations in the logarithmic ``BOUNDS`` buckets."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.buckets[bisect_left(BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket holding the ``q`` quantile.
+
+        The result is accurate to the bucket width (about 33 %) and never
+        exceeds the largest recorded value.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for k, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(BOUNDS[k] if k < len(BOUNDS) else self.max, self.max)
+        return self.max
+
+    def summary(self):
+        """Return the count and the latencies in milliseconds."""
+        out = {"count": self.count}
+        if self.count:
+            out["mean_ms"] = 1e3 * self.total / self.count
+            for q in QUANTILES:
+                out["p%d_ms" % round(100 * q)] = 1e3 * self.quantile(q)
+            out["min_ms"] = 1e3 * self.min
+            out["max_ms"] = 1e3 * self.max
+        return out
+
+
+class _Timer:
+    __slots__ = ("registry", "name", "start")
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.record(self.name, time.perf_counter() - self.start)
+
+
+class Metrics:
+    """A set of stage histograms and counters, safe to update from any thread."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        with self._lock:
+            self._stages = {}
+            self._counters = {}
+            self._start = time.monotonic()
+            self._last = (self._start, {})
+
+    def stage(self, name):
+        """Return a context manager recording its duration under ``name``."""
+        if not self.enabled:
+            return _NULL
+        return _Timer(self, name)
+
+    def record(self, name, seconds):
+        """Add a duration of ``seconds`` to the histogram of stage ``name``."""
+        if not self.enabled:
+            return
+        with self._lock:
+            hist = self._stages.get(name)
+            if hist is None:
+                hist = self._stages[name] = Histogram()
+            hist.record(seconds)
+
+    def count(self, name, n=1):
+        """Add ``n`` to the counter ``name``."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def snapshot(self):
+        """Return the stage latencies and the counters with their rates.
+
+        ``rate`` is per second since the previous snapshot, ``mean_rate``
+        since the last :meth:`reset`.
+        """
+        now = time.monotonic()
+        with self._lock:
+            stages = {name: hist.summary() for name, hist in sorted(self._stages.items())}
+            counters = dict(self._counters)
+            last_time, last_counters = self._last
+            self._last = (now, counters)
+        uptime = now - self._start
+        interval = now - last_time
+        return {
+            "uptime_s": uptime,
+            "stages": stages,
+            "counters": {
+                name: {
+                    "total": total,
+                    "rate": (total - last_counters.get(name, 0)) / interval if interval else 0.0,
+                    "mean_rate": total / uptime if uptime else 0.0,
+                }
+                for name, total in sorted(counters.items())
+            },
+        }
+
+
+def format_text(snap):
+    """Return a snapshot as an aligned text table."""
+    lines = [f"uptime {snap['uptime_s']:.1f} s"]
+    if snap["stages"]:
+        lines.append(
+            f"{'stage':<20}{'count':>10}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}  [ms]"
+        )
+        for name, s in snap["stages"].items():
+            values = "".join(
+                f"{s.get(key, 0):>10.3f}" for key in ("mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms")
+            )
+            lines.append(f"{name:<20}{s['count']:>10}{values}")
+    if snap["counters"]:
+        lines.append(f"{'counter':<20}{'total':>14}{'rate/s':>14}{'mean/s':>14}")
+        for name, c in snap["counters"].items():
+            lines.append(f"{name:<20}{c['total']:>14.0f}{c['rate']:>14.1f}{c['mean_rate']:>14.1f}")
+    return "\n".join(lines)
+
+
+class Reporter:
+    """Background thread calling :func:`dump` every ``interval`` seconds."""
+
+    def __init__(self, registry, interval=10.0, stream=None, fmt="text"):
+        self.registry = registry
+        self.interval = interval
+        self.stream = stream
+        self.fmt = fmt
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            dump(self.stream, self.fmt, self.registry)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+METRICS = Metrics(enabled=bool(os.environ.get("LOCALIZATION_METRICS")))
+
+
+def enable(on=True):
+    """Turn collection on (or off with ``on=False``).
+
+    Turning it on starts from an empty registry, so the rates cover only
+    the time it has been on.
+    """
+    if on and not METRICS.enabled:
+        METRICS.reset()
+    METRICS.enabled = on
+
+
+def enabled():
+    return METRICS.enabled
+
+
+def stage(name):
+    """Time a ``with`` block as stage ``name`` of the global registry."""
+    return METRICS.stage(name)
+
+
+def count(name, n=1):
+    """Add ``n`` to the counter ``name`` of the global registry."""
+    METRICS.count(name, n)
+
+
+def snapshot():
+    """Return :meth:`Metrics.snapshot` of the global registry."""
+    return METRICS.snapshot()
+
+
+def dump(stream=None, fmt="text", registry=None):
+    """Write a snapshot to ``stream`` (``sys.stderr`` by default) as ``"text"`` or ``"json"``."""
+    snap = (registry or METRICS).snapshot()
+    stream = sys.stderr if stream is None else stream
+    if fmt == "json":
+        stream.write(json.dumps(snap) + "\n")
+    else:
+        stream.write(format_text(snap) + "\n")
+    stream.flush()
+    return snap
+
+
+def start_reporter(interval=10.0, stream=None, fmt="text"):
+    """Enable collection and dump the global registry every ``interval`` seconds.
+
+    Returns the :class:`Reporter`; call its ``stop`` method to end it.
+    """
+    enable()
+    return Reporter(METRICS, interval, stream, fmt)
@@ -0,0 +1,732 @@
+"""Concurrent acquisition from several boards and fusion of their events.
+
+Every node is one microcontroller with its own microphone array, connected
+to its own serial port.  All ports are read from a single asyncio event
+loop: each file descriptor is registered with ``loop.add_reader`` and read
+without blocking when bytes arrive, so a slow or silent board never delays
+the others.  Detection runs in a thread pool.
+
+The streams are put on a common time base in two steps:
+
+* the sequence counter of the binary frames gives the absolute index of
+  every sample; frames lost on the link are replaced by the previous sample
+  so that the indices stay contiguous, and
+* a :class:`StreamClock` per node maps these indices to host time.
+
+Triggered captures are localized per node, and captures of different nodes
+whose trigger times fall within ``window`` seconds are grouped as one
+acoustic event.  The delays measured by each array are then solved jointly
+for a single position (:func:`fuse`).  The host clocks of the nodes only
+agree to about a millisecond, so delays between microphones of different
+nodes are not used.
+
+The configuration is a JSON object overriding ``DEFAULT_CONFIG``, with one
+entry per node in ``nodes``; the microphone coordinates of every node are in
+the shared frame (``mics``, or the default array moved by ``offset``)::
+
+    python multinode.py nodes.json
+
+``--simulate=N`` runs ``N`` instances of ``mcu_simulator.py`` on local
+pseudo-terminal pairs, one node each, and fuses their bursts::
+
+    python multinode.py --simulate=3 --source=1.2,0.8,0.3
+
+The event loop needs file descriptors it can poll, so this module works on
+POSIX systems only.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+
+import metrics
+from acquisition import AcquisitionEngine
+from deinterleave import FrameAssembler
+from detectors import get_detector
+from serial_protocol import CHANNELS, AsciiDecoder, FrameDecoder, counts_to_volts
+from sources import SampleSource
+from tdoa import TdoaSolver
+
+log = logging.getLogger("multinode")
+
+DEFAULT_MICS = {"x": [0, 0.17, 0.17, 0.72], "y": [0, 0, 0.85, 0.61], "z": [0, 0, 0, 0.13]}
+
+DEFAULT_CONFIG = {
+    "nodes": [],
+    "baud": 115200,
+    "binary": True,
+    "fs": 1000,
+    "method": "gcc",
+    # parameters of the method, see ``detectors``
+    "method_params": {},
+    "threshold": 1.75,
+    "pre": 200,
+    "post": 200,
+    # seconds between the triggers of one event on different nodes
+    "window": 0.05,
+    # seconds to wait for the other nodes before closing a group
+    "latency": 0.5,
+    # nodes that must see an event for it to be fused
+    "min_nodes": 2,
+    # largest RMS range-difference residual in metres of a fused position
+    "max_residual": 0.1,
+    # seconds of arrivals over which each node's clock offset is estimated
+    "clock_window": 10.0,
+    # captures of one node waiting for detection before new ones are dropped
+    "max_pending": 8,
+    "workers": None,
+}
+# Keys of a node entry; the others fall back to the global settings
+NODE_DEFAULTS = {"name": None, "port": None, "mics": None, "offset": [0, 0, 0]}
+
+
+def load_config(path=None):
+    """Return ``DEFAULT_CONFIG`` updated with the JSON file at ``path``."""
+    config = json.loads(json.dumps(DEFAULT_CONFIG))
+    if path is not None:
+        with open(path) as f:
+            config.update(json.load(f))
+    return config
+
+
+def node_geometry(node):
+    """Return the ``(channels, 3)`` microphone positions of a node entry."""
+    mics = node.get("mics") or DEFAULT_MICS
+    return np.column_stack((mics["x"], mics["y"], mics["z"])) + np.asarray(
+        node.get("offset", [0, 0, 0]), dtype=float
+    )
+
+
+class StreamClock:
+    """Host time of the samples of one stream.
+
+    A block read at host time ``t`` whose last sample has index ``k`` was
+    sampled no later than ``t``, so ``t - k / fs`` exceeds the host time of
+    sample 0 by the transmission and scheduling latency of that block.  The
+    smallest such offset seen during the last ``window`` seconds is kept:
+    it tracks the fastest delivery and follows a slow drift of the board
+    clock against the host clock.
+    """
+
+    def __init__(self, fs, window=10.0):
+        self.fs = fs
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        """Forget the offset, e.g. after the board restarted."""
+        # (arrival, offset) pairs with increasing offsets
+        self._candidates = deque()
+
+    @property
+    def offset(self):
+        """Host time of sample 0, ``None`` before the first update."""
+        return self._candidates[0][1] if self._candidates else None
+
+    def update(self, index, arrival):
+        """Record that sample ``index`` had arrived at host time ``arrival``."""
+        offset = arrival - index / self.fs
+        candidates = self._candidates
+        while candidates and candidates[-1][1] >= offset:
+            candidates.pop()
+        candidates.append((arrival, offset))
+        while candidates[0][0] < arrival - self.window:
+            candidates.popleft()
+
+    def time(self, index):
+        """Return the host time of sample ``index``."""
+        return self.offset + index / self.fs
+
+
+class NodeSource(SampleSource):
+    """Non-blocking reader of one board, with contiguous sample indices.
+
+    Parameters
+    ----------
+    ser : str, int or file-like
+        Name of a serial port, file descriptor (e.g. the master side of a
+        pseudo-terminal) or an open port whose ``read(n)`` does not block.
+    fs : float
+        Per-channel sampling frequency in Hz.
+    binary : bool, optional
+        Expect binary frames.  Lost frames are then detected with the
+        sequence counter and replaced by the previous sample; ASCII streams
+        are indexed by arrival only.
+    max_gap : int, optional
+        Longest run of lost frames that is filled, by default one second.
+        A longer jump of the counter is taken for a restart of the board
+        and resets the clock.
+
+    Attributes
+    ----------
+    samples : int
+        Samples returned so far; the next block starts at this index.
+    clock : StreamClock
+        Host time of the sample indices.
+    """
+
+    def __init__(
+        self,
+        ser,
+        fs,
+        binary=True,
+        channels=CHANNELS,
+        baud=115200,
+        max_gap=None,
+        clock_window=10.0,
+        chunk_frames=256,
+    ):
+        if isinstance(ser, str):
+            import serial
+
+            ser = serial.Serial(ser, baudrate=baud, timeout=0)
+        elif isinstance(ser, int):
+            os.set_blocking(ser, False)
+            ser = os.fdopen(ser, "rb", buffering=0)
+        self.ser = ser
+        self.fs = fs
+        self.binary = binary
+        self.channels = channels
+        self.max_gap = int(fs) if max_gap is None else max_gap
+        self.clock = StreamClock(fs, clock_window)
+        self.samples = 0
+        if binary:
+            self._decoder = FrameDecoder(channels)
+            self._read_size = chunk_frames * self._decoder.size
+        else:
+            self._decoder = AsciiDecoder()
+            self._assembler = FrameAssembler(channels)
+            self._read_size = chunk_frames * channels * 6
+        self._last_seq = None
+        self._held = np.zeros(channels, dtype=np.uint16)
+
+    def fileno(self):
+        return self.ser.fileno()
+
+    @property
+    def lost_frames(self):
+        """Frames lost on the link (binary mode only)."""
+        return getattr(self._decoder, "lost_frames", 0)
+
+    def _read(self):
+        try:
+            waiting = getattr(self.ser, "in_waiting", 0)
+            data = self.ser.read(max(waiting, self._read_size))
+        except BlockingIOError:
+            return b""
+        except OSError:
+            # the other end of a pseudo-terminal was closed
+            return None
+        if data is None:
+            return b""
+        if not data and not hasattr(self.ser, "in_waiting"):
+            return None
+        return data
+
+    def read_block(self):
+        """Return the ``(channels, n)`` voltages that arrived, without waiting.
+
+        ``None`` means the port was closed.
+        """
+        with metrics.stage("serial_read"):
+            data = self._read()
+        arrival = time.time()
+        if data is None:
+            return None
+        if self.binary:
+            lost = self._decoder.lost_frames
+            with metrics.stage("decode"):
+                counts, seq = self._decoder.feed(data)
+                block = counts_to_volts(self._align(counts, seq))
+            if self._decoder.lost_frames != lost:
+                metrics.count("dropped_frames", self._decoder.lost_frames - lost)
+        else:
+            with metrics.stage("decode"):
+                values = self._decoder.feed(data)
+            with metrics.stage("deinterleave"):
+                block = self._assembler.feed(values)
+        n = block.shape[1]
+        if n:
+            self.samples += n
+            self.clock.update(self.samples - 1, arrival)
+        return block
+
+    def _align(self, counts, seq):
+        """Return ``counts`` with the lost frames filled in."""
+        n = len(seq)
+        if not n:
+            return counts
+        if self._last_seq is None:
+            steps = np.ones(n, dtype=np.int64)
+            steps[1:] = np.diff(seq.astype(np.int64)) % 65536
+        else:
+            steps = np.diff(seq.astype(np.int64), prepend=self._last_seq) % 65536
+        self._last_seq = int(seq[-1])
+        restart = (steps == 0) | (steps > self.max_gap + 1)
+        if restart.any():
+            log.warning("sequence counter jumped, resetting the clock")
+            self.clock.reset()
+            steps[restart] = 1
+        held = self._held
+        self._held = counts[:, -1].copy()
+        if (steps == 1).all():
+            return counts
+        # column j of the output holds the latest frame received at or before j
+        positions = np.cumsum(steps) - 1
+        src = np.searchsorted(positions, np.arange(positions[-1] + 1), side="right")
+        return np.concatenate((held[:, None], counts), axis=1)[:, src]
+
+    def close(self):
+        self.ser.close()
+
+
+class NodeEvent(NamedTuple):
+    """One capture localized by one node.
+
+    Attributes
+    ----------
+    node : str
+        Name of the node.
+    timestamp : float
+        Host time of the trigger sample on the common time base.
+    amplitude : float
+        Largest voltage of the trigger sample.
+    delays : numpy.ndarray
+        Delays to the node's microphone 1 in seconds.
+    quality : float
+        Quality score of the detector, between 0 and 1.
+    position : numpy.ndarray
+        Position found by the node alone.
+    """
+
+    node: str
+    timestamp: float
+    amplitude: float
+    delays: np.ndarray
+    quality: float
+    position: np.ndarray
+
+
+class FusedEvent(NamedTuple):
+    """An acoustic event seen by several nodes.
+
+    Attributes
+    ----------
+    timestamp : float
+        Earliest trigger time of the group.
+    position : numpy.ndarray
+        Joint estimate of the source position in metres.
+    residual : float
+        RMS range-difference mismatch of all the nodes at ``position``, in
+        metres.
+    events : tuple of NodeEvent
+        The per-node events, at most one per node.
+    """
+
+    timestamp: float
+    position: np.ndarray
+    residual: float
+    events: tuple
+
+
+def fuse(events, solvers, iterations=20, tol=1e-6):
+    """Solve the delays of several nodes for one position.
+
+    The range-difference residuals of every node (see
+    :meth:`tdoa.TdoaSolver.residuals`) are stacked and minimized together
+    with damped Gauss-Newton iterations, each node weighted by the quality
+    of its detection.  A single array resolves the direction of a distant
+    source much better than its range, so the per-node positions can be far
+    off: the refinement starts from each of them, from their
+    quality-weighted mean and from the centroid of all the microphones, and
+    the solution with the smallest residual is kept.
+
+    Parameters
+    ----------
+    events : sequence of NodeEvent
+    solvers : dict
+        :class:`tdoa.TdoaSolver` of every node, by name, in the shared frame.
+
+    Returns
+    -------
+    position, residual
+        ``(3,)`` position and RMS residual in metres.
+    """
+    mics = [solvers[e.node].mics for e in events]
+    v = solvers[events[0].node].v
+    ranges = np.concatenate([v * np.asarray(e.delays, dtype=float) for e in events])
+    # reference microphone of every range difference
+    ref = np.concatenate([np.repeat(m[:1], len(m) - 1, axis=0) for m in mics])
+    other = np.concatenate([m[1:] for m in mics])
+    weights = np.array([max(e.quality, 1e-3) for e in events])
+    w = np.sqrt(np.repeat(weights, [len(m) - 1 for m in mics]))
+
+    starts = np.array([e.position for e in events], dtype=float)
+    finite = np.isfinite(starts).all(axis=1)
+    starts = [*starts[finite], np.concatenate(mics).mean(axis=0)]
+    if finite.any():
+        starts.append(np.average(starts[:-1], axis=0, weights=weights[finite]))
+    pos = np.array(starts)
+
+    # all the starting points are refined together, as a batch
+    for _ in range(iterations):
+        d_other = pos[:, None, :] - other
+        d_ref = pos[:, None, :] - ref
+        n_other = np.maximum(np.linalg.norm(d_other, axis=2), 1e-9)
+        n_ref = np.maximum(np.linalg.norm(d_ref, axis=2), 1e-9)
+        J = (d_other / n_other[:, :, None] - d_ref / n_ref[:, :, None]) * w[:, None]
+        res = (n_other - n_ref + ranges) * w
+        JtJ = np.einsum("ski,skj->sij", J, J)
+        damping = 1e-6 * np.trace(JtJ, axis1=1, axis2=2) + 1e-12
+        JtJ += damping[:, None, None] * np.eye(3)
+        step = np.linalg.solve(JtJ, -np.einsum("ski,sk->si", J, res)[:, :, None])[:, :, 0]
+        pos = pos + step
+        if (np.linalg.norm(step, axis=1) < tol).all():
+            break
+    res = (
+        np.linalg.norm(pos[:, None, :] - other, axis=2)
+        - np.linalg.norm(pos[:, None, :] - ref, axis=2)
+        + ranges
+    )
+    rms = np.sqrt(np.mean(res ** 2, axis=1))
+    rms = np.where(np.isfinite(rms), rms, np.inf)
+    best = int(np.argmin(rms))
+    return pos[best], float(rms[best])
+
+
+class CoincidenceGrouper:
+    """Group the events of different nodes that are close in time.
+
+    The earliest pending event opens a group, which collects the first event
+    of every other node triggered less than ``window`` seconds after it.  A
+    group is complete when every node contributed, or ``latency`` seconds
+    after its window closed, since the detections of some nodes may still
+    be running.
+    """
+
+    def __init__(self, nodes, window=0.05, latency=0.5):
+        self.nodes = set(nodes)
+        self.window = window
+        self.latency = latency
+        self._pending = []
+
+    def add(self, event):
+        self._pending.append(event)
+        self._pending.sort(key=lambda e: e.timestamp)
+
+    def deadline(self):
+        """Host time at which the oldest group closes, ``None`` if none is open."""
+        if not self._pending:
+            return None
+        return self._pending[0].timestamp + self.window + self.latency
+
+    def pop_ready(self, now):
+        """Return the list of groups (tuples of events) that are complete."""
+        groups = []
+        while self._pending:
+            first = self._pending[0]
+            group = {}
+            for event in self._pending:
+                if event.timestamp - first.timestamp > self.window:
+                    break
+                group.setdefault(event.node, event)
+            if set(group) != self.nodes and now < first.timestamp + self.window + self.latency:
+                break
+            members = set(map(id, group.values()))
+            self._pending = [e for e in self._pending if id(e) not in members]
+            groups.append(tuple(group.values()))
+        return groups
+
+
+class Node:
+    """Acquisition and per-node localization of one board."""
+
+    def __init__(self, entry, config):
+        self.name = entry["name"]
+        self.geometry = node_geometry(entry)
+        self.source = NodeSource(
+            entry["port"],
+            config["fs"],
+            binary=entry.get("binary", config["binary"]),
+            channels=len(self.geometry),
+            baud=entry.get("baud", config["baud"]),
+            clock_window=config["clock_window"],
+        )
+        self.engine = AcquisitionEngine(
+            self.source,
+            config["fs"],
+            entry.get("threshold", config["threshold"]),
+            config["pre"],
+            config["post"],
+        )
+        self.detector = get_detector(config["method"], self.geometry, **config["method_params"])
+        self.solver = TdoaSolver(*self.geometry.T)
+        self.pending = 0
+        self.events = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.finished = False
+
+    def localize(self, capture):
+        """Return the :class:`NodeEvent` of a capture, ``None`` if rejected."""
+        result = self.detector.detect(capture.samples, self.engine.fs)
+        if result.rejected:
+            return None
+        if result.position is not None:
+            position = np.asarray(result.position, dtype=float)
+        else:
+            with metrics.stage("tdoa"):
+                position = self.solver.solve(result.delays).positions[0]
+        return NodeEvent(
+            self.name,
+            capture.timestamp,
+            capture.amplitude,
+            np.asarray(result.delays, dtype=float),
+            float(result.quality),
+            position,
+        )
+
+    def stats(self):
+        return {
+            "samples": self.source.samples,
+            "lost_frames": self.source.lost_frames,
+            "events": self.events,
+            "rejected": self.rejected,
+            "dropped": self.dropped + self.engine.dropped_events,
+            "clock_offset": self.source.clock.offset,
+        }
+
+
+class MultiNodeAcquisition:
+    """Read all the nodes concurrently and fuse their events.
+
+    Parameters
+    ----------
+    config : dict
+        See ``DEFAULT_CONFIG``; ``nodes`` lists the boards, each with a
+        ``name``, a ``port`` and its microphones in the shared frame.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        if len({n["name"] for n in config["nodes"]}) != len(config["nodes"]):
+            raise ValueError("Node names must be unique")
+        self.nodes = [Node({**NODE_DEFAULTS, **entry}, config) for entry in config["nodes"]]
+        self.solvers = {node.name: node.solver for node in self.nodes}
+        self.grouper = CoincidenceGrouper(list(self.solvers), config["window"], config["latency"])
+        self.groups = 0
+        self.unmatched = 0
+        self.inconsistent = 0
+        self._executor = None
+        self._wake = None
+        self._stop = False
+
+    def stop(self):
+        self._stop = True
+        if self._wake is not None:
+            self._wake.set()
+
+    def stats(self):
+        """Return the counters of every node and of the grouping."""
+        return {
+            "nodes": {node.name: node.stats() for node in self.nodes},
+            "groups": self.groups,
+            "unmatched": self.unmatched,
+            "inconsistent": self.inconsistent,
+        }
+
+    def _on_readable(self, node):
+        loop = asyncio.get_running_loop()
+        block = node.source.read_block()
+        if block is None:
+            log.warning("node %s closed its port", node.name)
+            loop.remove_reader(node.source.fileno())
+            node.finished = True
+            self._wake.set()
+            return
+        if not block.shape[1]:
+            return
+        last = node.source.samples - 1
+        node.engine.process_block(block, node.source.clock.time(last))
+        while not node.engine.events.empty():
+            capture = node.engine.events.get_nowait()
+            if node.pending >= self.config["max_pending"]:
+                node.dropped += 1
+                metrics.count("dropped_events")
+                continue
+            node.pending += 1
+            future = loop.run_in_executor(self._executor, node.localize, capture)
+            future.add_done_callback(lambda f, node=node: self._on_localized(node, f))
+
+    def _on_localized(self, node, future):
+        node.pending -= 1
+        try:
+            event = future.result()
+        except Exception:
+            log.exception("localization failed on node %s", node.name)
+            return
+        if event is None:
+            node.rejected += 1
+            return
+        node.events += 1
+        self.grouper.add(event)
+        self._wake.set()
+
+    def _fuse(self, group):
+        if len(group) < self.config["min_nodes"]:
+            self.unmatched += 1
+            metrics.count("multinode.unmatched")
+            return None
+        with metrics.stage("fuse"):
+            position, residual = fuse(group, self.solvers)
+        if residual > self.config["max_residual"]:
+            # the delays of the nodes do not agree on a position
+            self.inconsistent += 1
+            metrics.count("multinode.inconsistent")
+            return None
+        self.groups += 1
+        metrics.count("multinode.groups")
+        return FusedEvent(min(e.timestamp for e in group), position, residual, group)
+
+    async def run(self, on_event, duration=None):
+        """Acquire until :meth:`stop`, every port closed, or ``duration`` seconds.
+
+        ``on_event`` is called in the event loop with every
+        :class:`FusedEvent`.
+        """
+        loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._executor = ThreadPoolExecutor(self.config["workers"], thread_name_prefix="localize")
+        end = None if duration is None else time.monotonic() + duration
+        for node in self.nodes:
+            loop.add_reader(node.source.fileno(), self._on_readable, node)
+        try:
+            while not self._stop:
+                done = all(node.finished and not node.pending for node in self.nodes)
+                now = float("inf") if done else time.time()
+                for group in self.grouper.pop_ready(now):
+                    event = self._fuse(group)
+                    if event is not None:
+                        on_event(event)
+                if done or (end is not None and time.monotonic() >= end):
+                    break
+                deadline = self.grouper.deadline()
+                timeout = 1.0 if deadline is None else min(max(deadline - time.time(), 0), 1.0)
+                if end is not None:
+                    timeout = min(timeout, max(end - time.monotonic(), 0))
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for node in self.nodes:
+                if not node.finished:
+                    loop.remove_reader(node.source.fileno())
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        for node in self.nodes:
+            node.source.close()
+
+
+def message(event):
+    """Return a :class:`FusedEvent` as a JSON-serialisable dictionary."""
+    x, y, z = (float(c) for c in event.position)
+    return {
+        "time": event.timestamp,
+        "x": x,
+        "y": y,
+        "z": z,
+        "residual": event.residual,
+        "nodes": {
+            e.node: {
+                "time": e.timestamp,
+                "amplitude": e.amplitude,
+                "delays": [float(d) for d in e.delays],
+                "quality": e.quality,
+                "position": [float(c) for c in e.position],
+            }
+            for e in event.events
+        },
+    }
+
+
+def simulate(count, source, spacing=2.0, period=1.0, v=343):
+    """Start ``count`` simulators on pseudo-terminals.
+
+    Node ``k`` has the default array moved by ``k * spacing`` metres along
+    x.  Each simulator sends a burst every ``period`` seconds with the
+    delays of a source at ``source``.  Returns the node entries (the master
+    side of each terminal as ``port``), the simulator processes and the
+    slave file descriptors, to be closed once the simulators are stopped:
+    reading a master whose slave is not open fails.
+    """
+    import pty
+    import subprocess
+    import tty
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mcu_simulator.py")
+    nodes, processes, slaves = [], [], []
+    for k in range(count):
+        entry = {"name": f"node{k + 1}", "offset": [k * spacing, 0, 0]}
+        arrivals = np.linalg.norm(node_geometry(entry) - np.asarray(source, dtype=float), axis=1) / v
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        delays = ",".join(f"{d:.7f}" for d in arrivals)
+        command = [sys.executable, script, os.ttyname(slave), "--binary"]
+        command += [f"--pulse={period}", f"--delays={delays}"]
+        processes.append(subprocess.Popen(command, stdout=subprocess.DEVNULL))
+        slaves.append(slave)
+        entry["port"] = master
+        nodes.append(entry)
+    return nodes, processes, slaves
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    opts = dict(a[2:].split("=", 1) for a in argv if a.startswith("--") and "=" in a)
+    args = [a for a in argv if not a.startswith("--")]
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if "--metrics" in argv:
+        metrics.enable()
+    config = load_config(args[0] if args else None)
+    processes, slaves = [], []
+    if "simulate" in opts:
+        source = [float(c) for c in opts.get("source", "1.2,0.8,0.3").split(",")]
+        config["nodes"], processes, slaves = simulate(int(opts["simulate"]), source)
+    if not config["nodes"]:
+        print("usage: multinode.py nodes.json | --simulate=N [--source=x,y,z] [--duration=s]")
+        return 2
+
+    acquisition = MultiNodeAcquisition(config)
+    try:
+        asyncio.run(acquisition.run(
+            lambda event: print(json.dumps(message(event)), flush=True),
+            float(opts["duration"]) if "duration" in opts else None,
+        ))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        for fd in slaves:
+            os.close(fd)
+        acquisition.close()
+    log.info("stats %s", json.dumps(acquisition.stats()))
+    if "--metrics" in argv:
+        metrics.dump()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Measure the sustained throughput of acquisition and localization.
+
+Samples from a :class:`sources.SampleSource` are pushed as fast as possible
+through the :class:`acquisition.AcquisitionEngine` trigger logic, and every
+capture is localized like ``App.process_signals`` does::
+
+    python replay_benchmark.py captures/ --method=gcc
+    python replay_benchmark.py --seconds=3600 --method=dpe --metrics
+
+Without an archive directory the synthetic signals of the simulator are
+used.  The real-time factor is the number of seconds of audio processed per
+second of wall time.  ``--metrics`` also prints the per-stage latencies
+collected by :mod:`metrics`.
+"""
+
+import sys
+import time
+
+import numpy as np
+
+import metrics
+from acquisition import AcquisitionEngine
+from detectors import get_detector
+from sources import ReplaySource, SyntheticSource
+from tdoa import TdoaSolver
+
+# Microphone coordinates in metres, as in ``tk_app``
+MIC_X = [0, 0.17, 0.17, 0.72]
+MIC_Y = [0, 0, 0.85, 0.61]
+MIC_Z = [0, 0, 0, 0.13]
+
+def run(source, method="gcc", threshold=1.75, pre=200, post=200):
+    """Process ``source`` until it is exhausted and return the statistics."""
+    detector = get_detector(method, np.column_stack((MIC_X, MIC_Y, MIC_Z)))
+    solver = TdoaSolver(MIC_X, MIC_Y, MIC_Z)
+    engine = AcquisitionEngine(source, threshold=threshold, pre=pre, post=post)
+    events = 0
+    rejected = 0
+    busy = 0.0
+    start = time.perf_counter()
+    while engine.poll():
+        while not engine.events.empty():
+            event = engine.events.get_nowait()
+            t = time.perf_counter()
+            result = detector.detect(event.samples, engine.fs)
+            if result.rejected:
+                rejected += 1
+            elif result.position is None:
+                with metrics.stage("tdoa"):
+                    solver.localize(*result.delays)
+            busy += time.perf_counter() - t
+            events += 1
+    wall = time.perf_counter() - start
+    audio = engine.ring.total / engine.fs
+    stats = {
+        "audio_s": audio,
+        "wall_s": wall,
+        "realtime_factor": audio / wall if wall else float("inf"),
+        "samples_per_s": engine.ring.total / wall if wall else float("inf"),
+        "events": events,
+        "rejected": rejected,
+        "events_per_s": events / wall if wall else float("inf"),
+        "localize_ms": 1e3 * busy / events if events else 0.0,
+        "dropped_events": engine.dropped_events,
+    }
+    if hasattr(detector, "stats"):
+        # per-stage outcomes of the cascade
+        for outcome, counts in detector.stats()["outcomes"].items():
+            stats["cascade_" + outcome] = counts["count"]
+        for stage, values in detector.stats()["stages"].items():
+            stats[f"cascade_{stage}_ms"] = values["time_ms"]
+    return stats
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    opts = dict(a[2:].split("=", 1) for a in argv if a.startswith("--") and "=" in a)
+    args = [a for a in argv if not a.startswith("--")]
+    method = opts.get("method", "gcc")
+    if "--metrics" in argv:
+        metrics.enable()
+    if args:
+        source = ReplaySource(args[0], gap=int(opts.get("gap", 200)))
+    else:
+        source = SyntheticSource(total=float(opts.get("seconds", 600)), block_frames=1024)
+    stats = run(source, method)
+    print(f"method {method}")
+    for key, value in stats.items():
+        print(f"{key:>20}: {value:.6g}" if isinstance(value, float) else f"{key:>20}: {value}")
+    if metrics.enabled():
+        metrics.dump(sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
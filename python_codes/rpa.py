@@ -1,5 +1,9 @@
+from typing import NamedTuple
+
 import numpy as np
 
+from deinterleave import as_channels
+
 
 def phasespace(signal, dim, tau):
     """Return delay embedding of ``signal``."""
@@ -15,7 +19,12 @@ def phasespace(signal, dim, tau):
 
 
 def rp_plot(P, m, t, r=0.9):
-    """Compute recurrence and distance matrices."""
+    """Compute recurrence and distance matrices.
+
+    Both are dense ``T x T`` matrices; only use this when they are actually
+    plotted.  :func:`distance_column_sums` and :func:`recurrence_column_sums`
+    give their column sums for long signals.
+    """
     P = np.asarray(P)
     r = r * np.std(P)
     X = phasespace(P, m, t)
@@ -27,11 +36,133 @@ def rp_plot(P, m, t, r=0.9):
     return RP, DD
 
 
+class RQA(NamedTuple):
+    """Recurrence quantification measures, see :func:`rqa`."""
+
+    recurrence_rate: float
+    determinism: float
+    laminarity: float
+
+
+def rp_sparse(P, m, t, r=0.9):
+    """Return the recurrence matrix of :func:`rp_plot` as a sparse matrix.
+
+    Neighbour pairs within the radius are found with a KD-tree on the
+    :func:`phasespace` embedding, so time and memory depend on the number
+    of recurrences rather than on ``T ** 2``.  Returns a
+    ``scipy.sparse.csr_matrix`` of ``int8`` with ones on the diagonal.
+    """
+    from scipy import sparse
+    from scipy.spatial import cKDTree
+
+    P = np.asarray(P)
+    r = r * np.std(P)
+    X = phasespace(P, m, t)
+    T = len(X)
+    pairs = cKDTree(X).query_pairs(r, output_type="ndarray")
+    diag = np.arange(T)
+    rows = np.concatenate((pairs[:, 0], pairs[:, 1], diag))
+    cols = np.concatenate((pairs[:, 1], pairs[:, 0], diag))
+    data = np.ones(len(rows), dtype=np.int8)
+    return sparse.csr_matrix((data, (rows, cols)), shape=(T, T))
+
+
+def _contains(sorted_keys, keys):
+    idx = np.searchsorted(sorted_keys, keys)
+    idx[idx == len(sorted_keys)] = 0
+    return sorted_keys[idx] == keys
+
+
+def _on_lines(rows, cols, T, dcol, length):
+    """Mask of the points lying on a line of at least ``length`` points.
+
+    ``rows`` and ``cols`` are the coordinates of the recurrent points, in
+    row-major order, and ``dcol`` the column offset to the next point of a
+    line (1 for diagonal lines, 0 for vertical ones).  Neighbours outside
+    the ``T x T`` matrix are absent; their linear index would otherwise wrap
+    to the next row.
+    """
+    if length <= 1:
+        return np.ones(len(rows), dtype=bool)
+    keys = rows * T + cols
+    present = {}
+    for s in range(1 - length, length):
+        if s:
+            row, col = rows + s, cols + s * dcol
+            inside = (row >= 0) & (row < T) & (col >= 0) & (col < T)
+            present[s] = inside & _contains(keys, keys + s * (T + dcol))
+    present[0] = np.ones(len(rows), dtype=bool)
+    mask = np.zeros(len(rows), dtype=bool)
+    for first in range(1 - length, 1):
+        window = present[first].copy()
+        for s in range(first + 1, first + length):
+            window &= present[s]
+        mask |= window
+    return mask
+
+
+def rqa(RP, lmin=2, vmin=2):
+    """Recurrence quantification of a (sparse or dense) recurrence matrix.
+
+    The recurrence rate is the fraction of recurrent points.  Determinism is
+    the fraction of recurrent points, the main diagonal excluded, lying on
+    diagonal lines of at least ``lmin`` points; laminarity the fraction
+    lying on vertical lines of at least ``vmin`` points.  Everything is
+    computed from the list of recurrent points, never from a dense matrix.
+    """
+    from scipy import sparse
+
+    csr = sparse.csr_matrix(RP)
+    csr.eliminate_zeros()
+    csr.sort_indices()
+    T = csr.shape[0]
+    if not csr.nnz:
+        return RQA(0.0, 0.0, 0.0)
+    # row-major order of a canonical CSR matrix: the linear indices are sorted
+    rows = np.repeat(np.arange(T, dtype=np.int64), np.diff(csr.indptr))
+    cols = csr.indices.astype(np.int64)
+
+    rate = csr.nnz / float(T * T)
+
+    off = rows != cols
+    n_off = np.count_nonzero(off)
+    det = np.count_nonzero(_on_lines(rows, cols, T, 1, lmin) & off) / n_off if n_off else 0.0
+    lam = np.count_nonzero(_on_lines(rows, cols, T, 0, vmin)) / csr.nnz
+    return RQA(rate, float(det), float(lam))
+
+
+def distance_column_sums(X):
+    """Return ``rp_plot(...)[1].sum(axis=0)`` for the embedding ``X``.
+
+    Uses ``sum_i |x_i - x_j|^2 = S + T |x_j|^2`` for centred points (``S``
+    the total squared norm), so time and memory are linear in the number of
+    points instead of building the ``T x T`` distance matrix.
+    """
+    X = np.asarray(X, dtype=float)
+    Xc = X - X.mean(axis=0)
+    norms = np.einsum("ij,ij->i", Xc, Xc)
+    return norms.sum() + len(Xc) * norms
+
+
+def recurrence_column_sums(P, m, t, r=0.9, block=1024):
+    """Return ``rp_plot(P, m, t, r)[0].sum(axis=0)`` without the dense matrix.
+
+    The thresholded recurrence matrix is evaluated in blocks of ``block``
+    rows, so memory stays ``O(block * T)`` for long signals.
+    """
+    P = np.asarray(P)
+    r = r * np.std(P)
+    X = phasespace(P, m, t)
+    threshold = r ** 2
+    counts = np.zeros(len(X), dtype=int)
+    for start in range(0, len(X), block):
+        diff = X[start : start + block, None, :] - X[None, :, :]
+        counts += (np.sum(diff ** 2, axis=2) <= threshold).sum(axis=0)
+    return counts
+
+
 def rpa_detection(
-    s1,
-    s2,
-    s3,
-    s4,
+    sigs,
     fs,
     threshold=0.4,
     rp_thresh=0.9,
@@ -39,26 +170,19 @@ def rpa_detection(
     axes=None,
 ):
 
-    """Estimate TDOA using Recurrence Plot Analysis."""
-    _, DD1 = rp_plot(s1, 3, 1, rp_thresh)
-    _, DD2 = rp_plot(s2, 3, 1, rp_thresh)
-    _, DD3 = rp_plot(s3, 3, 1, rp_thresh)
-    _, DD4 = rp_plot(s4, 3, 1, rp_thresh)
+    """Estimate TDOA using Recurrence Plot Analysis.
 
-    C1 = DD1.sum(axis=0)
-    C2 = DD2.sum(axis=0)
-    C3 = DD3.sum(axis=0)
-    C4 = DD4.sum(axis=0)
+    ``sigs`` is the ``(channels, N)`` sample matrix.  The detection curves
+    (column sums of the distance matrix of :func:`rp_plot`) are computed in
+    linear time with :func:`distance_column_sums` and returned as a
+    ``(channels, N - 2)`` array.  ``rp_thresh`` only affects the thresholded
+    recurrence matrix, which the detection does not use.
+    """
+    sigs = as_channels(sigs)
+    curves = np.array([distance_column_sums(phasespace(sig, 3, 1)) for sig in sigs])
 
-    idx1 = np.argmax(C1 > threshold * C1.max())
-    idx2 = np.argmax(C2 > threshold * C2.max())
-    idx3 = np.argmax(C3 > threshold * C3.max())
-    idx4 = np.argmax(C4 > threshold * C4.max())
-
-    t1 = idx1 / fs
-    t2 = idx2 / fs
-    t3 = idx3 / fs
-    t4 = idx4 / fs
+    idx = np.argmax(curves > threshold * curves.max(axis=1, keepdims=True), axis=1)
+    t1, t2, t3, t4 = idx / fs
 
     if axes is not None:
         axs = axes
@@ -71,14 +195,9 @@ def rpa_detection(
 
     if axs is not None:
 
-        axs[0, 0].plot(C1)
-        axs[0, 0].set_title("Detection curve 1")
-        axs[0, 1].plot(C2)
-        axs[0, 1].set_title("Detection curve 2")
-        axs[1, 0].plot(C3)
-        axs[1, 0].set_title("Detection curve 3")
-        axs[1, 1].plot(C4)
-        axs[1, 1].set_title("Detection curve 4")
+        for k, (ax, curve) in enumerate(zip(axs.flat, curves)):
+            ax.plot(curve)
+            ax.set_title(f"Detection curve {k + 1}")
         for ax in axs.flat:
             ax.set(xlabel="Samples", ylabel="Amplitude")
         if show and axes is None:
@@ -89,5 +208,4 @@ def rpa_detection(
     td12 = t1 - t2
     td13 = t1 - t3
     td14 = t1 - t4
-    return td12, td13, td14, (C1, C2, C3, C4)
-
+    return td12, td13, td14, curves
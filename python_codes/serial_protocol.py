@@ -0,0 +1,197 @@
+"""Binary framed serial protocol used between the microcontroller and the PC.
+
+Every frame carries one sample of each microphone::
+
+    offset  size  field
+    0       2     sync word 0xA55A (little endian, bytes 0x5A 0xA5)
+    2       2     sequence counter, wraps at 65536
+    4       2*C   C packed uint16 ADC samples (little endian)
+
+With four channels a frame is 12 bytes, against roughly 24 bytes for the
+ASCII lines ``"1.65\\r\\n"`` of the original protocol, and it can be decoded
+with a single :func:`numpy.frombuffer` call.  The ASCII protocol is still
+understood through :class:`AsciiDecoder`.
+"""
+
+import numpy as np
+
+SYNC_WORD = 0xA55A
+CHANNELS = 4
+# ADC used by ``Achizitie_semnale_microfoane.ino``: 10 bit, 5 V reference.
+ADC_BITS = 10
+VREF = 5.0
+
+# Optional ASCII line sent before the first channel of every frame
+FRAME_MARKER = b"#"
+
+_SYNC_LO = SYNC_WORD & 0xFF
+_SYNC_HI = SYNC_WORD >> 8
+
+
+def frame_dtype(channels=CHANNELS):
+    """Return the structured dtype describing one frame."""
+    return np.dtype(
+        [("sync", "<u2"), ("seq", "<u2"), ("samples", "<u2", (channels,))]
+    )
+
+
+def frame_size(channels=CHANNELS):
+    """Return the size in bytes of one frame."""
+    return frame_dtype(channels).itemsize
+
+
+def volts_to_counts(volts, vref=VREF, bits=ADC_BITS):
+    """Convert voltages to ADC counts the way ``analogRead`` reports them."""
+    full = (1 << bits) - 1
+    counts = np.rint(np.asarray(volts, dtype=float) * (1 << bits) / vref)
+    return np.clip(counts, 0, full).astype(np.uint16)
+
+
+def counts_to_volts(counts, vref=VREF, bits=ADC_BITS):
+    """Convert ADC counts to voltages, matching ``5.*value/1024.`` in the sketch."""
+    return np.asarray(counts, dtype=float) * (vref / (1 << bits))
+
+
+def encode_frames(counts, start_seq=0):
+    """Pack a ``(channels, N)`` array of ADC counts into binary frames."""
+    counts = np.asarray(counts)
+    channels, n = counts.shape
+    frames = np.empty(n, dtype=frame_dtype(channels))
+    frames["sync"] = SYNC_WORD
+    frames["seq"] = (start_seq + np.arange(n)) & 0xFFFF
+    frames["samples"] = counts.T
+    return frames.tobytes()
+
+
+class FrameDecoder:
+    """Incremental decoder turning raw serial bytes into a sample matrix.
+
+    Bytes can be fed in arbitrarily sized chunks (typically the result of a
+    large ``ser.read(n)``).  Incomplete frames are kept until the next call
+    and the stream is resynchronised on the sync word after corruption.
+
+    Attributes
+    ----------
+    skipped_bytes : int
+        Bytes discarded while searching for the sync word.
+    lost_frames : int
+        Frames missing according to the sequence counter.
+    """
+
+    def __init__(self, channels=CHANNELS):
+        self.channels = channels
+        self.dtype = frame_dtype(channels)
+        self.size = self.dtype.itemsize
+        self._buf = b""
+        self._last_seq = None
+        self.skipped_bytes = 0
+        self.lost_frames = 0
+
+    def _find_sync(self, raw, pos):
+        """Return the offset of the first sync word at or after ``pos``."""
+        hits = np.flatnonzero((raw[pos:-1] == _SYNC_LO) & (raw[pos + 1 :] == _SYNC_HI))
+        return int(hits[0]) + pos if len(hits) else -1
+
+    def feed(self, data):
+        """Decode ``data`` and return ``(samples, seq)``.
+
+        ``samples`` is a ``(channels, N)`` ``uint16`` array of ADC counts and
+        ``seq`` the ``(N,)`` sequence counters of the decoded frames.  A frame
+        is only emitted once the sync word of the following frame has been
+        received, which rejects frames that lost or gained bytes.
+        """
+        buf = self._buf + bytes(data)
+        raw = np.frombuffer(buf, dtype=np.uint8)
+        blocks = []
+        pos = 0
+        while len(raw) - pos >= self.size + 2:
+            start = self._find_sync(raw, pos)
+            if start < 0:
+                # Keep the last byte: it may be the first half of a sync word.
+                self.skipped_bytes += len(raw) - 1 - pos
+                pos = len(raw) - 1
+                break
+            self.skipped_bytes += start - pos
+            pos = start
+            count = (len(raw) - start - 2) // self.size
+            if count <= 0:
+                break
+            frames = np.frombuffer(buf, dtype=self.dtype, count=count, offset=start)
+            end = start + count * self.size
+            ok = np.empty(count, dtype=bool)
+            ok[:-1] = frames["sync"][1:] == SYNC_WORD
+            ok[-1] = raw[end] == _SYNC_LO and raw[end + 1] == _SYNC_HI
+            ok &= frames["sync"] == SYNC_WORD
+            if ok.all():
+                blocks.append(frames)
+                pos = end
+            else:
+                good = int(np.argmin(ok))
+                blocks.append(frames[:good])
+                pos = start + good * self.size + 1
+                self.skipped_bytes += 1
+        frames = np.concatenate(blocks) if blocks else np.empty(0, dtype=self.dtype)
+        samples = np.ascontiguousarray(frames["samples"].T)
+        seq = frames["seq"].copy()
+        self._buf = buf[pos:]
+        self._count_lost(seq)
+        return samples, seq
+
+    def _count_lost(self, seq):
+        if len(seq) == 0:
+            return
+        if self._last_seq is not None:
+            seq = np.concatenate(([self._last_seq], seq))
+        gaps = (np.diff(seq.astype(np.int64)) - 1) % 65536
+        self.lost_frames += int(gaps.sum())
+        self._last_seq = int(seq[-1])
+
+
+class AsciiDecoder:
+    """Decoder for the original ASCII protocol (one float per line).
+
+    Samples are returned channel-interleaved exactly as they were received,
+    as a flat ``float`` array.  Frame markers become ``NaN`` entries so that
+    :func:`deinterleave.deinterleave` can recover the channel phase.
+    """
+
+    def __init__(self):
+        self._tail = b""
+
+    def feed(self, data):
+        """Decode the complete lines contained in ``data``."""
+        data = self._tail + data
+        end = data.rfind(b"\n") + 1
+        self._tail = data[end:]
+        values = []
+        for line in data[:end].split(b"\n"):
+            line = line.strip()
+            if not line:
+                continue
+            if line == FRAME_MARKER:
+                values.append(np.nan)
+                continue
+            try:
+                values.append(float(line))
+            except ValueError:
+                continue
+        return np.asarray(values, dtype=float)
+
+
+def read_frames(ser, decoder, min_frames, chunk_frames=256):
+    """Read at least ``min_frames`` frames from ``ser`` with bulk reads.
+
+    Returns the ``(channels, N)`` ``uint16`` sample matrix.
+    """
+    blocks = []
+    total = 0
+    while total < min_frames:
+        waiting = getattr(ser, "in_waiting", 0)
+        size = max(waiting, chunk_frames * decoder.size)
+        samples, _ = decoder.feed(ser.read(size))
+        if samples.shape[1]:
+            blocks.append(samples)
+            total += samples.shape[1]
+    if not blocks:
+        return np.empty((decoder.channels, 0), dtype=np.uint16)
+    return np.concatenate(blocks, axis=1)
@@ -1,6 +1,11 @@
-from scipy import signal
+from functools import lru_cache
+
+from deinterleave import as_channels
+
 
 def butter_bandpass(lowcut, highcut, fs, order=5):
+    from scipy import signal
+
     nyq = 0.5 * fs
     low = lowcut / nyq
     high = highcut / nyq
@@ -8,7 +13,62 @@ def butter_bandpass(lowcut, highcut, fs, order=5):
     return b, a
 
 
+@lru_cache(maxsize=32)
+def butter_bandpass_sos(lowcut, highcut, fs, order=5):
+    """Return the second-order sections of a Butterworth band-pass filter.
+
+    Designs are cached per ``(lowcut, highcut, fs, order)``, so the returned
+    array is shared between callers and must not be modified.
+    """
+    from scipy import signal
+
+    return signal.butter(order, [lowcut, highcut], btype='band', fs=fs, output='sos')
+
+
 def butter_bandpass_filter(data, lowcut, highcut, fs, order=5):
-    b, a = butter_bandpass(lowcut, highcut, fs, order=order)
-    y = signal.lfilter(b, a, data)
-    return y
+    """Band-pass ``data`` along its last axis, starting from rest."""
+    from scipy import signal
+
+    return signal.sosfilt(butter_bandpass_sos(lowcut, highcut, fs, order), data, axis=-1)
+
+
+class BandpassFilter:
+    """Butterworth band-pass filter for a stream of ``(channels, n)`` blocks.
+
+    The filter state of every channel is carried from one block to the
+    next, so filtering a stream block by block gives the same samples as
+    filtering it at once, without a transient at the block boundaries.  The
+    state starts as the steady state for the first sample of each channel,
+    which avoids the step response to the 1.65 V offset of the microphones.
+
+    With ``zero_phase=True`` every block is filtered forwards and backwards
+    (:func:`scipy.signal.sosfiltfilt`) independently of the others; this
+    removes the group delay but is only suited to complete captures.
+    """
+
+    def __init__(self, lowcut, highcut, fs, order=5, zero_phase=False):
+        self.sos = butter_bandpass_sos(lowcut, highcut, fs, order)
+        self.zero_phase = zero_phase
+        self._zi = None
+
+    def reset(self):
+        """Forget the filter state; the next block starts a new stream."""
+        self._zi = None
+
+    def __call__(self, block):
+        return self.process(block)
+
+    def process(self, block):
+        """Return the filtered ``(channels, n)`` block."""
+        from scipy import signal
+
+        block = as_channels(block)
+        if self.zero_phase:
+            return signal.sosfiltfilt(self.sos, block, axis=-1)
+        if not block.shape[1]:
+            return block.copy()
+        if self._zi is None:
+            # (sections, channels, 2) as expected by sosfilt along axis -1
+            self._zi = signal.sosfilt_zi(self.sos)[:, None, :] * block[None, :, :1]
+        out, self._zi = signal.sosfilt(self.sos, block, axis=-1, zi=self._zi)
+        return out
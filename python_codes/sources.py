@@ -0,0 +1,249 @@
+"""Interchangeable sources of ``(channels, n)`` sample blocks.
+
+Everything downstream of the acquisition (:class:`acquisition.AcquisitionEngine`,
+the GUI, the command line script) reads blocks of voltages from a
+:class:`SampleSource`, so a live serial port, the synthetic signals of the
+simulator and captures recorded in a :class:`capture_archive.CaptureArchive`
+can be swapped freely.  Synthetic and replayed samples are produced either
+as fast as possible (``speed=None``) or paced like a real device
+(``speed=1.0``, or faster/slower).
+"""
+
+import time
+
+import numpy as np
+
+import metrics
+from deinterleave import FrameAssembler
+from serial_protocol import CHANNELS, AsciiDecoder, FrameDecoder, counts_to_volts
+
+# rate of the Arduino sketch, assumed when a source does not tell its own
+DEFAULT_FS = 1000
+
+
+class SampleSource:
+    """Base class of the sample sources.
+
+    Subclasses set ``fs`` and ``channels`` and implement :meth:`read_block`.
+    ``block_frames`` is the usual number of frames per block, ``None`` when
+    unknown; consumers size their buffers from it.
+    """
+
+    fs = None
+    channels = CHANNELS
+    block_frames = None
+
+    def read_block(self):
+        """Return the next ``(channels, n)`` block of voltages.
+
+        ``n`` may be 0 when no samples arrived in time; ``None`` means the
+        source is exhausted.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release the underlying device or files."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            block = self.read_block()
+            if block is None:
+                return
+            if block.shape[1]:
+                yield block
+
+
+class _Pacer:
+    """Sleep so that samples are released at ``speed`` times their rate."""
+
+    def __init__(self, fs, speed):
+        self.fs = fs
+        self.speed = speed
+        self._start = None
+        self._sent = 0
+
+    def wait(self, n):
+        if self.speed is None:
+            return
+        if self._start is None:
+            self._start = time.monotonic()
+        self._sent += n
+        # a block is available once its last sample has been acquired
+        delay = self._start + self._sent / (self.fs * self.speed) - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class SerialSource(SampleSource):
+    """Samples read from the microcontroller.
+
+    Parameters
+    ----------
+    ser : serial.Serial, file-like or str
+        Open port (``read(n)`` should return within a short timeout), or the
+        name of a port to open.
+    fs : float, optional
+        Per-channel sampling frequency in Hz, ``DEFAULT_FS`` by default.
+    binary : bool, optional
+        Expect binary frames instead of ASCII lines.
+    chunk_frames : int, optional
+        Frames requested per read.
+    """
+
+    def __init__(self, ser, fs=None, binary=False, channels=CHANNELS, chunk_frames=256, baud=115200):
+        if isinstance(ser, str):
+            import serial
+
+            ser = serial.Serial(ser, baudrate=baud, timeout=0.1)
+        self.ser = ser
+        self.fs = DEFAULT_FS if fs is None else fs
+        self.binary = binary
+        self.channels = channels
+        self.block_frames = chunk_frames
+        if binary:
+            self._decoder = FrameDecoder(channels)
+            self._read_size = chunk_frames * self._decoder.size
+        else:
+            self._decoder = AsciiDecoder()
+            self._assembler = FrameAssembler(channels)
+            # about six bytes per ASCII sample ("1.65\r\n")
+            self._read_size = chunk_frames * channels * 6
+
+    @property
+    def lost_frames(self):
+        """Frames lost on the link (binary mode only)."""
+        return getattr(self._decoder, "lost_frames", 0)
+
+    def read_block(self):
+        with metrics.stage("serial_read"):
+            data = self.ser.read(self._read_size)
+        if self.binary:
+            lost = self._decoder.lost_frames
+            with metrics.stage("decode"):
+                counts, _ = self._decoder.feed(data)
+                volts = counts_to_volts(counts)
+            if self._decoder.lost_frames != lost:
+                metrics.count("dropped_frames", self._decoder.lost_frames - lost)
+            return volts
+        with metrics.stage("decode"):
+            values = self._decoder.feed(data)
+        with metrics.stage("deinterleave"):
+            return self._assembler.feed(values)
+
+    def close(self):
+        self.ser.close()
+
+
+def synthetic_signals(fs=1000, duration=2.0, freq=40.0, delays=(0.0, 0.0005, 0.001, 0.0015)):
+    """Return the ``(channels, N)`` delayed sine waves sent by ``mcu_simulator``."""
+    t = np.arange(0.0, duration, 1.0 / fs)
+    base = np.sin(2 * np.pi * freq * t)
+    shifts = [int(round(d * fs)) for d in delays]
+    sigs = np.array([np.roll(base, shift) for shift in shifts])
+    return np.clip(1.65 + 1.65 * sigs, 0, 3.3)
+
+
+class SyntheticSource(SampleSource):
+    """The signals of :func:`synthetic_signals`, repeated endlessly.
+
+    ``duration`` is the length of the repeated pattern and ``total`` the
+    number of seconds after which the source is exhausted (``None`` for
+    never).  Voltages are rounded to the 10 mV of the ASCII protocol.
+    """
+
+    def __init__(
+        self,
+        fs=1000,
+        duration=2.0,
+        freq=40.0,
+        delays=(0.0, 0.0005, 0.001, 0.0015),
+        total=None,
+        block_frames=256,
+        speed=None,
+    ):
+        self.fs = fs
+        self.pattern = np.round(synthetic_signals(fs, duration, freq, delays), 2)
+        self.channels = self.pattern.shape[0]
+        self.block_frames = block_frames
+        self.remaining = None if total is None else int(round(total * fs))
+        self._pos = 0
+        self._pacer = _Pacer(fs, speed)
+
+    def read_block(self):
+        n = self.block_frames
+        if self.remaining is not None:
+            if self.remaining <= 0:
+                return None
+            n = min(n, self.remaining)
+            self.remaining -= n
+        idx = (self._pos + np.arange(n)) % self.pattern.shape[1]
+        self._pos = int(idx[-1]) + 1
+        self._pacer.wait(n)
+        return self.pattern[:, idx]
+
+
+class ReplaySource(SampleSource):
+    """Captures of a :class:`capture_archive.CaptureArchive` played back to back.
+
+    Parameters
+    ----------
+    archive : CaptureArchive or str
+        Archive or its directory.
+    capture_ids : iterable of int, optional
+        Captures to play, all of them by default.
+    gap : int, optional
+        Samples of silence (the first sample of the next capture repeated)
+        inserted before every capture, so that a trigger detector re-arms.
+    block_frames : int, optional
+        Samples per returned block; captures never share a block.
+    speed : float, optional
+        ``None`` to replay as fast as possible, ``1.0`` for real time.
+    """
+
+    def __init__(self, archive, capture_ids=None, gap=0, block_frames=256, speed=None):
+        if isinstance(archive, str):
+            from capture_archive import CaptureArchive
+
+            archive = CaptureArchive(archive)
+        self.archive = archive
+        self.capture_ids = iter(range(len(archive)) if capture_ids is None else capture_ids)
+        self.gap = gap
+        self.block_frames = block_frames
+        self.speed = speed
+        self.record = None
+        self._samples = None
+        self._pos = 0
+        self._pacer = None
+        self._next_capture()
+
+    def _next_capture(self):
+        capture_id = next(self.capture_ids, None)
+        if capture_id is None:
+            self.record = self._samples = None
+            return
+        self.record = self.archive.read(capture_id)
+        self.fs = self.record.fs
+        self.channels = self.record.samples.shape[0]
+        if self._pacer is None or self._pacer.fs != self.fs:
+            self._pacer = _Pacer(self.fs, self.speed)
+        volts = self.record.volts()
+        if self.gap:
+            volts = np.concatenate((np.repeat(volts[:, :1], self.gap, axis=1), volts), axis=1)
+        self._samples = volts
+        self._pos = 0
+
+    def read_block(self):
+        if self._samples is not None and self._pos >= self._samples.shape[1]:
+            self._next_capture()
+        if self._samples is None:
+            return None
+        block = self._samples[:, self._pos : self._pos + self.block_frames]
+        self._pos += block.shape[1]
+        self._pacer.wait(block.shape[1])
+        return block
@@ -0,0 +1,204 @@
+"""Steered response power (SRP-PHAT) localization on a grid of positions.
+
+Instead of solving for the position from three pairwise delays, every
+candidate position of a grid is scored by summing the GCC-PHAT curves of
+all microphone pairs at the delays that position would produce.  A single
+wrong pair then only lowers the score of the true position a little.
+
+The inter-microphone delays of the coarse grid only depend on the geometry
+and the grid, so they are computed once, optionally cached on disk
+(``cache_dir``), and turned into indices into the (upsampled) GCC curves
+once per sampling rate.
+Finer levels are searched in a small box around the best coarse point.
+"""
+
+import hashlib
+import os
+from typing import NamedTuple
+
+import numpy as np
+
+from deinterleave import as_channels
+from gcc_phat import gcc, mic_pairs
+
+# Where applications keep the steering tables; pass it as ``cache_dir``
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "srp_phat")
+
+
+class SrpResult(NamedTuple):
+    """Output of :meth:`SrpLocalizer.localize`.
+
+    Attributes
+    ----------
+    position : numpy.ndarray
+        ``(3,)`` best grid position in metres.
+    score : float
+        Steered response power at ``position``, averaged over the pairs
+        (1 would mean every pair peaks exactly there).
+    """
+
+    position: np.ndarray
+    score: float
+
+
+def grid_points(lo, hi, step):
+    """Return the ``(G, 3)`` points of a regular grid including both bounds.
+
+    Use ``lo[2] == hi[2]`` for a 2-D grid at a fixed height.
+    """
+    axes = [
+        np.linspace(a, b, int(round((b - a) / step)) + 1) if b > a else np.array([a], dtype=float)
+        for a, b in zip(lo, hi)
+    ]
+    mesh = np.meshgrid(*axes, indexing="ij")
+    return np.column_stack([m.ravel() for m in mesh])
+
+
+def steering_delays(points, mics, pairs, v=343):
+    """Return the ``(G, P)`` delays ``t_i - t_j`` of every pair at every point."""
+    dist = np.linalg.norm(points[:, None, :] - mics[None, :, :], axis=2)
+    return ((dist[:, pairs[:, 0]] - dist[:, pairs[:, 1]]) / v).astype(np.float32)
+
+
+class SteeringTable:
+    """Grid positions and their pairwise delays, optionally cached on disk.
+
+    With a ``cache_dir`` (e.g. ``CACHE_DIR``) the table is saved there,
+    under a hash of the geometry, the grid and the speed of sound, and
+    loaded again next time; by default it is only kept in memory.
+    """
+
+    def __init__(self, x, y, z, lo, hi, step, v=343, cache_dir=None):
+        self.mics = np.column_stack((x, y, z)).astype(float)
+        self.pairs = mic_pairs(len(self.mics))
+        self.v = v
+        self.step = step
+        key = hashlib.sha1(
+            np.concatenate(
+                (self.mics.ravel(), np.ravel(lo), np.ravel(hi), [step, v])
+            ).astype(np.float64).tobytes()
+        ).hexdigest()[:16]
+        path = None if cache_dir is None else os.path.join(cache_dir, f"steering_{key}.npz")
+        if path is not None and os.path.exists(path):
+            with np.load(path) as data:
+                self.points = data["points"]
+                self.delays = data["delays"]
+            return
+        self.points = grid_points(lo, hi, step)
+        self.delays = steering_delays(self.points, self.mics, self.pairs, v)
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = path + ".tmp.npz"
+            np.savez(tmp, points=self.points, delays=self.delays)
+            os.replace(tmp, path)
+
+
+def _lookup(delays, fs, lags):
+    """Return flat indices into ``curves.ravel()`` of the lags nearest to ``delays``.
+
+    ``delays`` is ``(G, P)``; the result is ``(P, G)`` so that the gather of
+    each pair reads contiguous indices.
+    """
+    step = lags[1] - lags[0]
+    col = np.rint((delays.T * fs - lags[0]) / step)
+    col = np.clip(col, 0, len(lags) - 1).astype(np.int32)
+    return col + (np.arange(delays.shape[1], dtype=np.int32) * len(lags))[:, None]
+
+
+def _scores(index, curves):
+    """Sum the pair curves at the lags selected by :func:`_lookup`."""
+    return np.take(curves.ravel(), index).sum(axis=0)
+
+
+def _interp_scores(delays, fs, lags, curves):
+    """Like :func:`_scores` with linear interpolation between lags."""
+    step = lags[1] - lags[0]
+    pos = np.clip((delays * fs - lags[0]) / step, 0, len(lags) - 1.000001)
+    i0 = pos.astype(np.intp)
+    frac = pos - i0
+    cols = np.arange(curves.shape[0])
+    lo = curves[cols, i0]
+    return (lo + frac * (curves[cols, i0 + 1] - lo)).sum(axis=1)
+
+
+class SrpLocalizer:
+    """Coarse-to-fine SRP-PHAT search over a box.
+
+    Parameters
+    ----------
+    x, y, z : sequence of float
+        Microphone coordinates in metres.
+    lo, hi : sequence of float
+        Corners of the search box; equal heights give a 2-D search.
+    step : float, optional
+        Final grid resolution in metres.
+    coarse_step : float, optional
+        Resolution of the cached coarse grid.
+    refine_factor : int, optional
+        Resolution gain between successive refinement levels.
+    upsample : int, optional
+        GCC curves are evaluated every ``1 / upsample`` samples.
+    cache_dir : str, optional
+        Directory caching the coarse steering table (see
+        :class:`SteeringTable`), none by default.
+    """
+
+    def __init__(
+        self,
+        x,
+        y,
+        z,
+        lo,
+        hi,
+        step=0.01,
+        coarse_step=0.1,
+        refine_factor=4,
+        v=343,
+        weighting="phat",
+        upsample=8,
+        cache_dir=None,
+    ):
+        self.table = SteeringTable(x, y, z, lo, hi, coarse_step, v, cache_dir)
+        self.lo = np.asarray(lo, dtype=float)
+        self.hi = np.asarray(hi, dtype=float)
+        self.weighting = weighting
+        self.upsample = upsample
+        self.steps = [coarse_step]
+        while self.steps[-1] > step * (1 + 1e-9):
+            self.steps.append(max(step, self.steps[-1] / refine_factor))
+        dist = np.linalg.norm(self.table.mics[:, None] - self.table.mics[None], axis=2)
+        self.max_delay = dist.max() / v
+        # (key, index): one attribute, so that threads never pair a key
+        # with another key's index
+        self._index = (None, None)
+
+    def _coarse_index(self, fs, lags):
+        # the lag grid only changes with fs and N, so the lookup is reused
+        key = (fs, lags[0], lags[1], len(lags))
+        cached_key, index = self._index
+        if key != cached_key:
+            index = _lookup(self.table.delays, fs, lags)
+            self._index = (key, index)
+        return index
+
+    def localize(self, sigs, fs):
+        """Return the :class:`SrpResult` of a ``(channels, N)`` capture."""
+        sigs = as_channels(sigs)
+        table = self.table
+        lags, curves = gcc(sigs, fs, table.pairs, self.weighting, self.max_delay, self.upsample)
+        curves = curves.astype(np.float32)
+        scores = _scores(self._coarse_index(fs, lags), curves)
+        best = table.points[np.argmax(scores)]
+        score = scores.max()
+        for prev, step in zip(self.steps, self.steps[1:]):
+            # search the cells around the previous optimum at the finer step
+            lo = np.maximum(best - prev, self.lo)
+            hi = np.minimum(best + prev, self.hi)
+            lo = np.where(self.lo == self.hi, self.lo, lo)
+            hi = np.where(self.lo == self.hi, self.hi, hi)
+            points = grid_points(lo, hi, step)
+            delays = steering_delays(points, table.mics, table.pairs, table.v)
+            scores = _interp_scores(delays, fs, lags, curves)
+            best = points[np.argmax(scores)]
+            score = scores.max()
+        return SrpResult(best, float(score) / len(table.pairs))
@@ -1,3 +1,5 @@
+from typing import NamedTuple
+
 import numpy as np
 
 
@@ -40,9 +42,9 @@ def tdoa(td1, td2, td3, x, y, z, v=343, eps=1e-6):
     M = np.zeros((n + 1, 3))
     D = np.zeros((n + 1, 1))
     for i in range(n):
-        M[i, 0] = Amat[i]
-        M[i, 1] = Bmat[i]
-        M[i, 2] = Cmat[i]
+        M[i, 0] = Amat[i, 0]
+        M[i, 1] = Bmat[i, 0]
+        M[i, 2] = Cmat[i, 0]
         D[i] = Dmat[i]
 
     M = np.array(M[2:n, :])
@@ -53,3 +55,166 @@ def tdoa(td1, td2, td3, x, y, z, v=343, eps=1e-6):
     T = np.dot(Minv, D)
     xs, ys, zs = T.flatten()
     return xs, ys, zs
+
+
+class TdoaSolution(NamedTuple):
+    """Output of :meth:`TdoaSolver.solve`.
+
+    Attributes
+    ----------
+    positions : numpy.ndarray
+        ``(E, 3)`` source coordinates in metres.
+    residuals : numpy.ndarray
+        ``(E,)`` RMS mismatch of the range differences in metres; small
+        values mean the delays are consistent with the returned position.
+    converged : numpy.ndarray
+        ``(E,)`` whether the refinement settled.
+    """
+
+    positions: np.ndarray
+    residuals: np.ndarray
+    converged: np.ndarray
+
+
+class TdoaSolver:
+    """Batched multilateration for a fixed microphone array.
+
+    Everything that only depends on the geometry is computed once.  Delays
+    follow the convention of :func:`tdoa`: ``delays[:, k]`` is
+    ``t_1 - t_{k+2}``, the arrival time at the reference microphone minus
+    the arrival time at microphone ``k + 2``, as returned by the detectors.
+
+    The closed form of :func:`tdoa` (without the ``eps`` clamping, which
+    breaks down for sources near the array) gives a first estimate.  It is
+    then refined with Levenberg-Marquardt iterations on the hyperbolic
+    range-difference residuals, started from the closed form and from the
+    array centroid; the better of the two is kept.
+
+    A large residual in :meth:`solve` means the refinement did not reach a
+    consistent position (noisy delays, or too few iterations).  A near-zero
+    residual does not guarantee the right position: with four microphones
+    the three hyperboloids may intersect twice, and then either point can
+    be returned.  For the default array this happens for roughly one
+    source in ten around it; only more microphones or another array can
+    tell the two points apart.
+    """
+
+    def __init__(self, x, y, z, v=343):
+        self.v = v
+        mics = np.column_stack((x, y, z)).astype(float)
+        self.mics = mics
+        self.origin = mics[0]
+        rel = mics - self.origin
+        # closed form terms relative to the reference microphone
+        self._grad = 2 * rel[1:]
+        self._norm2 = np.sum(rel[1:] ** 2, axis=1)
+        self._centroid = mics.mean(axis=0)
+
+    def closed_form(self, delays):
+        """Return the ``(E, 3)`` closed-form positions (``NaN`` if undefined)."""
+        delays = np.atleast_2d(np.asarray(delays, dtype=float))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv = 1.0 / (self.v * delays)
+            A = inv[:, 1:, None] * self._grad[None, 1:, :] - inv[:, :1, None] * self._grad[None, :1, :]
+            D = (
+                self.v * (delays[:, 1:] - delays[:, :1])
+                - inv[:, 1:] * self._norm2[1:]
+                + inv[:, :1] * self._norm2[:1]
+            )
+        ok = np.isfinite(A).all(axis=(1, 2)) & np.isfinite(D).all(axis=1)
+        pos = np.full((len(delays), 3), np.nan)
+        if ok.any():
+            pos[ok] = np.einsum("eij,ej->ei", np.linalg.pinv(A[ok]), -D[ok]) + self.origin
+        return pos
+
+    def residuals(self, positions, delays):
+        """Return the ``(E, M - 1)`` range-difference residuals in metres."""
+        dist = np.linalg.norm(positions[:, None, :] - self.mics[None, :, :], axis=2)
+        return dist[:, 1:] - dist[:, :1] + self.v * delays
+
+    def _evaluate(self, pos, delays):
+        """Return the residuals and their ``(E, M - 1, 3)`` Jacobian at ``pos``."""
+        diff = pos[:, None, :] - self.mics[None, :, :]
+        dist = np.maximum(np.linalg.norm(diff, axis=2), 1e-9)
+        unit = diff / dist[:, :, None]
+        res = dist[:, 1:] - dist[:, :1] + self.v * delays
+        return res, unit[:, 1:, :] - unit[:, :1, :]
+
+    def _refine(self, pos, delays, iterations, tol):
+        # Levenberg-Marquardt: a step is only taken if it lowers the cost,
+        # otherwise the damping grows and the step shortens; plain
+        # Gauss-Newton steps overshoot near the array and can cycle
+        pos = pos.copy()
+        res, J = self._evaluate(pos, delays)
+        cost = np.sum(res ** 2, axis=1)
+        damping = np.full(len(pos), 1e-3)
+        converged = np.zeros(len(pos), dtype=bool)
+        # only the events still moving are iterated
+        active = np.arange(len(pos))
+        for _ in range(iterations):
+            Ja, ra = J[active], res[active]
+            JtJ = np.einsum("eki,ekj->eij", Ja, Ja)
+            scale = np.trace(JtJ, axis1=1, axis2=2) / 3 + 1e-12
+            JtJ += (damping[active] * scale)[:, None, None] * np.eye(3)
+            step = np.linalg.solve(JtJ, -np.einsum("eki,ek->ei", Ja, ra)[:, :, None])[:, :, 0]
+            new_res, new_J = self._evaluate(pos[active] + step, delays[active])
+            new_cost = np.sum(new_res ** 2, axis=1)
+            better = new_cost <= cost[active]
+            moved = active[better]
+            pos[moved] += step[better]
+            res[moved], J[moved], cost[moved] = new_res[better], new_J[better], new_cost[better]
+            damping[active] = np.where(better, damping[active] / 3, damping[active] * 4)
+            # a rejected step that short means the minimum is within ``tol``
+            done = np.linalg.norm(step, axis=1) < tol
+            converged[active[done]] = True
+            active = active[~done]
+            if not len(active):
+                break
+        return pos, converged
+
+    def solve(self, delays, refine=True, iterations=60, tol=1e-6):
+        """Localize a batch of events.
+
+        Parameters
+        ----------
+        delays : array_like
+            ``(E, M - 1)`` delays in seconds (``(E, 3)`` for four
+            microphones); a single ``(M - 1,)`` row is accepted too.
+        refine : bool, optional
+            Run the Gauss-Newton refinement.
+        iterations : int, optional
+            Maximum number of refinement iterations.
+        tol : float, optional
+            Step size in metres below which an event counts as converged.
+
+        Returns
+        -------
+        TdoaSolution
+        """
+        delays = np.atleast_2d(np.asarray(delays, dtype=float))
+        pos = self.closed_form(delays)
+        if not refine:
+            finite = np.isfinite(pos).all(axis=1)
+            res = np.full(len(pos), np.inf)
+            res[finite] = np.sqrt(np.mean(self.residuals(pos[finite], delays[finite]) ** 2, axis=1))
+            return TdoaSolution(pos, res, finite)
+
+        start = np.where(np.isfinite(pos), pos, self._centroid)
+        starts = np.concatenate((start, np.broadcast_to(self._centroid, start.shape)))
+        both = np.concatenate((delays, delays))
+        refined, converged = self._refine(starts, both, iterations, tol)
+        res = np.sqrt(np.mean(self.residuals(refined, both) ** 2, axis=1))
+        res = np.where(np.isfinite(res), res, np.inf)
+
+        E = len(delays)
+        pick = res[E:] < res[:E]
+        rows = np.arange(E) + E * pick
+        return TdoaSolution(refined[rows], res[rows], converged[rows])
+
+    def localize(self, td1, td2, td3):
+        """Return ``(xs, ys, zs)`` of one event, like :func:`tdoa`.
+
+        Use :meth:`solve` to get the residual as well.
+        """
+        xs, ys, zs = self.solve([td1, td2, td3]).positions[0]
+        return xs, ys, zs
@@ -0,0 +1,100 @@
+import io
+import threading
+
+import numpy as np
+import pytest
+
+from acquisition import AcquisitionEngine, RingBuffer
+from serial_protocol import encode_frames
+from sources import DEFAULT_FS, SampleSource, SerialSource
+
+
+class BlockingSource(SampleSource):
+    """Returns empty blocks, or blocks in ``read_block`` while ``gate`` is closed."""
+
+    fs = 1000
+    block_frames = 16
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.readers = 0
+        self._lock = threading.Lock()
+
+    def read_block(self):
+        with self._lock:
+            self.readers += 1
+        try:
+            self.gate.wait()
+            return np.empty((self.channels, 0))
+        finally:
+            with self._lock:
+                self.readers -= 1
+
+
+def test_a_reader_stuck_after_stop_is_never_run_twice():
+    source = BlockingSource()
+    engine = AcquisitionEngine(source)
+    engine.start()
+    while not source.readers:
+        pass
+    engine.stop(timeout=0.05)
+    assert engine.running
+    with pytest.raises(RuntimeError):
+        engine.start(timeout=0.05)
+    assert source.readers == 1
+
+    source.gate.set()
+    engine.start()
+    assert engine.running
+    engine.stop()
+    assert not engine.running
+
+
+def test_sources_without_a_rate_fall_back_to_the_default_rate():
+    frames = encode_frames(np.full((4, 8), 100, dtype=np.uint16))
+    assert SerialSource(io.BytesIO(frames), binary=True).fs == DEFAULT_FS
+    engine = AcquisitionEngine(io.BytesIO(frames), binary=True, threshold=0.0, pre=2, post=2)
+    assert engine.fs == DEFAULT_FS
+    assert engine.poll()
+    assert engine.get_event(timeout=0) is not None
+
+
+def test_ring_buffer_keeps_the_latest_samples_across_the_wrap():
+    ring = RingBuffer(2, 8)
+    stream = np.arange(2 * 30, dtype=float).reshape(2, 30)
+    for i in range(0, 30, 7):
+        ring.write(stream[:, i : i + 7])
+    np.testing.assert_array_equal(ring.snapshot(22, 30), stream[:, 22:30])
+    with pytest.raises(IndexError):
+        ring.snapshot(21, 30)
+    with pytest.raises(IndexError):
+        ring.snapshot(25, 31)
+    ring.write(stream)
+    np.testing.assert_array_equal(ring.snapshot(52, 60), stream[:, 22:30])
+
+
+@pytest.mark.parametrize("block", [1, 7, 64, 1000])
+def test_captures_hold_pre_and_post_samples_whatever_the_block_size(block):
+    stream = np.full((4, 1000), 0.5)
+    stream[2, [100, 130, 500, 990]] = 2.0
+    engine = AcquisitionEngine(BlockingSource(), threshold=1.75, pre=20, post=50, max_events=8)
+    for i in range(0, stream.shape[1], block):
+        engine.process_block(stream[:, i : i + block])
+    events = []
+    while (event := engine.get_event(timeout=0)) is not None:
+        events.append(event)
+    # 130 falls in the window of 100; 990 has no post-trigger samples yet
+    assert [e.start + e.trigger_index for e in events] == [100, 500]
+    for e in events:
+        assert e.trigger_index == 20 and e.samples.shape == (4, 70)
+        np.testing.assert_array_equal(e.samples, stream[:, e.start : e.start + 70])
+        assert e.amplitude == 2.0
+
+
+def test_the_oldest_captures_are_dropped_when_nobody_reads_them():
+    stream = np.zeros((4, 1000))
+    stream[0, 100::100] = 2.0
+    engine = AcquisitionEngine(BlockingSource(), pre=10, post=10, max_events=3)
+    engine.process_block(stream)
+    assert engine.dropped_events == 6
+    assert [engine.get_event(timeout=0).start for _ in range(3)] == [690, 790, 890]
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from batch_reprocess import load_results, main, parameter_grid, reprocess
+from capture_archive import CaptureArchive
+from detectors import get_detector
+from sources import synthetic_signals
+
+
+def test_results_match_the_archived_volts(tmp_path):
+    archive = CaptureArchive(str(tmp_path / "captures"))
+    sigs = synthetic_signals(fs=1000, duration=0.4)
+    archive.append(np.round(sigs, 2), 1000)
+    # not ADC voltages: stored as int16 counts with their own scale
+    archive.append(sigs * 0.01, 2000)
+    output = str(tmp_path / "results.npz")
+    configs = parameter_grid(["dpe", "rpa"], {"rpa": {"rp_thresh": [0.8, 0.9]}})
+
+    assert reprocess(archive, output, configs, workers=1, chunk=1, save_every=0) == 6
+    assert reprocess(archive, output, configs, workers=1) == 0
+
+    columns = load_results(output)
+    assert len(columns["capture_id"]) == 6
+    for k in range(6):
+        config = next(c for c in configs if c["key"] == columns["config"][k])
+        record = archive.read(int(columns["capture_id"][k]))
+        result = get_detector(config["method"], **config["params"])(record.volts(), record.fs)
+        delays = [columns[name][k] for name in ("td12", "td13", "td14")]
+        np.testing.assert_array_equal(delays, result.delays)
+
+
+def test_parameter_grid_combines_values_and_bands():
+    configs = parameter_grid(["wavelet", "dpe"], {"dpe": {"level": [0.3, 0.35], "nsigma": [4.0]}}, [None, (20, 200)])
+    assert [(c["method"], c["params"], c["band"]) for c in configs] == [
+        ("wavelet", {}, None),
+        ("wavelet", {}, (20, 200)),
+        ("dpe", {"level": 0.3, "nsigma": 4.0}, None),
+        ("dpe", {"level": 0.3, "nsigma": 4.0}, (20, 200)),
+        ("dpe", {"level": 0.35, "nsigma": 4.0}, None),
+        ("dpe", {"level": 0.35, "nsigma": 4.0}, (20, 200)),
+    ]
+    assert len({c["key"] for c in configs}) == 6
+    assert configs[1]["key"] == parameter_grid(["wavelet"], {}, [(20.0, 200.0)])[0]["key"]
+    with pytest.raises(TypeError):
+        parameter_grid(["dpe"], {"dpe": {"treshold": [0.4]}})
+
+
+def test_main_resumes_an_interrupted_run(tmp_path):
+    archive = CaptureArchive(str(tmp_path / "captures"))
+    for k in range(3):
+        archive.append(np.round(synthetic_signals(fs=1000, duration=0.4), 2), 1000)
+    output = str(tmp_path / "results.npz")
+    configs = parameter_grid(["dpe"], {}, [None, (20, 200)])
+    # only the first capture was done before the interruption
+    reprocess(archive, output, configs, capture_ids=[0], workers=1)
+    assert main([archive.path, output, "--methods=dpe", "--band=none,20-200", "--workers=1"]) == 0
+    columns = load_results(output)
+    assert sorted(zip(columns["band"].tolist(), columns["capture_id"].tolist())) == [
+        (band, cid) for band in ("20-200", "none") for cid in range(3)
+    ]
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from capture_archive import CaptureArchive
+from serial_protocol import counts_to_volts
+
+
+def test_records_survive_reopening_across_segments(tmp_path):
+    path = str(tmp_path / "captures")
+    rng = np.random.default_rng(0)
+    counts = [rng.integers(0, 1024, (4, n), dtype=np.uint16) for n in (100, 250, 80, 300)]
+    geometry = np.arange(12.0).reshape(4, 3)
+    archive = CaptureArchive(path, segment_bytes=2048)
+    ids = [archive.append(c, 1000 + k, k, geometry, 1e9 + k) for k, c in enumerate(counts)]
+    assert ids == [0, 1, 2, 3]
+
+    reopened = CaptureArchive(path, segment_bytes=2048)
+    assert len(reopened) == 4
+    assert len(list((tmp_path / "captures").glob("segment_*.cap"))) > 1
+    for k, record in enumerate(reopened):
+        np.testing.assert_array_equal(record.samples, counts[k])
+        np.testing.assert_array_equal(record.volts(), counts_to_volts(counts[k]))
+        assert (record.fs, record.trigger_index, record.timestamp) == (1000 + k, k, 1e9 + k)
+        np.testing.assert_array_equal(record.geometry, geometry)
+    with pytest.raises(IndexError):
+        reopened.read(4)
+
+
+def test_appends_of_another_instance_are_visible(tmp_path):
+    path = str(tmp_path / "captures")
+    reader = CaptureArchive(path)
+    writer = CaptureArchive(path)
+    writer.append(np.zeros((4, 10), dtype=np.uint16), 1000)
+    assert reader.read(0).samples.shape == (4, 10)
+    # an index entry cut short by a crash is ignored
+    with open(tmp_path / "captures" / "index.bin", "ab") as f:
+        f.write(b"\x01\x02\x03")
+    assert len(CaptureArchive(path)) == 1
+
+
+def test_voltages_keep_sixteen_bits(tmp_path):
+    archive = CaptureArchive(str(tmp_path / "captures"))
+    volts = np.random.default_rng(1).normal(0, 0.3, (4, 500))
+    adc = counts_to_volts(np.full((4, 20), 512, dtype=np.uint16))
+    record = archive.read(archive.append(volts, 1000))
+    assert record.samples.dtype == np.int16
+    assert np.abs(record.volts() - volts).max() <= record.scale / 2 + 1e-12
+    assert archive.read(archive.append(adc, 1000)).samples.dtype == np.uint16
+    with pytest.raises(ValueError):
+        archive.append(np.full((4, 5), np.nan), 1000)
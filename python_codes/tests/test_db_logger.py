@@ -0,0 +1,104 @@
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from db_logger import EventQuery, EventStore
+
+
+def test_explicit_timestamps_are_stored_in_iso_format(tmp_path):
+    path = str(tmp_path / "logs.db")
+    when = datetime(2024, 5, 1, 12, 30, 15)
+    with EventStore(path) as store:
+        assert store.log(1.0, 0.1, 0.2, 0.3, timestamp=when) == "2024-05-01T12:30:15"
+        store.log(1.0, 0.1, 0.2, 0.3, timestamp=when.replace(tzinfo=timezone(timedelta(hours=2))))
+        store.log(1.0, 0.1, 0.2, 0.3, timestamp=np.datetime64("2024-05-01T12:31:00"))
+        store.flush()
+    with EventQuery(path) as query:
+        assert query.count() == 3
+        minutes, counts = query.events_per_minute()
+        assert minutes.astype(str).tolist() == ["2024-05-01T10:30", "2024-05-01T12:30", "2024-05-01T12:31"]
+        assert counts.tolist() == [1, 1, 1]
+
+
+def test_a_failed_batch_is_reported_once(tmp_path):
+    path = str(tmp_path / "logs.db")
+    with EventStore(path) as store:
+        # sqlite3 cannot bind a list: the batch fails in the writer thread
+        store.log([1.0], 0.1, 0.2, 0.3)
+        with pytest.raises(sqlite3.Error):
+            store.flush()
+        assert store.failed == 1
+        store.log(0.5, 1.0, 2.0, 3.0)
+        store.flush()
+        assert store.written == 1
+    with EventQuery(path) as query:
+        assert query.count() == 1
+        assert query.occupancy().counts.tolist() == [1]
+
+
+def test_events_from_several_threads_are_all_committed(tmp_path):
+    path = str(tmp_path / "logs.db")
+    with EventStore(path, batch_size=16, flush_interval=0.01, max_pending=32) as store:
+        def produce(k):
+            for i in range(200):
+                store.log(float(k), 0.1 * i, 0.0, 0.0, capture_id=i)
+
+        threads = [threading.Thread(target=produce, args=(k,)) for k in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    # close() commits what was still queued
+    assert store.written == 800
+    with EventQuery(path) as query:
+        events = query.events()
+        assert len(events) == 800
+        assert np.bincount(events["amplitude"].astype(int)).tolist() == [200] * 4
+        assert sorted(events["capture_id"][events["amplitude"] == 2.0]) == list(range(200))
+        with pytest.raises(sqlite3.OperationalError):
+            query._conn.execute("DELETE FROM events")
+
+
+def test_queries_and_summaries_follow_the_time_bounds(tmp_path):
+    path = str(tmp_path / "logs.db")
+    start = np.datetime64("2024-05-01T12:00:00")
+    with EventStore(path) as store:
+        for i in range(30):
+            # two events every minute; the odd ones cannot be located
+            x = np.nan if i % 2 else -0.05 + 0.01 * i
+            store.log(1.0, x, 0.25, 0.0, timestamp=start + np.timedelta64(30 * i, "s"))
+    with EventQuery(path) as query:
+        assert query.count() == 30
+        assert query.count("2024-05-01T12:05:00", datetime(2024, 5, 1, 12, 10)) == 10
+        chunks = list(query.iter_events(chunk=7))
+        assert [len(c) for c in chunks] == [7, 7, 7, 7, 2]
+        times = np.concatenate(chunks)["timestamp"]
+        assert (np.diff(times) == np.timedelta64(30, "s")).all()
+
+        minutes, counts = query.events_per_minute("2024-05-01T12:03:30", "2024-05-01T12:06")
+        assert minutes.astype(str).tolist() == ["2024-05-01T12:03", "2024-05-01T12:04", "2024-05-01T12:05"]
+        assert counts.tolist() == [2, 2, 2]
+
+        occupancy = query.occupancy()
+        cells = dict(zip(map(tuple, occupancy.cells.tolist()), occupancy.counts.tolist()))
+        assert sum(cells.values()) == 15
+        assert [cells[(i, 2, 0)] for i in (-1, 0, 1, 2)] == [3, 5, 5, 2]
+
+
+def test_summaries_are_rebuilt_for_an_older_database(tmp_path):
+    path = str(tmp_path / "logs.db")
+    with EventStore(path) as store:
+        for i in range(5):
+            store.log(1.0, 0.05, 0.05, 0.05, timestamp=f"2024-05-01T12:0{i}:00")
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("DROP TABLE events_per_minute")
+        conn.execute("DROP TABLE occupancy")
+    conn.close()
+    EventStore(path).close()
+    with EventQuery(path) as query:
+        assert query.events_per_minute()[1].tolist() == [1] * 5
+        assert query.occupancy().counts.tolist() == [5]
@@ -0,0 +1,68 @@
+import numpy as np
+
+import detectors
+from detectors import Detector, get_detector
+from rpa import rpa_detection
+from sources import synthetic_signals
+
+
+def test_rpa_detector_matches_rpa_detection():
+    sigs = synthetic_signals(fs=1000, duration=0.5)
+    result = get_detector("rpa", threshold=0.5, rp_thresh=0.8)(sigs, 1000)
+    *delays, curves = rpa_detection(sigs, 1000, threshold=0.5, rp_thresh=0.8)
+    np.testing.assert_array_equal(result.delays, delays)
+    np.testing.assert_array_equal(result.curves, curves)
+
+
+def test_prepared_states_are_evicted_least_recently_used_first(monkeypatch):
+    monkeypatch.setattr(detectors, "PREPARE_CACHE_SIZE", 2)
+
+    class Counting(Detector):
+        name = "counting"
+        calls = 0
+
+        def prepare(self, fs, n):
+            Counting.calls += 1
+            return n
+
+    detector = Counting()
+    for n in (10, 20, 10, 30, 10):
+        assert detector.prepared(1000, n) == n
+    # 10 stays cached while it is used; 20 was evicted by 30
+    assert Counting.calls == 3
+    detector.prepared(1000, 20)
+    assert Counting.calls == 4
+
+
+def test_cascade_counts_every_outcome_once():
+    rng = np.random.default_rng(1)
+    burst = np.hanning(80) * np.sin(2 * np.pi * np.arange(80) / 16)
+
+    def noise():
+        return 1.4 + rng.normal(0, 0.01, (4, 600))
+
+    accepted, clipped, ambiguous, escalated = noise(), noise(), noise(), noise()
+    for k, onset in enumerate([200, 205, 210, 215]):
+        accepted[k, onset : onset + 80] += burst
+        escalated[k, onset : onset + 80] += burst + 0.8 * np.hanning(80) * rng.normal(0, 1, 80)
+    clipped[:, 200:300] = np.clip(clipped[:, 200:300] + 3 * np.hanning(100), 0, 3.3)
+    # bursts of different frequencies do not correlate
+    for k, period in enumerate([6, 11, 23, 47]):
+        ambiguous[k, 200:440] += np.hanning(240) * np.sin(2 * np.pi * np.arange(240) / period)
+
+    cascade = get_detector("cascade", final="dpe")
+    assert cascade(noise(), 1000).rejected == "weak"
+    assert cascade(clipped, 1000).rejected == "clipped"
+    assert cascade(ambiguous, 1000).rejected == "ambiguous"
+    result = cascade(accepted, 1000)
+    assert not result.rejected
+    np.testing.assert_allclose(result.delays, [-0.005, -0.010, -0.015], atol=1e-4)
+    result = cascade(escalated, 1000)
+    np.testing.assert_array_equal(result.delays, get_detector("dpe")(escalated, 1000).delays)
+
+    stats = cascade.stats()
+    assert stats["events"] == 5
+    assert {k: v["count"] for k, v in stats["outcomes"].items()} == dict.fromkeys(cascade.OUTCOMES, 1)
+    assert [stats["stages"][k]["events"] for k in cascade.STAGES] == [5, 3, 1]
+    cascade.reset_stats()
+    assert cascade.stats()["events"] == 0
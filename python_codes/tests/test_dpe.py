@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from dpe import StreamingOnsetDetector, dpe_detection, dpe_onsets
+
+
+def bursts(onsets, n=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    sigs = 1.4 + rng.normal(0, 0.01, (len(onsets), n))
+    for k, onset in enumerate(onsets):
+        sigs[k, onset : onset + 60] += np.hanning(60)
+    return sigs
+
+
+def test_batch_onsets_are_interpolated_and_missing_channels_are_nan():
+    sigs = np.full((4, 400), 1.4)
+    # 0.1 V per sample: a 0.35 V departure is crossed half way through a sample
+    sigs[0, 200:] += 0.1 * np.arange(1, 201)
+    sigs[1, 250:] -= 0.1 * np.arange(1, 151)
+    sigs[2, 100:] += 2.0
+    onsets = dpe_onsets(sigs, level=0.35, baseline=1.4)
+    np.testing.assert_allclose(onsets[:3], [202.5, 252.5, 99.175])
+    assert np.isnan(onsets[3])
+    assert dpe_detection(np.full((4, 500), 1.4), 1000) == (0.0, 0.0, 0.0)
+
+
+@pytest.mark.parametrize("chunk", [1, 13, 100, 1000])
+def test_streaming_onsets_do_not_depend_on_the_block_size(chunk):
+    sigs = bursts([200, 230, 180, 260])
+    sigs[:, 600:] = bursts([700, 650, 800, 720])[:, 600:]
+    detector = StreamingOnsetDetector(warmup=100, holdoff=50, drift=0.0)
+    found = []
+    for i in range(0, sigs.shape[1], chunk):
+        found.extend(detector.update(sigs[:, i : i + chunk]))
+    first = {}
+    for onset in found:
+        first.setdefault(onset.channel, onset.index)
+    # the first onset of every channel is the one of the batch detector
+    np.testing.assert_allclose([first[k] for k in range(4)], dpe_onsets(sigs, pre=100), atol=1e-9)
+    assert len(found) == 8
+    reference = StreamingOnsetDetector(warmup=100, holdoff=50, drift=0.0)
+    assert found == reference.update(sigs)
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from gcc_phat import gcc_phat, tdoa_gcc
+
+
+def delayed_bursts(shifts, n=1024, seed=0):
+    """Noise burst in the middle of ``n`` samples, delayed by ``shifts`` samples."""
+    rng = np.random.default_rng(seed)
+    burst = np.zeros(n)
+    burst[n // 4 : 3 * n // 4] = rng.standard_normal(n // 2) * np.hanning(n // 2)
+    freqs = np.fft.rfftfreq(n)
+    spectrum = np.fft.rfft(burst)
+    return np.array([np.fft.irfft(spectrum * np.exp(-2j * np.pi * freqs * s), n) for s in shifts])
+
+
+@pytest.mark.parametrize("weighting", ["phat", "scot", "roth", "cc"])
+def test_sub_sample_delays_are_recovered(weighting):
+    fs = 1000.0
+    shifts = np.array([0.0, 0.3, -1.7, 2.45])
+    res = gcc_phat(delayed_bursts(shifts), fs, weighting=weighting)
+    expected = (shifts[res.pairs[:, 0]] - shifts[res.pairs[:, 1]]) / fs
+    np.testing.assert_allclose(res.delays, expected, atol=0.05 / fs)
+
+
+def test_peaks_are_searched_within_the_array_geometry():
+    fs = 10000.0
+    # microphones 0.1 m apart allow at most about 2.9 samples of delay
+    x, y, z = [0, 0.1, 0, 0], [0, 0, 0.1, 0], [0, 0, 0, 0.1]
+    shifts = np.array([0.0, 1.2, -2.4, 0.6])
+    sigs = delayed_bursts(shifts)
+    # a louder echo on microphone 2, 40 samples late: outside the allowed range
+    sigs[1] += 2 * np.roll(sigs[0], 40)
+    td = tdoa_gcc(sigs, fs, x, y, z)
+    np.testing.assert_allclose(td, -shifts[1:] / fs, atol=0.1 / fs)
@@ -0,0 +1,106 @@
+import json
+
+import numpy as np
+import pytest
+
+import metrics
+from detectors import DetectionResult
+from localization_daemon import LocalizationDaemon
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / "daemon.json"
+    path.write_text(json.dumps({
+        "source": "synthetic",
+        "listen": f"unix:{tmp_path / 'daemon.sock'}",
+        "db_path": str(tmp_path / "logs.db"),
+    }))
+    return path
+
+
+def test_failed_reload_keeps_the_running_parts(config_path, tmp_path):
+    daemon = LocalizationDaemon(str(config_path))
+    try:
+        engine, publisher, store = daemon.engine, daemon.publisher, daemon.store
+        config = daemon.config
+        assert engine.get_event(timeout=5) is not None
+
+        for change in (
+            {"source": str(tmp_path / "no-such-port")},
+            {"method_params": {"no_such_param": 1}},
+            {"source": str(tmp_path / "no-such-port"), "db_path": str(tmp_path / "new.db")},
+        ):
+            path = tmp_path / "new.json"
+            path.write_text(json.dumps({**json.loads(config_path.read_text()), **change}))
+            daemon.config_path = str(path)
+            daemon.reload()
+
+            assert daemon.engine is engine and engine.running
+            assert daemon.publisher is publisher and daemon.store is store
+            assert daemon.config is config
+            assert engine.get_event(timeout=5) is not None
+        assert not (tmp_path / "new.db").exists()
+    finally:
+        daemon.close()
+
+
+def test_reload_applies_a_valid_change(config_path, tmp_path):
+    daemon = LocalizationDaemon(str(config_path))
+    try:
+        engine = daemon.engine
+        path = tmp_path / "new.json"
+        path.write_text(json.dumps({**json.loads(config_path.read_text()), "method": "dpe"}))
+        daemon.config_path = str(path)
+        daemon.reload()
+        # the source settings did not change
+        assert daemon.engine is engine
+        assert daemon.localizer.method == "dpe"
+        assert daemon.config["method"] == "dpe"
+    finally:
+        daemon.close()
+
+
+def test_metrics_are_turned_off_when_the_interval_drops_to_zero(config_path, tmp_path):
+    config = json.loads(config_path.read_text())
+    config_path.write_text(json.dumps({**config, "metrics_interval": 60}))
+    daemon = LocalizationDaemon(str(config_path))
+    try:
+        assert metrics.enabled()
+        path = tmp_path / "new.json"
+        path.write_text(json.dumps({**config, "metrics_interval": 0}))
+        daemon.config_path = str(path)
+        daemon.reload()
+        assert not metrics.enabled()
+    finally:
+        daemon.close()
+        metrics.enable(False)
+
+
+def test_non_finite_results_are_never_published_as_nan(config_path):
+    class StubLocalizer:
+        method = "stub"
+        geometry = None
+
+        def __init__(self, coords, result):
+            self.coords, self.result = coords, result
+
+        def __call__(self, sigs, fs):
+            return self.coords, self.result
+
+    daemon = LocalizationDaemon(str(config_path))
+    try:
+        event = daemon.engine.get_event(timeout=5)
+        result = DetectionResult(np.array([np.nan, 0.001, np.inf]), None, np.nan)
+        daemon.localizer = StubLocalizer((np.nan, 0.0, 0.0), result)
+        assert daemon.process(event) is None
+        assert daemon.rejected == 1 and daemon.events == 0
+
+        daemon.localizer = StubLocalizer((1.0, 2.0, 0.5), result)
+        message = daemon.process(event)
+        assert message["delays"] == [None, 0.001, None]
+        assert message["quality"] is None
+        with pytest.raises(ValueError):
+            daemon.publisher.publish({"x": np.nan})
+    finally:
+        daemon.close()
@@ -0,0 +1,52 @@
+import io
+import json
+import threading
+
+import pytest
+
+from metrics import BOUNDS, Histogram, Metrics, dump
+
+
+def test_quantiles_are_bucket_bounds_never_above_the_maximum():
+    hist = Histogram()
+    for ms in range(1, 101):
+        hist.record(ms / 1e3)
+    assert hist.count == 100
+    assert hist.total == pytest.approx(5.05)
+    for q, exact in ((0.5, 0.050), (0.9, 0.090), (0.99, 0.099)):
+        value = hist.quantile(q)
+        assert exact <= value <= min(exact * BOUNDS[1] / BOUNDS[0], hist.max)
+    assert hist.quantile(1.0) == hist.max == 0.1
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_a_disabled_registry_records_nothing():
+    registry = Metrics()
+    with registry.stage("detect"):
+        pass
+    registry.count("events")
+    snap = registry.snapshot()
+    assert snap["stages"] == {} and snap["counters"] == {}
+
+
+def test_counters_from_several_threads_add_up():
+    registry = Metrics(enabled=True)
+
+    def work():
+        for _ in range(1000):
+            registry.count("samples", 4)
+            with registry.stage("decode"):
+                pass
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    out = io.StringIO()
+    snap = dump(out, "json", registry)
+    assert json.loads(out.getvalue()) == json.loads(json.dumps(snap))
+    assert snap["counters"]["samples"]["total"] == 16000
+    assert snap["stages"]["decode"]["count"] == 4000
+    # the rate covers the time since the previous snapshot
+    assert registry.snapshot()["counters"]["samples"]["rate"] == 0.0
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from multinode import CoincidenceGrouper, NodeEvent, fuse, node_geometry
+from tdoa import TdoaSolver
+
+SOURCE = np.array([1.2, 0.8, 0.3])
+
+
+def nodes(count, spacing=2.0):
+    solvers = {}
+    for k in range(count):
+        mics = node_geometry({"offset": [k * spacing, 0, 0]})
+        solvers[f"node{k + 1}"] = TdoaSolver(*mics.T)
+    return solvers
+
+
+def event(name, solver, timestamp=0.0, position=None, quality=1.0):
+    dist = np.linalg.norm(solver.mics - SOURCE, axis=1)
+    delays = (dist[0] - dist[1:]) / solver.v
+    position = np.full(3, np.nan) if position is None else np.asarray(position, dtype=float)
+    return NodeEvent(name, timestamp, 2.0, delays, quality, position)
+
+
+def test_fused_position_recovers_the_source_from_poor_node_estimates():
+    solvers = nodes(3)
+    # the direction of a distant source is right but its range is not
+    starts = [SOURCE + [0.5, 0.3, 0.0], None, SOURCE * 3 - [4.0, 0.0, 0.0]]
+    events = [event(name, solvers[name], position=p) for name, p in zip(solvers, starts)]
+    position, residual = fuse(events, solvers)
+    np.testing.assert_allclose(position, SOURCE, atol=1e-6)
+    assert residual < 1e-9
+
+
+def test_groups_close_when_every_node_reported_or_after_the_latency():
+    grouper = CoincidenceGrouper(["a", "b", "c"], window=0.05, latency=0.5)
+    assert grouper.deadline() is None
+    for name, t in [("b", 10.02), ("a", 10.0), ("a", 10.03), ("c", 10.04), ("a", 20.0), ("b", 20.1)]:
+        grouper.add(NodeEvent(name, t, 0.0, None, 1.0, None))
+    first, = grouper.pop_ready(now=10.1)
+    # the first event of every node within the window, the second "a" is left
+    assert sorted((e.node, e.timestamp) for e in first) == [("a", 10.0), ("b", 10.02), ("c", 10.04)]
+    assert grouper.deadline() == pytest.approx(10.03 + 0.55)
+
+    assert grouper.pop_ready(now=10.5) == []
+    lone, = grouper.pop_ready(now=10.6)
+    assert [e.timestamp for e in lone] == [10.03]
+    # "b" triggered outside the window of "a"
+    assert [len(g) for g in grouper.pop_ready(now=21.0)] == [1, 1]
+    assert grouper.deadline() is None
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from rpa import (
+    distance_column_sums,
+    phasespace,
+    recurrence_column_sums,
+    rp_plot,
+    rp_sparse,
+    rpa_detection,
+    rqa,
+)
+
+
+def brute_force_rqa(RP, lmin, vmin):
+    """Recurrence rate, determinism and laminarity from explicit line runs."""
+    RP = np.asarray(RP, dtype=bool)
+    T = len(RP)
+    on_diagonal = np.zeros_like(RP)
+    for offset in range(-(T - 1), T):
+        i = np.arange(max(0, -offset), min(T, T - offset))
+        line = RP[i, i + offset]
+        start = 0
+        while start < len(line):
+            stop = start
+            while stop < len(line) and line[stop]:
+                stop += 1
+            if stop - start >= lmin:
+                on_diagonal[i[start:stop], i[start:stop] + offset] = True
+            start = stop + 1
+    on_vertical = np.zeros_like(RP)
+    for j in range(T):
+        column = RP[:, j]
+        start = 0
+        while start < T:
+            stop = start
+            while stop < T and column[stop]:
+                stop += 1
+            if stop - start >= vmin:
+                on_vertical[start:stop, j] = True
+            start = stop + 1
+    off = RP & ~np.eye(T, dtype=bool)
+    det = np.count_nonzero(on_diagonal & off) / np.count_nonzero(off) if off.any() else 0.0
+    return RP.sum() / T**2, det, np.count_nonzero(on_vertical) / RP.sum()
+
+
+def test_lines_do_not_wrap_across_rows():
+    RP = np.eye(6, dtype=int)
+    RP[0, 5] = RP[2, 0] = RP[5, 0] = 1
+    result = rqa(RP)
+    assert result.determinism == 0.0
+    assert np.allclose(result, brute_force_rqa(RP, 2, 2))
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("lmin, vmin", [(2, 2), (3, 2), (2, 4)])
+def test_rqa_matches_brute_force(seed, lmin, vmin):
+    rng = np.random.default_rng(seed)
+    RP = rng.random((12, 12)) < 0.35
+    RP = RP | RP.T | np.eye(12, dtype=bool)
+    assert np.allclose(rqa(RP.astype(int), lmin, vmin), brute_force_rqa(RP, lmin, vmin))
+
+
+def test_column_sums_match_the_dense_matrices():
+    signal = np.sin(np.linspace(0, 12, 300)) + np.random.default_rng(0).normal(0, 0.2, 300)
+    RP, DD = rp_plot(signal, 3, 2)
+    np.testing.assert_allclose(distance_column_sums(phasespace(signal, 3, 2)), DD.sum(axis=0))
+    np.testing.assert_array_equal(recurrence_column_sums(signal, 3, 2, block=64), RP.sum(axis=0))
+
+
+def test_rpa_detection_finds_the_delayed_onsets():
+    fs = 1000
+    sigs = np.random.default_rng(1).normal(0, 0.01, (4, 400))
+    for k, onset in enumerate((100, 110, 125, 95)):
+        sigs[k, onset:] += np.sin(np.arange(400 - onset) * 0.3)
+    *delays, curves = rpa_detection(sigs, fs)
+    assert curves.shape == (4, 398)
+    np.testing.assert_allclose(delays, np.array([-10, -25, 5]) / fs, atol=3 / fs)
+
+
+def test_sparse_recurrence_matrix_matches_the_dense_one():
+    signal = np.random.default_rng(2).normal(size=200)
+    RP, _ = rp_plot(signal, 3, 1, r=0.5)
+    sparse = rp_sparse(signal, 3, 1, r=0.5)
+    np.testing.assert_array_equal(sparse.toarray(), RP)
+    assert np.allclose(rqa(sparse), rqa(RP))
@@ -0,0 +1,50 @@
+import numpy as np
+
+from serial_protocol import AsciiDecoder, FrameDecoder, encode_frames
+
+
+def counts(n, start=0):
+    return (np.arange(4 * n, dtype=np.uint16) + start).reshape(n, 4).T % 1024
+
+
+def test_frames_split_at_any_byte_are_decoded_once():
+    data = encode_frames(counts(50)) + encode_frames(counts(1))[:2]
+    decoder = FrameDecoder()
+    out = [decoder.feed(data[i : i + 7]) for i in range(0, len(data), 7)]
+    samples = np.concatenate([s for s, _ in out], axis=1)
+    np.testing.assert_array_equal(samples, counts(50))
+    assert np.concatenate([q for _, q in out]).tolist() == list(range(50))
+    assert decoder.skipped_bytes == 0 and decoder.lost_frames == 0
+
+
+def test_resynchronises_after_lost_bytes():
+    frames = encode_frames(counts(20))
+    size = FrameDecoder().size
+    # garbage in front, and frame 5 loses three bytes
+    data = b"\x00\x5a\x13" + frames[: 5 * size + 4] + frames[6 * size :] + encode_frames(counts(1))[:2]
+    decoder = FrameDecoder()
+    samples, seq = decoder.feed(data)
+    assert seq.tolist() == [*range(5), *range(6, 20)]
+    np.testing.assert_array_equal(samples, np.delete(counts(20), 5, axis=1))
+    assert decoder.lost_frames == 1
+    assert decoder.skipped_bytes == 3 + 4
+
+
+def test_sequence_counter_wraps_without_lost_frames():
+    data = encode_frames(counts(12), start_seq=65530)
+    decoder = FrameDecoder()
+    _, first = decoder.feed(data[:60])
+    _, second = decoder.feed(data[60:] + encode_frames(counts(1), start_seq=6)[:2])
+    assert [*first, *second] == [*range(65530, 65536), *range(6)]
+    assert decoder.lost_frames == 0
+    # frames 6 to 9 are missing across the next call
+    decoder.feed(encode_frames(counts(3), start_seq=10))
+    assert decoder.lost_frames == 4
+
+
+def test_ascii_lines_keep_frame_markers_as_nan():
+    decoder = AsciiDecoder()
+    first = decoder.feed(b"#\r\n1.25\r\n2.")
+    second = decoder.feed(b"5\r\nbad\r\n")
+    np.testing.assert_array_equal(first, [np.nan, 1.25])
+    np.testing.assert_array_equal(second, [2.5])
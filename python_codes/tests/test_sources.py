@@ -0,0 +1,49 @@
+import io
+
+import numpy as np
+
+from acquisition import AcquisitionEngine
+from capture_archive import CaptureArchive
+from serial_protocol import encode_frames, volts_to_counts
+from sources import ReplaySource, SerialSource, SyntheticSource, synthetic_signals
+
+
+def read_all(source, blocks=None):
+    """Concatenate the blocks until the end of ``source``, or ``blocks`` reads of a port."""
+    reads = iter(source) if blocks is None else (source.read_block() for _ in range(blocks))
+    return np.concatenate(list(reads), axis=1)
+
+
+def test_synthetic_source_repeats_the_pattern_until_exhausted():
+    source = SyntheticSource(fs=1000, duration=0.3, total=1.0, block_frames=128)
+    samples = read_all(source)
+    pattern = np.round(synthetic_signals(1000, 0.3), 2)
+    assert samples.shape == (4, 1000)
+    np.testing.assert_array_equal(samples, np.tile(pattern, 4)[:, :1000])
+    assert source.read_block() is None
+
+
+def test_ascii_and_binary_ports_give_the_same_volts():
+    volts = np.round(synthetic_signals(1000, 0.2), 2)
+    counts = volts_to_counts(volts)
+    lines = "".join(f"{v:.2f}\r\n" for v in volts.T.ravel()).encode()
+    ascii_volts = read_all(SerialSource(io.BytesIO(lines), chunk_frames=16), blocks=20)
+    np.testing.assert_array_equal(ascii_volts, volts)
+    binary = SerialSource(io.BytesIO(encode_frames(counts) + encode_frames(counts[:, :1])[:2]), binary=True)
+    np.testing.assert_array_equal(volts_to_counts(read_all(binary, blocks=2)), counts)
+
+
+def test_replayed_captures_trigger_where_they_were_recorded(tmp_path):
+    archive = CaptureArchive(str(tmp_path / "captures"))
+    for trigger in (60, 90):
+        volts = np.full((4, 200), 0.5)
+        volts[1, trigger : trigger + 5] = 2.0
+        archive.append(volts, 1000, trigger)
+    source = ReplaySource(archive, gap=300, block_frames=64)
+    engine = AcquisitionEngine(source, pre=50, post=100)
+    while engine.poll():
+        pass
+    events = [engine.get_event(timeout=0) for _ in range(2)]
+    assert [e.start + e.trigger_index for e in events] == [300 + 60, 2 * 300 + 200 + 90]
+    np.testing.assert_array_equal(events[0].samples, archive.read(0).volts()[:, 10:160])
+    assert engine.fs == 1000 and engine.finished
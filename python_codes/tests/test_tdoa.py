@@ -0,0 +1,30 @@
+import numpy as np
+
+from tdoa import TdoaSolver
+
+MIC_X = [0, 0.17, 0.17, 0.72]
+MIC_Y = [0, 0, 0.85, 0.61]
+MIC_Z = [0, 0, 0, 0.13]
+
+
+def delays_of(solver, sources):
+    dist = np.linalg.norm(sources[:, None, :] - solver.mics[None, :, :], axis=2)
+    return (dist[:, :1] - dist[:, 1:]) / solver.v
+
+
+def test_noiseless_delays_are_solved_exactly():
+    solver = TdoaSolver(MIC_X, MIC_Y, MIC_Z)
+    sources = np.random.default_rng(0).uniform((-1, -1, 0), (2, 2, 2), (2000, 3))
+    solution = solver.solve(delays_of(solver, sources))
+    assert solution.converged.all()
+    assert solution.residuals.max() < 1e-6
+    # the others are the second intersection of the hyperboloids
+    error = np.linalg.norm(solution.positions - sources, axis=1)
+    assert (error < 0.01).mean() > 0.85
+
+
+def test_localize_returns_the_source():
+    solver = TdoaSolver(MIC_X, MIC_Y, MIC_Z)
+    source = np.array([[0.4, 0.3, 0.2]])
+    td = delays_of(solver, source)[0]
+    np.testing.assert_allclose(solver.localize(*td), source[0], atol=1e-6)
@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+import pywt
+
+from wavelet_analysis import SCALES, cwt_detection_curves
+
+
+@pytest.mark.parametrize("wavelet", ["morl", "cmor1.5-1.0"])
+def test_detection_curves_match_pywt(wavelet):
+    sigs = np.random.default_rng(0).normal(size=(2, 300))
+    scales = SCALES[::16]
+    expected = [np.abs(pywt.cwt(sig, scales, wavelet, method="conv")[0]).sum(axis=0) for sig in sigs]
+    curves = cwt_detection_curves(sigs, scales, wavelet, block=3)
+    np.testing.assert_allclose(curves, expected, rtol=1e-9, atol=1e-9)
+    single = cwt_detection_curves(sigs, scales, wavelet, dtype=np.float32)
+    assert single.dtype == np.float32
+    np.testing.assert_allclose(single, expected, rtol=1e-3)
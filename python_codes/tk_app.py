@@ -1,38 +1,69 @@
+import queue
+import threading
 import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import ttk, messagebox
+from typing import NamedTuple
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import matplotlib.pyplot as plt
-import serial
 import numpy as np
 
 
 
-from compute_correlation import corelatia
-from tdoa import tdoa
+import metrics
+from tdoa import TdoaSolver
 from db_logger import log_event
-from data_visualization import plot_3d_coordinates
-from wavelet_analysis import wavelet_detection
-from rpa import rpa_detection
-from dpe import dpe_detection
-from compute_spectogram import spectrogram
-
+from capture_archive import CaptureArchive
+from data_visualization import LivePlot, plot_3d_coordinates
+from compute_spectogram import plot_spectrogram, spectrogram_batch
+from serial_protocol import CHANNELS, FRAME_MARKER, FrameDecoder, counts_to_volts, read_frames
+from deinterleave import as_channels, deinterleave
+from detectors import available, get_detector
+from srp_phat import CACHE_DIR as SRP_CACHE_DIR
+from sources import SyntheticSource, synthetic_signals
+from acquisition import AcquisitionEngine
+
+# Microphone coordinates in metres, microphone 1 is the reference
+MIC_X = [0, 0.17, 0.17, 0.72]
+MIC_Y = [0, 0, 0.85, 0.61]
+MIC_Z = [0, 0, 0, 0.13]
+
+
+def read_signals(port="COM6", baud=115200, threshold=1.75, iterations=50, binary=False):
+    """Read data from the serial port until a threshold is exceeded.
+
+    With ``binary=True`` the microcontroller is expected to send binary frames
+    (see :mod:`serial_protocol`) which are read and decoded in bulk.  The
+    samples are returned channel-interleaved in both modes.
+    """
 
-def read_signals(port="COM6", baud=115200, threshold=1.75, iterations=50):
-    """Read data from the serial port until a threshold is exceeded."""
+    import serial
 
     ser = serial.Serial(port, baudrate=baud)
+    if binary:
+        try:
+            return _read_frames_until_trigger(ser, threshold, iterations)
+        finally:
+            ser.close()
+    marker = FRAME_MARKER.decode()
     data = []
     try:
         while True:
             line = ser.readline().decode("ascii", errors="ignore").strip()
             if not line:
                 continue
+            if line == marker:
+                # kept as NaN so ``deinterleave`` can find the channel phase
+                data.append(float("nan"))
+                continue
             data.append(float(line))
             if line.replace(".", "", 1).isdigit() and float(line) > threshold:
                 for _ in range(iterations):
                     line = ser.readline().decode("ascii", errors="ignore").strip()
 
-                    if line:
+                    if line == marker:
+                        data.append(float("nan"))
+                    elif line:
                         data.append(float(line))
                 break
     finally:
@@ -40,6 +71,23 @@ def read_signals(port="COM6", baud=115200, threshold=1.75, iterations=50):
     return data
 
 
+def _read_frames_until_trigger(ser, threshold, iterations):
+    decoder = FrameDecoder()
+    blocks = []
+    # ``iterations`` counts samples (lines) after the trigger, as in ASCII mode
+    post = -(-iterations // CHANNELS)
+    while True:
+        volts = counts_to_volts(read_frames(ser, decoder, 1))
+        blocks.append(volts)
+        hits = np.flatnonzero((volts > threshold).any(axis=0))
+        if len(hits):
+            missing = post - (volts.shape[1] - hits[0] - 1)
+            if missing > 0:
+                blocks.append(counts_to_volts(read_frames(ser, decoder, missing)))
+            break
+    return np.concatenate(blocks, axis=1).T.ravel().tolist()
+
+
 def simulate_signals(
     fs: int = 1000,
     duration: float = 2.0,
@@ -52,15 +100,7 @@ def simulate_signals(
     would produce when receiving data from the microcontroller.
     """
 
-    t = np.arange(0.0, duration, 1.0 / fs)
-    base = np.sin(2 * np.pi * freq * t)
-    sigs = []
-    for d in delays:
-        shift = int(round(d * fs))
-        sig = np.roll(base, shift)
-        voltage = np.clip(1.65 + 1.65 * sig, 0, 3.3)
-        sigs.append(voltage)
-    sigs = np.array(sigs)
+    sigs = synthetic_signals(fs, duration, freq, delays)
 
     data = []
     for i in range(sigs.shape[1]):
@@ -69,10 +109,71 @@ def simulate_signals(
     return data
 
 
+class ProcessedEvent(NamedTuple):
+    """Result of processing one capture, handed from a worker to the window.
+
+    Attributes
+    ----------
+    method : str
+        Algorithm used.
+    sigs : numpy.ndarray
+        ``(channels, N)`` samples of the capture.
+    fs : float
+        Sampling frequency in Hz.
+    coords : tuple
+        Estimated ``(x, y, z)`` of the source.
+    curves : numpy.ndarray or None
+        Detection curves of the method, see :class:`detectors.DetectionResult`.
+    spectrogram : tuple
+        ``(f, t, Sxx)`` of all channels, see :func:`spectrogram_batch`.
+    """
+
+    method: str
+    sigs: np.ndarray
+    fs: float
+    coords: tuple
+    curves: object
+    spectrogram: tuple
+
+
 class App:
-    def __init__(self, master):
+    """Main window.
+
+    ``source`` is the :class:`sources.SampleSource` captures are taken from,
+    the synthetic signals of the simulator by default.  With ``archive``, or
+    once "Archive captures" is ticked, the raw samples of every event are
+    kept in a :class:`CaptureArchive`.
+
+    Acquisition runs in the :class:`AcquisitionEngine` reader thread and
+    every triggered capture is processed in a pool of ``workers`` threads,
+    so several events can be in flight while the window stays responsive.
+    Results come back through a queue polled from the Tk event loop; only
+    the main thread touches Tk and matplotlib.
+    """
+
+    POLL_MS = 50
+
+    def __init__(self, master, source=None, archive=False, workers=2):
         self.master = master
+        self.source = SyntheticSource(speed=1.0) if source is None else source
+        self.engine = AcquisitionEngine(self.source)
         self.master.title("Sound Source Localization")
+        self.solver = TdoaSolver(MIC_X, MIC_Y, MIC_Z)
+        self.detectors = {}
+        # opened on first use, and only used while ``archive_var`` is set
+        self._archive = None
+        self.archive = None
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="processing")
+        # at most two captures per worker wait for processing
+        self._slots = threading.BoundedSemaphore(2 * workers)
+        self.results = queue.Queue()
+        self._cancel = threading.Event()
+        self._dispatcher = None
+        self._busy = False
+        self._futures = []
+        self._run = 0
+        self.processed = 0
+        self.rejected = 0
 
         ctrl = ttk.Frame(master)
         ctrl.pack(side=tk.TOP, fill=tk.X)
@@ -80,10 +181,22 @@ class App:
         ttk.Label(ctrl, text="Algorithm:").pack(side=tk.LEFT, padx=5)
 
         self.algorithm_var = tk.StringVar(value="correlation")
-        options = ["correlation", "wavelet", "rpa", "dpe"]
-        ttk.OptionMenu(ctrl, self.algorithm_var, options[0], *options).pack(side=tk.LEFT)
-
-        ttk.Button(ctrl, text="Start Acquisition", command=self.start_acquisition).pack(side=tk.LEFT, padx=10)
+        options = available()
+        ttk.OptionMenu(ctrl, self.algorithm_var, self.algorithm_var.get(), *options).pack(side=tk.LEFT)
+
+        self.start_button = ttk.Button(ctrl, text="Start Acquisition", command=self.start_acquisition)
+        self.start_button.pack(side=tk.LEFT, padx=10)
+        self.stop_button = ttk.Button(ctrl, text="Stop", command=self.stop_acquisition, state=tk.DISABLED)
+        self.stop_button.pack(side=tk.LEFT)
+        self.archive_var = tk.BooleanVar(value=archive)
+        ttk.Checkbutton(
+            ctrl, text="Archive captures", variable=self.archive_var, command=self._toggle_archive
+        ).pack(side=tk.LEFT, padx=10)
+        self._toggle_archive()
+        self.busy = ttk.Progressbar(ctrl, mode="indeterminate", length=100)
+        self.busy.pack(side=tk.LEFT, padx=10)
+        self.status_var = tk.StringVar(value="Idle")
+        ttk.Label(ctrl, textvariable=self.status_var).pack(side=tk.LEFT)
 
         self.nb = ttk.Notebook(master)
         self.nb.pack(fill=tk.BOTH, expand=True)
@@ -105,6 +218,7 @@ class App:
         self.fig_time, self.ax_time = plt.subplots(4, 1, figsize=(5, 4))
         self.canvas_time = FigureCanvasTkAgg(self.fig_time, master=self.time_tab)
         self.canvas_time.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.time_plot = LivePlot(self.ax_time, window=self.engine.pre + self.engine.post)
 
         self.fig_spec, self.ax_spec = plt.subplots(2, 2, figsize=(5, 4))
         self.canvas_spec = FigureCanvasTkAgg(self.fig_spec, master=self.spec_tab)
@@ -127,60 +241,199 @@ class App:
         self.canvas_loc = FigureCanvasTkAgg(self.fig_loc, master=self.loc_tab)
         self.canvas_loc.get_tk_widget().pack(fill=tk.BOTH, expand=True)
 
+        self.master.protocol("WM_DELETE_WINDOW", self.close)
+        self.master.after(self.POLL_MS, self._poll_results)
+
+    @property
+    def running(self):
+        return self._dispatcher is not None and self._dispatcher.is_alive()
+
     def start_acquisition(self):
+        """Start acquiring and processing captures until :meth:`stop_acquisition`."""
+        if self.running:
+            return
         try:
-            data = simulate_signals()
-            fs = 1000  # sampling frequency placeholder
-            method = self.algorithm_var.get()
-            amp, xs, ys, zs, sigs = self.process_signals(data, fs, method)
-            log_event(amp, xs, ys, zs)
-            self.update_plots(sigs, fs, method, (xs, ys, zs))
-        except Exception as exc:
+            self.engine.start()
+        except RuntimeError as exc:
             messagebox.showerror("Error", str(exc))
+            return
+        self._cancel.clear()
+        self._run += 1
+        self._dispatcher = threading.Thread(
+            target=self._dispatch, args=(self._run, self.algorithm_var.get()), name="dispatcher", daemon=True
+        )
+        self._dispatcher.start()
+        self.start_button.config(state=tk.DISABLED)
+        self.stop_button.config(state=tk.NORMAL)
+
+    def stop_acquisition(self):
+        """Stop acquiring; captures not being processed yet are dropped."""
+        self._cancel.set()
+        self.engine.stop()
+        if self._dispatcher is not None:
+            # it notices the cancellation within its 0.1 s polling period
+            self._dispatcher.join(1.0)
+            self._dispatcher = None
+        for future in self._futures:
+            future.cancel()
+        # results of the cancelled run still in flight are ignored
+        self._run += 1
+        self.start_button.config(state=tk.NORMAL)
+        self.stop_button.config(state=tk.DISABLED)
+
+    def _toggle_archive(self):
+        """Start or stop keeping the raw samples of the events."""
+        if self.archive_var.get():
+            if self._archive is None:
+                self._archive = CaptureArchive()
+            self.archive = self._archive
+        else:
+            self.archive = None
+
+    def close(self):
+        self.stop_acquisition()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.master.destroy()
+
+    def _dispatch(self, run, method):
+        """Hand every triggered capture to the worker pool (dispatcher thread)."""
+        while not self._cancel.is_set():
+            event = self.engine.get_event(timeout=0.1)
+            if event is None:
+                if self.engine.error is not None:
+                    self.results.put((run, self.engine.error))
+                    return
+                if self.engine.finished and self.engine.events.empty():
+                    self.results.put((run, RuntimeError("The sample source is exhausted")))
+                    return
+                continue
+            # wait for a free slot, so captures queue up in the engine
+            # (which drops the oldest) rather than here
+            while not self._slots.acquire(timeout=0.1):
+                if self._cancel.is_set():
+                    return
+            future = self.executor.submit(self._process_event, run, event, method)
+            future.add_done_callback(lambda _: self._slots.release())
+            self._futures = [f for f in self._futures if not f.done()] + [future]
+
+    def _process_event(self, run, event, method):
+        """Detect, localize, archive and log one capture (worker thread)."""
+        try:
+            fs = self.engine.fs
+            sigs = as_channels(event.samples)
+            coords, curves = self._detect(sigs, fs, method)
+            if coords is None:
+                # not worth localizing, see ``detectors.CascadeDetector``
+                self.results.put((run, None))
+                return
+            capture_id = None
+            archive = self.archive
+            if archive is not None:
+                capture_id = archive.append(
+                    sigs, fs, event.trigger_index, np.column_stack((MIC_X, MIC_Y, MIC_Z)), event.timestamp
+                )
+            log_event(float(sigs[-1, -1]), *coords, capture_id=capture_id)
+            result = ProcessedEvent(method, sigs, fs, coords, curves, spectrogram_batch(sigs, fs))
+        except Exception as exc:  # shown by the main thread
+            result = exc
+        self.results.put((run, result))
+
+    def _poll_results(self):
+        latest = None
+        try:
+            while True:
+                run, result = self.results.get_nowait()
+                if run != self._run:
+                    continue
+                if result is None:
+                    self.rejected += 1
+                    continue
+                if isinstance(result, Exception):
+                    self.stop_acquisition()
+                    messagebox.showerror("Error", str(result))
+                    continue
+                self.processed += 1
+                latest = result
+        except queue.Empty:
+            pass
+        # several results may arrive between two polls; only the last is drawn
+        if latest is not None:
+            self.update_plots(latest)
+        busy = self.running or any(not f.done() for f in self._futures)
+        # starting the progress bar again on every poll would restart its timer
+        if busy and not self._busy:
+            self.busy.start(10)
+        elif self._busy and not busy:
+            self.busy.stop()
+        self._busy = busy
+        state = "Running" if self.running else "Idle"
+        self.status_var.set(
+            f"{state} - {self.processed} events, {self.rejected} rejected, "
+            f"{self.engine.dropped_events} dropped"
+        )
+        self.master.after(self.POLL_MS, self._poll_results)
+
+    def _detect(self, sigs, fs, method):
+        """Return ``((x, y, z), curves)`` of a capture; safe to call from any thread.
+
+        The coordinates are ``None`` if the detector rejected the capture.
+        """
+        detector = self.detectors.get(method)
+        if detector is None:
+            # detectors keep per-capture-length caches, so they are reused
+            geometry = np.column_stack((MIC_X, MIC_Y, MIC_Z))
+            # the GUI keeps the SRP steering tables between sessions
+            params = {"cache_dir": SRP_CACHE_DIR} if method == "srp" else {}
+            detector = self.detectors.setdefault(method, get_detector(method, geometry, **params))
+        result = detector.detect(sigs, fs)
+        if result.rejected:
+            return None, result.curves
+        if result.position is not None:
+            # searched directly on a grid, no delays to solve for
+            return tuple(result.position), result.curves
+        with metrics.stage("tdoa"):
+            return self.solver.localize(*result.delays), result.curves
 
     def process_signals(self, signals, fs, method):
-        s1, s2, s3, s4 = [], [], [], []
-        for i in range(len(signals) - 3):
-            s4.append(signals[i])
-            s1.append(signals[i + 1])
-            s2.append(signals[i + 2])
-            s3.append(signals[i + 3])
-        if method == "correlation":
-            td1, td2, td3 = corelatia(s1, s2, s3, s4, fs)
-        elif method == "wavelet":
-            td1, td2, td3, _ = wavelet_detection(s1, s2, s3, s4, fs, show=False, axes=self.ax_wave)
-        elif method == "rpa":
-            td1, td2, td3, _ = rpa_detection(s1, s2, s3, s4, fs, axes=self.ax_rpa)
-        elif method == "dpe":
-            td1, td2, td3 = dpe_detection(s1, s2, s3, s4, fs)
-        else:
-            raise ValueError(f"Unknown method: {method}")
-        xs, ys, zs = tdoa(td1, td2, td3, [0, 0.17, 0.17, 0.72], [0, 0, 0.85, 0.61], [0, 0, 0, 0.13])
-        return float(signals[-1]), xs, ys, zs, (s1, s2, s3, s4)
-
-    def update_plots(self, sigs, fs, method, coords):
-        s1, s2, s3, s4 = sigs
-        for ax, sig in zip(self.ax_time, [s1, s2, s3, s4]):
-            ax.clear()
-            ax.plot(sig)
-        self.canvas_time.draw()
-
-        spectrogram(s1, s2, s3, s4, fs, axes=self.ax_spec, show=False)
-        self.canvas_spec.draw()
-
-        if method == "wavelet":
-            self.canvas_wave.draw()
-        elif method == "rpa":
-            self.canvas_rpa.draw()
-
-        x, y, z = coords
+        # interleaved samples as read by ``read_signals``, or a sample matrix
+        sigs = as_channels(signals) if np.ndim(signals) == 2 else deinterleave(signals)
+        coords, _ = self._detect(sigs, fs, method)
+        xs, ys, zs = (np.nan,) * 3 if coords is None else coords
+        return float(sigs[-1, -1]), xs, ys, zs, sigs
+
+    def update_plots(self, result):
+        """Draw a :class:`ProcessedEvent`; main thread only."""
+        self.time_plot.set(result.sigs)
+        self.time_plot.refresh(force=True)
+
+        plot_spectrogram(self.ax_spec, *result.spectrogram)
+        self.canvas_spec.draw_idle()
+
+        if result.method in ("wavelet", "rpa"):
+            axs = self.ax_wave if result.method == "wavelet" else self.ax_rpa
+            for k, (ax, curve) in enumerate(zip(axs.flat, result.curves)):
+                ax.clear()
+                ax.plot(curve)
+                ax.set_title(f"Detection curve {k + 1}")
+                ax.set(xlabel="Samples", ylabel="Amplitude")
+            (self.canvas_wave if result.method == "wavelet" else self.canvas_rpa).draw_idle()
+
+        x, y, z = result.coords
         self.ax_loc.clear()
-        plot_3d_coordinates(x, y, z)
-        self.canvas_loc.draw()
+        plot_3d_coordinates(x, y, z, ax=self.ax_loc)
+        self.canvas_loc.draw_idle()
 
 
 if __name__ == "__main__":
+    import sys
+
+    from sources import ReplaySource
+
+    # ``python tk_app.py captures/`` replays an archive instead of simulating
     root = tk.Tk()
-    app = App(root)
+    if len(sys.argv) > 1:
+        app = App(root, ReplaySource(sys.argv[1], gap=200, speed=1.0))
+    else:
+        app = App(root)
     root.mainloop()
 
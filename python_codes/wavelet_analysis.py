@@ -1,26 +1,117 @@
+import inspect
+from functools import lru_cache
+
 import numpy as np
-import matplotlib.pyplot as plt
-import pywt
+
+from deinterleave import as_channels
+
+# Scales of the MATLAB script: 2**(64/64) .. 2**(256/64) in 1/64 octave steps
+A0 = 2 ** (1 / 64)
+SCALES = A0 ** np.arange(64, 4 * 64 + 1)
+
+
+@lru_cache(maxsize=None)
+def _precision():
+    """Wavelet sampling used by ``pywt.cwt``; the default differs between releases."""
+    import pywt
+
+    return getattr(inspect.signature(pywt.cwt).parameters.get("precision"), "default", 10)
+
+
+@lru_cache(maxsize=4)
+def _filter_bank(wavelet, scales, n, dtype):
+    """Return ``(bank, nfft)`` reproducing ``pywt.cwt(..., method='conv')``.
+
+    Row ``k`` of ``bank`` is the spectrum of the filter applied at
+    ``scales[k]``.  Only the part of each (very long) scaled wavelet that
+    reaches the ``n`` retained output samples is kept, the output alignment,
+    the ``diff`` and the ``-sqrt(scale)`` factor of :func:`pywt.cwt` are
+    folded in, so that all scales share one FFT length and
+    ``irfft(rfft(x) * bank[k])[:n]`` is the coefficient row of scale ``k``.
+    The bank does not depend on the sampling frequency.
+    """
+    import pywt
+    from scipy import fft
+
+    cw = pywt.ContinuousWavelet(wavelet)
+    int_psi, x = pywt.integrate_wavelet(cw, precision=_precision())
+    int_psi = np.conj(int_psi) if cw.complex_cwt else np.real(int_psi)
+    step = x[1] - x[0]
+
+    filters = []
+    for scale in scales:
+        j = (np.arange(scale * (x[-1] - x[0]) + 1) / (scale * step)).astype(int)
+        h = int_psi[j[j < int_psi.size]][::-1]
+        # pywt keeps coefficients floor(d) .. floor(d) + n of diff(conv)
+        first = int(np.floor((h.size - 2) / 2))
+        lo = max(0, first - n + 1)
+        hi = min(h.size, first + n + 1)
+        filters.append((np.sqrt(scale), h[lo:hi], first - lo))
+
+    nfft = fft.next_fast_len(n + max(f[1].size for f in filters), real=not cw.complex_cwt)
+    transform = fft.fft if cw.complex_cwt else fft.rfft
+    freqs = np.arange(nfft if cw.complex_cwt else nfft // 2 + 1)
+    omega = 2 * np.pi * freqs / nfft
+    bank = np.empty((len(scales), freqs.size), dtype=np.result_type(dtype, np.complex64))
+    for k, (gain, h, shift) in enumerate(filters):
+        # roll by ``shift`` and take the forward difference, in frequency
+        spec = transform(h, nfft) * np.exp(1j * omega * shift)
+        bank[k] = -gain * (np.exp(1j * omega) - 1) * spec
+    bank.setflags(write=False)
+    return bank, nfft
+
+
+def cwt_detection_curves(sigs, scales=SCALES, wavelet="morl", dtype=np.float64, block=16):
+    """Return ``sum(abs(pywt.cwt(sig, scales, wavelet)[0]), axis=0)`` per channel.
+
+    All channels are transformed together with one FFT; the coefficients
+    are computed ``block`` scales at a time and accumulated immediately, so
+    the full ``(scales, N)`` coefficient arrays are never held in memory.
+    The filter bank is cached per ``(wavelet, scales, N, dtype)``.  Use
+    ``dtype=np.float32`` for single precision.
+    """
+    sigs = as_channels(sigs).astype(dtype, copy=False)
+    bank, nfft = filter_bank(sigs.shape[1], scales, wavelet, dtype)
+    return apply_filter_bank(sigs, bank, nfft, block)
+
+
+def filter_bank(n, scales=SCALES, wavelet="morl", dtype=np.float64):
+    """Return the cached ``(bank, nfft)`` for captures of ``n`` samples."""
+    return _filter_bank(wavelet, tuple(np.asarray(scales, dtype=float)), n, np.dtype(dtype))
+
+
+def apply_filter_bank(sigs, bank, nfft, block=16):
+    """Return the detection curves of ``(channels, N)`` samples with a :func:`filter_bank`."""
+    from scipy import fft
+
+    n = sigs.shape[1]
+    cplx = bank.shape[1] == nfft
+    spec = (fft.fft if cplx else fft.rfft)(sigs, nfft, axis=-1)
+    inverse = fft.ifft if cplx else fft.irfft
+    det = np.zeros(sigs.shape, dtype=sigs.dtype)
+    for start in range(0, len(bank), block):
+        prod = spec[None, :, :] * bank[start : start + block, None, :]
+        coef = inverse(prod, nfft, axis=-1)[..., :n]
+        det += np.abs(coef).sum(axis=0)
+    return det
 
 
 def wavelet_detection(
-    s1,
-    s2,
-    s3,
-    s4,
+    sigs,
     fs,
     threshold=0.6,
     wavelet="morl",
     show=True,
     axes=None,
+    dtype=np.float64,
 ):
 
     """Detect events using a wavelet-based method similar to MATLAB wavelet_s.m.
 
     Parameters
     ----------
-    s1, s2, s3, s4 : array_like
-        Signals from the four microphones.
+    sigs : array_like
+        ``(channels, N)`` matrix with the signals from the four microphones.
     fs : int or float
         Sampling frequency in Hz.
     threshold : float, optional
@@ -30,59 +121,34 @@ def wavelet_detection(
         ``'morl'``.
     show : bool, optional
         If True, plot the detection curves.
+    dtype : numpy dtype, optional
+        ``np.float32`` computes the transform in single precision.
 
     Returns
     -------
-    tuple of float
-        Estimated TDOA values ``(td12, td13, td14)`` in seconds.
+    tuple
+        Estimated TDOA values ``(td12, td13, td14)`` in seconds followed by
+        the ``(channels, N)`` array of detection curves.
     """
-    a0 = 2 ** (1 / 64)
-    scales = a0 ** np.arange(64, 4 * 64 + 1)
+    sigs = as_channels(sigs)
+    dets = cwt_detection_curves(sigs, SCALES, wavelet, dtype)
 
-    # ensure numpy arrays for ``pywt.cwt``
-    s1 = np.asarray(s1)
-    s2 = np.asarray(s2)
-    s3 = np.asarray(s3)
-    s4 = np.asarray(s4)
-
-    cw = pywt.ContinuousWavelet(wavelet)
-
-    coeffs1, _ = pywt.cwt(s1, scales, cw, 1 / fs)
-    coeffs2, _ = pywt.cwt(s2, scales, cw, 1 / fs)
-    coeffs3, _ = pywt.cwt(s3, scales, cw, 1 / fs)
-    coeffs4, _ = pywt.cwt(s4, scales, cw, 1 / fs)
-
-    det1 = np.sum(np.abs(coeffs1), axis=0)
-    det2 = np.sum(np.abs(coeffs2), axis=0)
-    det3 = np.sum(np.abs(coeffs3), axis=0)
-    det4 = np.sum(np.abs(coeffs4), axis=0)
-
-    idx1 = np.argmax(det1 > threshold * det1.max())
-    idx2 = np.argmax(det2 > threshold * det2.max())
-    idx3 = np.argmax(det3 > threshold * det3.max())
-    idx4 = np.argmax(det4 > threshold * det4.max())
-
-    t1 = idx1 / fs
-    t2 = idx2 / fs
-    t3 = idx3 / fs
-    t4 = idx4 / fs
+    idx = np.argmax(dets > threshold * dets.max(axis=1, keepdims=True), axis=1)
+    t1, t2, t3, t4 = idx / fs
 
     if axes is not None:
         axs = axes
     elif show:
+        import matplotlib.pyplot as plt
+
         fig, axs = plt.subplots(2, 2)
     else:
         axs = None
 
     if axs is not None:
-        axs[0, 0].plot(det1)
-        axs[0, 0].set_title("Detection curve 1")
-        axs[0, 1].plot(det2)
-        axs[0, 1].set_title("Detection curve 2")
-        axs[1, 0].plot(det3)
-        axs[1, 0].set_title("Detection curve 3")
-        axs[1, 1].plot(det4)
-        axs[1, 1].set_title("Detection curve 4")
+        for k, (ax, det) in enumerate(zip(axs.flat, dets)):
+            ax.plot(det)
+            ax.set_title(f"Detection curve {k + 1}")
         for ax in axs.flat:
             ax.set(xlabel="Samples", ylabel="Amplitude")
         if show and axes is None:
@@ -93,4 +159,4 @@ def wavelet_detection(
     td12 = t1 - t2
     td13 = t1 - t3
     td14 = t1 - t4
-    return td12, td13, td14, (det1, det2, det3, det4)
+    return td12, td13, td14, dets